@@ -1,15 +1,53 @@
-from fastapi import FastAPI, UploadFile, File
+import asyncio
+import json
+import os
+import time
+from fastapi import FastAPI, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from backend.models.schemas import QueryRequest, QueryResponse, ReportSummaryResponse, ReportQuestionRequest, ReportQuestionResponse, ReportExplanationRequest, ReportExplanationResponse
-from backend.services.pubmed_service import fetch_pubmed
-from backend.services.retrieval_service import hybrid_retrieve
-from backend.services.reranker_service import rerank
+from backend.services.pipeline_service import run_ask_pipeline, article_cache
+from backend.services.reranker_service import rerank_scores
+from backend.services.score_memo_service import query_embeddings
 from backend.services.llm_service import generate_answer
-from backend.services.report_parser_service import extract_report_text, extract_key_sections
-from backend.services.report_summarizer_service import summarize_report, answer_report_question, explain_medical_term
+from backend.services.extractive_service import extractive_answer
+from backend.services.corpus_service import search_local_corpus
+from backend.services.metadata_filter_service import FILTER_FIELDS, normalize_filters
+from backend.services.report_cache_service import spool_upload, UploadLimitMiddleware
+from backend.services.report_session_service import report_sessions
+from backend.services.report_job_service import process_report, report_jobs, ReportJobNotFound, ReportJobQueueFull
+from backend.services.glossary_service import get_glossary
+from backend.services.conversation_service import conversations, embed_question, ConversationNotFound
+from backend.services.deadline_service import Deadline, DEADLINE_HEADER, allows
+from backend.services.admission_service import (
+    admission, client_keys, trusted_frontend, AdmissionRejected, CLIENT_ID_HEADER, FRONTEND_SECRET_HEADER,
+    INTERACTIVE, CONVERSATIONAL, BATCH
+)
+from backend.services.profiling_service import (
+    ProfileMiddleware, ProfileNotFound, profiles, sampled, admin_authorized, to_collapsed, to_speedscope,
+    ADMIN_TOKEN_HEADER
+)
+from backend.services.tracing_service import TracingMiddleware, TRACEPARENT_HEADER, stats as tracing_stats
+from backend.services.capture_service import CaptureMiddleware, stats as capture_stats
+from backend.services.report_summarizer_service import answer_report_question, explain_medical_term
 
 app = FastAPI(title="AutoMedRAG API", description="Medical Document Retrieval and Analysis System")
 
+# Refuse oversized uploads while they stream in, before they are spooled
+app.add_middleware(UploadLimitMiddleware, paths=["/summarize-report", "/jobs/summarize-report"])
+
+# Anonymized traffic capture (CAPTURE_ENABLED) for benchmarks/replay_traffic.py
+app.add_middleware(CaptureMiddleware, paths=["/ask", "/summarize-report", "/jobs/summarize-report",
+                                             "/report-question", "/explain-term"])
+
+# Opt-in sampling profiles (X-Profile: 1 plus X-Admin-Token) of the heavy endpoints
+app.add_middleware(ProfileMiddleware, paths=["/ask", "/summarize-report", "/report-question", "/explain-term"])
+
+# Request traces (TRACING_ENABLED), continuing the caller's traceparent header
+app.add_middleware(TracingMiddleware, paths=["/ask", "/summarize-report", "/jobs/summarize-report",
+                                             "/report-question", "/explain-term"])
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -17,6 +55,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", TRACEPARENT_HEADER],
 )
 
 @app.get("/")
@@ -27,111 +66,379 @@ def root():
         "version": "1.0.0"
     }
 
+def _admit(http_request: Request, endpoint: str, priority: str, deadline: Deadline = None):
+    """Admission ticket for a request (raises AdmissionRejected)"""
+    clients = client_keys(http_request.client.host if http_request.client else None,
+                          http_request.headers.get("x-forwarded-for"),
+                          http_request.headers.get(CLIENT_ID_HEADER) if CLIENT_ID_HEADER else None,
+                          trusted_frontend(http_request.headers.get(FRONTEND_SECRET_HEADER)))
+    deadline = deadline or Deadline.from_header(http_request.headers.get(DEADLINE_HEADER))
+    return admission.admit(endpoint, priority, clients, deadline.remaining())
+
+
+def _shed_response(e: AdmissionRejected):
+    return JSONResponse(status_code=e.status_code, headers={"Retry-After": str(e.retry_after)},
+                        content={"error": str(e), "status": "rejected", "reason": e.reason})
+
+
+async def _run_admitted(ticket, func, *args, **kwargs):
+    """Run an admitted request's blocking work off the event loop, then release its ticket"""
+    def work():
+        ticket.start()
+        with sampled(func.__name__):
+            return func(*args, **kwargs)
+    try:
+        return await run_in_threadpool(work)
+    finally:
+        ticket.release()
+
+
+@app.get("/admission/stats")
+def admission_stats():
+    """In-flight requests, service-time estimates and admitted/shed counts per class"""
+    return admission.stats()
+
+
+@app.get("/tracing/stats")
+def tracing_statistics():
+    """Kept, dropped and exported traces"""
+    return tracing_stats()
+
+
+@app.get("/capture/stats")
+def capture_statistics():
+    """Captured and dropped request records"""
+    return capture_stats()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit rates of the memoized model layers"""
+    return {
+        "query_embeddings": query_embeddings.stats(),
+        "article_embeddings": article_cache.stats(),
+        "rerank_scores": rerank_scores.stats(),
+    }
+
+
+def _admin_forbidden(http_request: Request):
+    """403 response unless the request carries the admin token"""
+    if admin_authorized(http_request.headers.get(ADMIN_TOKEN_HEADER)):
+        return None
+    return JSONResponse(status_code=403, content={"error": f"Requires a valid {ADMIN_TOKEN_HEADER}", "status": "error"})
+
+
+@app.get("/debug/profiles")
+def list_profiles(http_request: Request):
+    """Stored request profiles, newest first"""
+    forbidden = _admin_forbidden(http_request)
+    if forbidden is not None:
+        return forbidden
+    return {"profiles": profiles.list()}
+
+
+@app.get("/debug/profiles/{profile_id}")
+def get_profile(profile_id: str, http_request: Request, format: str = "speedscope"):
+    """A request profile as speedscope JSON, or as collapsed stacks with format=collapsed"""
+    forbidden = _admin_forbidden(http_request)
+    if forbidden is not None:
+        return forbidden
+    try:
+        data = profiles.get(profile_id)
+    except ProfileNotFound as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "status": "error"})
+    if format == "collapsed":
+        return PlainTextResponse(to_collapsed(data))
+    return to_speedscope(data)
+
+
+@app.post("/sessions")
+def create_conversation():
+    """Start a conversation; pass its session_id to /ask instead of the history"""
+    conversation = conversations.create()
+    return {"session_id": conversation.session_id, "ttl": conversations.ttl}
+
+
+@app.get("/sessions/{session_id}")
+def get_conversation(session_id: str):
+    """Turns (with condensed answers) and cached candidates of a conversation"""
+    try:
+        return conversations.get(session_id).to_dict()
+    except ConversationNotFound as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "status": "error"})
+
+
+@app.delete("/sessions/{session_id}")
+def delete_conversation(session_id: str):
+    try:
+        conversations.delete(session_id)
+        return {"session_id": session_id, "status": "deleted"}
+    except ConversationNotFound as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "status": "error"})
+
+
+def _history_context(history) -> str:
+    """Context from a client-sent history (requests without a session_id)"""
+    context = ""
+    if history and len(history) > 0:
+        # Get last 2 exchanges for context
+        recent_history = history[-4:]  # Last 2 Q&A pairs
+        for msg in recent_history:
+            if msg.role == "user":
+                context += f"Previous question: {msg.content}\n"
+            else:
+                context += f"Previous answer: {msg.content}\n"
+    return context
+
+
 @app.post("/ask", response_model=QueryResponse)
-async def ask_question(request: QueryRequest):
+async def ask_question(request: QueryRequest, http_request: Request):
     """
     Retrieve and analyze medical papers for a given question.
     
     - Fetches relevant papers from PubMed
     - Performs hybrid retrieval (semantic + keyword)
     - Re-ranks results for relevance
-    - Generates an evidence-based answer
-    - Supports conversation history for contextual understanding
+    - Generates an evidence-based answer (mode="fast": cited sentences
+      extracted from the abstracts, no LLM call)
+    - Supports conversations: a session_id from /sessions (or the history)
+    - Answers within the X-Request-Deadline-Ms budget, degrading stages
+      (listed in degradations) rather than timing out
+    - Refuses at once (429/503 + Retry-After) when it could not start in time
     """
+    deadline = Deadline.from_header(http_request.headers.get(DEADLINE_HEADER))
     try:
-        # Build context from conversation history
-        context = ""
-        if request.history and len(request.history) > 0:
-            # Get last 2 exchanges for context
-            recent_history = request.history[-4:]  # Last 2 Q&A pairs
-            for msg in recent_history:
-                if msg.role == "user":
-                    context += f"Previous question: {msg.content}\n"
-                else:
-                    context += f"Previous answer: {msg.content}\n"
-        
-        # Enhance the question with context if available
-        enhanced_question = request.question
-        if context:
-            enhanced_question = f"Context: {context}\nNew question: {request.question}"
-        
-        # Fetch papers from PubMed (use original question for API)
-        papers = fetch_pubmed(request.question)
+        conversation = conversations.get(request.session_id) if request.session_id else None
+    except ConversationNotFound as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "status": "error"})
+
+    # A conversation's opening question is as urgent as a one-off one
+    follow_up = (conversation is not None and conversation.turn_count > 0) or bool(request.history)
+    priority = CONVERSATIONAL if follow_up else INTERACTIVE
+    try:
+        ticket = _admit(http_request, "ask", priority, deadline)
+    except AdmissionRejected as e:
+        return _shed_response(e)
+    return await _run_admitted(ticket, _answer_question, request, conversation, deadline)
+
+
+def _compose_answer(request: QueryRequest, question: str, papers: list, deadline: Deadline, timings: dict):
+    """LLM or extractive answer per request.mode, timed into timings["answer"]"""
+    if not papers:
+        return None
+    started = time.perf_counter()
+    if request.mode == "fast":
+        answer = extractive_answer(question, papers, deadline=deadline)
+    else:
+        answer = generate_answer(question, papers, deadline)
+    timings["answer"] = {"mode": request.mode, "busy_ms": round((time.perf_counter() - started) * 1000, 1)}
+    return answer
+
+
+def _answer_question(request: QueryRequest, conversation, deadline: Deadline) -> QueryResponse:
+    try:
+        # Structured evidence filters (year / publication type / MeSH)
+        filters = normalize_filters(request.model_dump(include=set(FILTER_FIELDS)))
         
-        if not papers:
-            return QueryResponse(
-                answer="No relevant papers found for your query.",
-                papers=[]
+        # Local corpus hits are already filtered by its bitmaps
+        local_papers = search_local_corpus(request.question, filters=filters)
+
+        if conversation is None:
+            # Enhance the question with context if available
+            context = _history_context(request.history)
+            enhanced_question = request.question
+            if context:
+                enhanced_question = f"Context: {context}\nNew question: {request.question}"
+
+            # Streaming fetch -> embed -> rerank (original question for PubMed,
+            # enhanced question for matching); fetched papers are pre-filtered
+            top_papers, timings = run_ask_pipeline(
+                request.question, enhanced_question, filters=filters, extra_papers=local_papers,
+                deadline=deadline
             )
+            # Generate answer using LLM (use original question but with context awareness)
+            answer = _compose_answer(request, enhanced_question, top_papers, deadline, timings)
+        else:
+            # One turn at a time per conversation
+            with conversation.lock:
+                enhanced_question = conversation.retrieval_query(request.question)
+                question_embedding = embed_question(request.question) if allows(deadline, "embed") else None
+                # A close follow-up re-ranks the papers already retrieved
+                reuse = conversation.is_follow_up(question_embedding, filters)
+                prior = conversation.candidates()
+                scored = []
+                top_papers, timings = run_ask_pipeline(
+                    request.question, enhanced_question, filters=filters, extra_papers=local_papers,
+                    prior=prior, fetch=not reuse, scored=scored, deadline=deadline
+                )
+                answer = _compose_answer(request, enhanced_question, top_papers, deadline, timings)
+                conversation.record(request.question, answer or "", question_embedding, top_papers, scored,
+                                    reuse, filters)
+                conversations.save(conversation)
+                timings["conversation"] = {
+                    "turn": conversation.turn_count,
+                    "prior_candidates": len(prior),
+                    "reused_candidates": reuse,
+                }
+        timings["deadline"] = deadline.summary()
         
-        # Hybrid retrieval (use enhanced question for better matching)
-        retrieved = hybrid_retrieve(enhanced_question, papers)
-        
-        if not retrieved:
+        if not top_papers:
             return QueryResponse(
-                answer="No relevant results after retrieval.",
-                papers=[]
+                answer="No relevant papers found for your query.",
+                papers=[],
+                timings=timings,
+                session_id=request.session_id,
+                degradations=deadline.degradations
             )
         
-        # Re-rank papers (use enhanced question)
-        top_papers = rerank(enhanced_question, retrieved)
-        
-        # Generate answer using LLM (use original question but with context awareness)
-        answer = generate_answer(enhanced_question, top_papers)
-        
         return QueryResponse(
             answer=answer,
-            papers=top_papers
+            papers=top_papers,
+            timings=timings,
+            session_id=request.session_id,
+            degradations=deadline.degradations
         )
     except Exception as e:
         return QueryResponse(
             answer=f"Error processing query: {str(e)}",
-            papers=[]
+            papers=[],
+            session_id=request.session_id
         )
 
 
 # Report-related endpoints
 @app.post("/summarize-report")
-async def summarize_medical_report(file: UploadFile = File(...)):
+async def summarize_medical_report(http_request: Request, file: UploadFile = File(...), include_text: bool = False):
     """
     Upload a medical report and get AI-powered summary.
     Supports: PDF, DOCX, TXT
+    Returns a report_id for /report-question and /explain-term; the
+    extracted text is only echoed back when include_text is set.
     """
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Extract text from report
-        report_text = extract_report_text(content, file.filename)
-        
-        # Summarize the report
-        summary_result = summarize_report(report_text)
-        
-        # Extract key sections
-        key_sections = extract_key_sections(report_text)
-        
+        ticket = _admit(http_request, "summarize-report", BATCH)
+    except AdmissionRejected as e:
+        return _shed_response(e)
+    path = None
+    try:
+        # Spool the upload to disk in chunks, hashing as we go
+        path, digest, size = await spool_upload(file)
+
+        # Parse, index and summarize off the event loop (cached by content)
+        result, session, cached = await _run_admitted(ticket, process_report, path, file.filename, digest)
+
+        response = dict(result, filename=file.filename, report_id=session.report_id,
+                        sha256=digest, cached=cached, status="success")
+        if not include_text:
+            del response["report_text"]
+        return response
+    except Exception as e:
         return {
-            "filename": file.filename,
-            "summary": summary_result["summary"],
-            "key_sections": key_sections,
-            "report_text": report_text,  # Include the extracted text
-            "status": "success"
+            "error": str(e),
+            "status": "error"
         }
+    finally:
+        ticket.release()
+        if path is not None:
+            os.remove(path)
+
+
+@app.on_event("startup")
+def start_report_jobs():
+    # Work on the shared job table, including jobs left by a stopped process
+    report_jobs.start()
+
+
+@app.post("/jobs/summarize-report")
+async def submit_report_job(http_request: Request, file: UploadFile = File(...)):
+    """
+    Queue a medical report for background analysis.
+    Returns a job_id at once; poll GET /jobs/{job_id} or stream
+    GET /jobs/{job_id}/events for stage progress and partial results.
+    """
+    try:
+        ticket = _admit(http_request, "jobs", BATCH)
+    except AdmissionRejected as e:
+        return _shed_response(e)
+    path = None
+    try:
+        path, digest, size = await spool_upload(file)
+        job_id = await _run_admitted(ticket, report_jobs.submit, path, file.filename, digest)
+        path = None
+        return {"job_id": job_id, "status": "queued", "queue_depth": await run_in_threadpool(report_jobs.depth)}
+    except ReportJobQueueFull as e:
+        return JSONResponse(status_code=429, headers={"Retry-After": "5"},
+                            content={"error": str(e), "status": "rejected"})
     except Exception as e:
         return {
             "error": str(e),
             "status": "error"
         }
+    finally:
+        ticket.release()
+        if path is not None:
+            os.remove(path)
+
+
+@app.get("/jobs/{job_id}")
+async def get_report_job(job_id: str):
+    """Stage, progress and (partial) result of a report job"""
+    try:
+        return await run_in_threadpool(report_jobs.get, job_id)
+    except ReportJobNotFound as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "status": "error"})
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_report_job(job_id: str, request: Request):
+    """Server-sent events: one 'progress' event per job update, then 'done' or 'failed'"""
+    try:
+        job = await run_in_threadpool(report_jobs.get, job_id)
+    except ReportJobNotFound as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "status": "error"})
+
+    async def events(job):
+        last_update = None
+        while True:
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                finished = job["status"] in ("done", "failed")
+                event = job["status"] if finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+                if finished:
+                    return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(0.5)
+            job = await run_in_threadpool(report_jobs.get, job_id)
+
+    return StreamingResponse(events(job), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+def _resolve_report(report_id, report_text):
+    """(report_text, session) for a follow-up request: by report_id, else inline text"""
+    if report_id:
+        session = report_sessions.get(report_id)
+        return session.text, session
+    if report_text:
+        return report_text, None
+    raise ValueError("Provide a report_id from /summarize-report or the report_text")
 
 
 @app.post("/report-question", response_model=ReportQuestionResponse)
-async def ask_question_about_report(request: ReportQuestionRequest):
+async def ask_question_about_report(request: ReportQuestionRequest, http_request: Request):
     """
     Ask a question about a medical report.
     The AI will answer based on the report content.
     """
     try:
-        answer = answer_report_question(request.report_text, request.question)
+        ticket = _admit(http_request, "report-question", CONVERSATIONAL)
+    except AdmissionRejected as e:
+        return _shed_response(e)
+    try:
+        report_text, session = _resolve_report(request.report_id, request.report_text)
+        answer = await _run_admitted(ticket, answer_report_question, request.question, report_text, session=session)
         
         return ReportQuestionResponse(
             question=request.question,
@@ -142,16 +449,23 @@ async def ask_question_about_report(request: ReportQuestionRequest):
             question=request.question,
             answer=f"Error answering question: {str(e)}"
         )
+    finally:
+        ticket.release()
 
 
 @app.post("/explain-term", response_model=ReportExplanationResponse)
-async def explain_medical_term_endpoint(request: ReportExplanationRequest):
+async def explain_medical_term_endpoint(request: ReportExplanationRequest, http_request: Request):
     """
     Get an explanation of a medical term found in the report.
     Provides patient-friendly language.
     """
     try:
-        explanation = explain_medical_term(request.report_text, request.term)
+        ticket = _admit(http_request, "explain-term", CONVERSATIONAL)
+    except AdmissionRejected as e:
+        return _shed_response(e)
+    try:
+        report_text, session = _resolve_report(request.report_id, request.report_text)
+        explanation = await _run_admitted(ticket, explain_medical_term, report_text, request.term, session=session)
         
         return ReportExplanationResponse(
             term=request.term,
@@ -162,4 +476,23 @@ async def explain_medical_term_endpoint(request: ReportExplanationRequest):
             term=request.term,
             explanation=f"Error explaining term: {str(e)}"
         )
+    finally:
+        ticket.release()
+
 
+
+@app.get("/glossary/search")
+def search_glossary(q: str, limit: int = 10):
+    """
+    Glossary terms starting with q (for autocomplete), or the closest
+    spellings when nothing starts with it.
+    """
+    glossary = get_glossary()
+    matches = glossary.complete(q, limit) or glossary.fuzzy(q)[:limit]
+    return {
+        "query": q,
+        "matches": [
+            {"term": m.entry.term, "matched": m.key, "distance": m.distance, "definition": m.entry.definition}
+            for m in matches
+        ]
+    }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 class ConversationMessage(BaseModel):
     role: str  # "user" or "assistant"
@@ -7,17 +7,30 @@ class ConversationMessage(BaseModel):
 
 class QueryRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None  # from POST /sessions; replaces history
+    mode: Literal["llm", "fast"] = "llm"  # "fast": extractive answer, no LLM call
     history: Optional[List[ConversationMessage]] = None
+    # Evidence filters, applied before scoring (OR within a field, AND across fields)
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+    publication_types: Optional[List[str]] = None  # e.g. ["Randomized Controlled Trial"]
+    mesh_terms: Optional[List[str]] = None  # MeSH descriptors, e.g. ["Diabetes Mellitus, Type 2"]
 
 class Paper(BaseModel):
+    pmid: Optional[str] = None
     title: str
     abstract: str
+    year: Optional[int] = None
+    publication_types: Optional[List[str]] = None
     hybrid_score: Optional[float] = None
     rerank_score: Optional[float] = None
 
 class QueryResponse(BaseModel):
     answer: str
     papers: List[Paper]
+    timings: Optional[Dict[str, Any]] = None  # per-stage start/end/busy ms
+    session_id: Optional[str] = None
+    degradations: Optional[List[str]] = None  # cheaper paths taken to meet the deadline
 
 
 # Report-related schemas
@@ -30,7 +43,8 @@ class ReportSummaryResponse(BaseModel):
 
 class ReportQuestionRequest(BaseModel):
     question: str
-    report_text: str
+    report_id: Optional[str] = None  # from /summarize-report
+    report_text: Optional[str] = None  # only needed without a report_id
 
 
 class ReportQuestionResponse(BaseModel):
@@ -40,7 +54,8 @@ class ReportQuestionResponse(BaseModel):
 
 class ReportExplanationRequest(BaseModel):
     term: str
-    report_text: str
+    report_id: Optional[str] = None  # from /summarize-report
+    report_text: Optional[str] = None  # only needed without a report_id
 
 
 class ReportExplanationResponse(BaseModel):
@@ -0,0 +1,244 @@
+"""
+Admission Service - Early rejection instead of queueing past the deadline
+Every heavy endpoint asks for a ticket before doing any work. Requests are
+refused at once when:
+
+    429  the client's token bucket is empty (ADMISSION_CLIENT_RATE per
+         second, bursts of ADMISSION_CLIENT_BURST)
+    503  the server is at ADMISSION_MAX_INFLIGHT, or the predicted queue
+         wait exceeds the request's deadline
+
+Each priority class may only fill its share of ADMISSION_CAPACITY before it
+starts queueing, so under load batch report work is shed first, then
+conversational follow-ups, and interactive quick research last. The
+predicted wait is the work queued ahead of the request times the recent
+(EWMA) service time of its endpoint, spread over ADMISSION_CAPACITY.
+"""
+import hmac
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from backend.utils.config import (
+    ADMISSION_ENABLED, ADMISSION_CAPACITY, ADMISSION_MAX_INFLIGHT,
+    ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST, ADMISSION_CLIENT_HEADER, ADMISSION_FRONTEND_SECRET,
+    ADMISSION_FORWARDED_HOPS
+)
+
+INTERACTIVE = "interactive"
+CONVERSATIONAL = "conversational"
+BATCH = "batch"
+
+# Share of capacity a class may occupy before its requests have to wait
+PRIORITY_SHARES = {INTERACTIVE: 1.0, CONVERSATIONAL: 0.75, BATCH: 0.5}
+
+# Per-user id header the frontend sends (None = not used)
+CLIENT_ID_HEADER = ADMISSION_CLIENT_HEADER or None
+# Carries ADMISSION_FRONTEND_SECRET from the Streamlit app
+FRONTEND_SECRET_HEADER = "X-Frontend-Secret"
+
+# Service time assumed for an endpoint until one has been measured
+DEFAULT_SERVICE_SECONDS = 2.0
+
+_EWMA_ALPHA = 0.2
+_MAX_CLIENTS = 10000
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After"""
+
+    def __init__(self, message: str, status_code: int, retry_after: float, reason: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+def trusted_frontend(secret) -> bool:
+    """Whether secret matches ADMISSION_FRONTEND_SECRET (always False when none is configured)"""
+    return bool(ADMISSION_FRONTEND_SECRET) and hmac.compare_digest(str(secret or ""), ADMISSION_FRONTEND_SECRET)
+
+
+def client_keys(peer: str, forwarded_for: str = None, client_id: str = None, trusted: bool = False,
+                hops: int = ADMISSION_FORWARDED_HOPS) -> tuple:
+    """
+    The token buckets a request draws from. A client is the address the
+    trusted proxies (hops of them, nearest last in X-Forwarded-For) saw,
+    else the socket peer; behind a proxy the peer is the proxy itself,
+    shared by every user. A per-user id replaces the address only from a
+    trusted frontend, whose users all share its address. Anyone else can
+    make up ids, so theirs are scoped under the address and the address
+    bucket still applies.
+    """
+    addresses = [address.strip() for address in (forwarded_for or "").split(",") if address.strip()]
+    if hops > 0 and addresses:
+        # Entries left of those the trusted proxies appended can be forged
+        address = addresses[max(len(addresses) - hops, 0)]
+    else:
+        address = peer or "unknown"
+    client_id = (client_id or "").strip()[:128]
+    if not client_id:
+        return (address,)
+    if trusted:
+        return ("id:" + client_id,)
+    return (address, f"{address}|{client_id}")
+
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+
+class Ticket:
+    """An admitted request; release() it when done (safe to call twice)"""
+
+    def __init__(self, controller: "AdmissionController", endpoint: str, priority: str):
+        self._controller = controller
+        self.endpoint = endpoint
+        self.priority = priority
+        self.admitted_at = time.monotonic()
+        self.started_at = None
+        self._released = False
+
+    def start(self):
+        """Mark the start of actual work, so queueing is not counted as service time"""
+        self.started_at = time.monotonic()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """In-flight counts, service-time estimates and client buckets for one process"""
+
+    def __init__(self, capacity: int = ADMISSION_CAPACITY, max_inflight: int = ADMISSION_MAX_INFLIGHT,
+                 client_rate: float = ADMISSION_CLIENT_RATE, client_burst: float = ADMISSION_CLIENT_BURST,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.capacity = max(1, capacity)
+        self.max_inflight = max_inflight
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.enabled = enabled
+        self._inflight = {}  # endpoint -> count
+        self._class_inflight = {priority: 0 for priority in PRIORITY_SHARES}
+        self._service_seconds = {}  # endpoint -> EWMA
+        self._buckets = OrderedDict()
+        self._counts = {}  # (priority, outcome) -> count
+        self._lock = threading.Lock()
+
+    def _count(self, priority: str, outcome: str):
+        self._counts[(priority, outcome)] = self._counts.get((priority, outcome), 0) + 1
+
+    def _take_token(self, clients, now: float) -> float:
+        """
+        0 if every one of the client's buckets has a token (one is then
+        taken from each), else seconds until the emptiest refills. Buckets
+        after an empty one are not created, so a rate-limited address
+        cannot fill the table with made-up ids.
+        """
+        if self.client_rate <= 0:
+            return 0.0
+        buckets = []
+        for client in clients:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = _TokenBucket(self.client_burst, now)
+                while len(self._buckets) > _MAX_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket.tokens = min(self.client_burst, bucket.tokens + (now - bucket.updated) * self.client_rate)
+                bucket.updated = now
+            if bucket.tokens < 1:
+                return (1 - bucket.tokens) / self.client_rate
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return 0.0
+
+    def predicted_wait(self, endpoint: str, priority: str) -> float:
+        """Seconds a new request of this class would wait before starting"""
+        with self._lock:
+            return self._predicted_wait(endpoint, priority)
+
+    def _predicted_wait(self, endpoint: str, priority: str) -> float:
+        inflight = sum(self._inflight.values())
+        ahead = inflight + 1 - self.capacity * PRIORITY_SHARES[priority]
+        if ahead <= 0:
+            return 0.0
+        service = self._service_seconds.get(endpoint, DEFAULT_SERVICE_SECONDS)
+        return ahead * service / self.capacity
+
+    def admit(self, endpoint: str, priority: str, clients, deadline_seconds: float) -> Ticket:
+        """Admit a request drawing on the client_keys() buckets, or raise AdmissionRejected"""
+        now = time.monotonic()
+        with self._lock:
+            if self.enabled:
+                retry_after = self._take_token(clients, now)
+                if retry_after:
+                    self._count(priority, "shed_rate_limited")
+                    raise AdmissionRejected("Too many requests from this client; slow down.",
+                                            429, retry_after, "rate_limited")
+                if sum(self._inflight.values()) >= self.max_inflight:
+                    self._count(priority, "shed_overloaded")
+                    raise AdmissionRejected("Server is at capacity; try again shortly.", 503,
+                                            self._service_seconds.get(endpoint, DEFAULT_SERVICE_SECONDS),
+                                            "overloaded")
+                wait = self._predicted_wait(endpoint, priority)
+                if wait > deadline_seconds:
+                    self._count(priority, "shed_deadline")
+                    raise AdmissionRejected(
+                        f"Server is busy (about {wait:.0f}s queued ahead); try again shortly.",
+                        503, wait, "predicted_wait")
+            self._inflight[endpoint] = self._inflight.get(endpoint, 0) + 1
+            self._class_inflight[priority] += 1
+            self._count(priority, "admitted")
+        return Ticket(self, endpoint, priority)
+
+    def _release(self, ticket: Ticket):
+        now = time.monotonic()
+        with self._lock:
+            self._inflight[ticket.endpoint] -= 1
+            self._class_inflight[ticket.priority] -= 1
+            if ticket.started_at is not None:
+                seconds = now - ticket.started_at
+                previous = self._service_seconds.get(ticket.endpoint)
+                self._service_seconds[ticket.endpoint] = (
+                    seconds if previous is None else previous + _EWMA_ALPHA * (seconds - previous)
+                )
+
+    def stats(self) -> dict:
+        """In-flight work, service-time estimates and admitted/shed counts"""
+        with self._lock:
+            counts = {priority: {} for priority in PRIORITY_SHARES}
+            for (priority, outcome), count in self._counts.items():
+                counts[priority][outcome] = count
+            return {
+                "enabled": self.enabled,
+                "capacity": self.capacity,
+                "max_inflight": self.max_inflight,
+                "inflight": dict(self._inflight),
+                "inflight_by_class": dict(self._class_inflight),
+                "service_seconds": {endpoint: round(s, 3) for endpoint, s in self._service_seconds.items()},
+                "predicted_wait_seconds": {
+                    priority: round(self._predicted_wait("ask", priority), 3) for priority in PRIORITY_SHARES
+                },
+                "requests": counts,
+                "clients_tracked": len(self._buckets),
+            }
+
+
+admission = AdmissionController()
@@ -0,0 +1,201 @@
+"""
+Article Store Service - Memory-mapped columnar storage for the local corpus
+Layout: one contiguous UTF-8 text blob plus int64 offset/PMID columns.
+Files are opened via mmap so the page cache is shared across worker processes.
+"""
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+
+STORE_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+TEXT_FILE = "text.bin"
+OFFSETS_FILE = "offsets.i64"
+PMIDS_FILE = "pmids.i64"
+PMID_SORTED_FILE = "pmid_sorted.i64"
+PMID_ROWS_FILE = "pmid_rows.i64"
+
+
+def _map_file(path: str):
+    """Map a file read-only, returning (mmap or None, memoryview)"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None, memoryview(b"")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, memoryview(mm)
+
+
+def _int64_view(buffer) -> memoryview:
+    """View a raw buffer as a flat int64 column"""
+    view = memoryview(buffer)
+    if view.nbytes == 0:
+        return memoryview(array("q"))
+    return view.cast("B").cast("q")
+
+
+class ArticleStore:
+    """
+    Read-only columnar article store.
+    Row r has its title at text[offsets[2r]:offsets[2r+1]] and its abstract
+    at text[offsets[2r+1]:offsets[2r+2]]. Ranking code works on row IDs and
+    only materializes strings through title()/abstract()/materialize().
+    """
+
+    def __init__(self, text, offsets, pmids, pmid_sorted, pmid_rows, mappings=None):
+        self._text = memoryview(text)
+        self._offsets = _int64_view(offsets)
+        self._pmids = _int64_view(pmids)
+        self._pmid_sorted = _int64_view(pmid_sorted)
+        self._pmid_rows = _int64_view(pmid_rows)
+        self._mappings = mappings or []
+
+    @classmethod
+    def open(cls, path: str) -> "ArticleStore":
+        """Open a store directory written by build_article_store"""
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported article store version: {manifest.get('version')}")
+
+        mappings = []
+        views = []
+        for name in (TEXT_FILE, OFFSETS_FILE, PMIDS_FILE, PMID_SORTED_FILE, PMID_ROWS_FILE):
+            mm, view = _map_file(os.path.join(path, name))
+            if mm is not None:
+                mappings.append(mm)
+            views.append(view)
+
+        store = cls(*views, mappings=mappings)
+        if len(store) != manifest.get("count"):
+            store.close()
+            raise ValueError("Article store manifest does not match its columns")
+        return store
+
+    def close(self):
+        """Release the memory maps"""
+        for view in (self._text, self._offsets, self._pmids, self._pmid_sorted, self._pmid_rows):
+            view.release()
+        for mm in self._mappings:
+            mm.close()
+        self._mappings = []
+
+    def __len__(self):
+        return len(self._pmids)
+
+    def _span(self, row: int, column: int) -> memoryview:
+        start = self._offsets[2 * row + column]
+        end = self._offsets[2 * row + column + 1]
+        return self._text[start:end]
+
+    def title(self, row: int) -> str:
+        return str(self._span(row, 0), "utf-8")
+
+    def abstract(self, row: int) -> str:
+        return str(self._span(row, 1), "utf-8")
+
+    def titles(self, rows) -> list:
+        return [self.title(int(r)) for r in rows]
+
+    def abstracts(self, rows) -> list:
+        return [self.abstract(int(r)) for r in rows]
+
+    def pmid(self, row: int) -> str:
+        return str(self._pmids[row])
+
+    def row_for_pmid(self, pmid):
+        """Return the row for a PMID, or None if it is not in the store"""
+        try:
+            key = int(pmid)
+        except (TypeError, ValueError):
+            return None
+        pos = bisect_left(self._pmid_sorted, key)
+        if pos < len(self._pmid_sorted) and self._pmid_sorted[pos] == key:
+            return self._pmid_rows[pos]
+        return None
+
+    def rows_for_pmids(self, pmids) -> list:
+        """Map PMIDs to rows, skipping unknown ones"""
+        rows = []
+        for pmid in pmids:
+            row = self.row_for_pmid(pmid)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def materialize(self, rows, scores=None, score_key: str = "hybrid_score") -> list:
+        """Build paper dicts for the final top-k rows only"""
+        papers = []
+        for i, row in enumerate(rows):
+            row = int(row)
+            paper = {
+                "pmid": self.pmid(row),
+                "title": self.title(row),
+                "abstract": self.abstract(row),
+            }
+            if scores is not None:
+                paper[score_key] = float(scores[i])
+            papers.append(paper)
+        return papers
+
+
+def build_article_store(papers, path: str, observers=()) -> int:
+    """
+    Write papers (dicts with pmid/title/abstract) to a store directory.
+    Text is streamed to disk; only the offset columns are held in memory.
+    Each observer's add(row, paper) is called per written row so secondary
+    indexes can be built in the same pass.
+    Returns the number of rows written.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    offsets = array("q", [0])
+    pmids = array("q")
+    seen = set()
+    position = 0
+
+    with open(os.path.join(path, TEXT_FILE), "wb") as text_file:
+        for paper in papers:
+            pmid = int(paper["pmid"])
+            if pmid in seen:
+                continue
+            seen.add(pmid)
+
+            for field in ("title", "abstract"):
+                data = (paper.get(field) or "").encode("utf-8")
+                text_file.write(data)
+                position += len(data)
+                offsets.append(position)
+            for observer in observers:
+                observer.add(len(pmids), paper)
+            pmids.append(pmid)
+
+    order = sorted(range(len(pmids)), key=lambda r: pmids[r])
+    pmid_sorted = array("q", (pmids[r] for r in order))
+    pmid_rows = array("q", order)
+
+    for name, column in ((OFFSETS_FILE, offsets), (PMIDS_FILE, pmids),
+                         (PMID_SORTED_FILE, pmid_sorted), (PMID_ROWS_FILE, pmid_rows)):
+        with open(os.path.join(path, name), "wb") as f:
+            column.tofile(f)
+
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump({"version": STORE_VERSION, "count": len(pmids)}, f)
+
+    return len(pmids)
+
+
+_store = None
+
+
+def get_article_store():
+    """Open the configured local corpus once per process (None if not configured)"""
+    global _store
+    if _store is None:
+        from backend.utils.config import LOCAL_CORPUS_DIR
+        if not LOCAL_CORPUS_DIR or not os.path.exists(os.path.join(LOCAL_CORPUS_DIR, MANIFEST_FILE)):
+            return None
+        _store = ArticleStore.open(LOCAL_CORPUS_DIR)
+    return _store
@@ -0,0 +1,295 @@
+"""
+Capture Service - Anonymized traffic recording for load-test replay
+With CAPTURE_ENABLED, CaptureMiddleware records a CAPTURE_SAMPLE_RATE share
+of /ask and report requests: arrival time, the request with questions
+scrubbed of contact details and long numbers, its status, latency and the
+stage timings and degradations the backend reported. Session, report and
+client ids are replaced by salted digests so replays can group requests
+without learning them; uploaded reports and inline report text are reduced
+to their size.
+
+Records are built and written by a background thread as JSON lines to
+CAPTURE_DIR/capture.jsonl, which is rotated at CAPTURE_MAX_BYTES.
+benchmarks/replay_traffic.py replays them.
+"""
+import hashlib
+import hmac
+import json
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+
+from starlette.datastructures import Headers
+
+from backend.services.metadata_filter_service import FILTER_FIELDS
+from backend.utils.config import (
+    CAPTURE_ENABLED, CAPTURE_DIR, CAPTURE_MAX_BYTES, CAPTURE_MAX_FILES, CAPTURE_SAMPLE_RATE, CAPTURE_SALT
+)
+
+CAPTURE_FILE = "capture.jsonl"
+CAPTURE_VERSION = 1
+
+# Request and response bodies beyond these are not kept (uploads are only counted)
+_MAX_REQUEST_BYTES = 64 * 1024
+_MAX_RESPONSE_BYTES = 1024 * 1024
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+_LONG_NUMBER = re.compile(r"\b\d{5,}\b")
+_DATE = re.compile(r"\b\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}\b")
+_FILENAME = re.compile(rb'filename="([^"]*)"')
+
+# Answers the endpoints return with status 200 when the work itself failed
+_ERROR_PREFIXES = ("Error processing query", "Error answering question", "Error explaining term")
+
+
+def scrub(text: str) -> str:
+    """Text with e-mail addresses, phone numbers, dates and long numbers masked"""
+    text = _EMAIL.sub("<email>", text or "")
+    text = _DATE.sub("<date>", text)
+    text = _PHONE.sub("<phone>", text)
+    return _LONG_NUMBER.sub("<number>", text)
+
+
+def response_outcome(path: str, status: int, data) -> dict:
+    """
+    Error flag, degradations and stage timings of one response, as used by
+    both the capture files and the replay report.
+    """
+    outcome = {"error": status >= 500 or status in (400, 404, 422), "shed": status in (429, 503),
+               "degradations": [], "timings": None}
+    if not isinstance(data, dict):
+        return outcome
+    answer = data.get("answer") or data.get("explanation") or ""
+    if data.get("status") in ("error", "failed") or str(answer).startswith(_ERROR_PREFIXES):
+        outcome["error"] = True
+    outcome["degradations"] = list(data.get("degradations") or [])
+    if path == "/ask":
+        outcome["timings"] = data.get("timings")
+    elif path == "/summarize-report" and isinstance(data.get("extraction"), dict):
+        outcome["timings"] = {"stages": {"extract": {"busy_ms": data["extraction"].get("elapsed_ms")}},
+                              "cached": data.get("cached", False)}
+    return outcome
+
+
+class _Anonymizer:
+    def __init__(self, salt: str = CAPTURE_SALT):
+        # Without a configured salt, digests only correlate within one process
+        self._key = (salt or secrets.token_hex(16)).encode("utf-8")
+
+    def digest(self, value) -> str:
+        if not value:
+            return None
+        return hmac.new(self._key, str(value).encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+    def request(self, path: str, body: bytes, size: int, headers: dict) -> dict:
+        if path.endswith("summarize-report"):
+            match = _FILENAME.search(body)
+            extension = os.path.splitext(match.group(1).decode("utf-8", "replace"))[1].lower() if match else ""
+            return {"upload_bytes": size, "extension": extension}
+        try:
+            data = json.loads(body) if size <= _MAX_REQUEST_BYTES else {}
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        request = {}
+        for field in ("question", "term"):
+            if data.get(field):
+                request[field] = scrub(data[field])
+        if data.get("history"):
+            request["history"] = [{"role": m.get("role"), "content": scrub(m.get("content", ""))}
+                                  for m in data["history"] if isinstance(m, dict)]
+        for field in ("session_id", "report_id"):
+            if data.get(field):
+                request[field] = self.digest(data[field])
+        if data.get("report_text"):
+            request["report_text_chars"] = len(data["report_text"])
+        # Answer mode and evidence filters carry no personal data
+        for field in ("mode",) + FILTER_FIELDS:
+            if data.get(field) is not None:
+                request[field] = data[field]
+        if headers.get("x-request-deadline-ms"):
+            request["deadline_ms"] = headers["x-request-deadline-ms"]
+        return request
+
+
+class _RotatingJsonl:
+    """Appends lines to one file, renaming it aside once it reaches max_bytes"""
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.path = os.path.join(directory, CAPTURE_FILE)
+
+    def write(self, lines: list):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.writelines(lines)
+            size = f.tell()
+        if size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        os.replace(self.path, os.path.join(self.directory, f"capture-{stamp}-{secrets.token_hex(3)}.jsonl"))
+        rotated = sorted(name for name in os.listdir(self.directory)
+                         if name.startswith("capture-") and name.endswith(".jsonl"))
+        # The active file counts towards max_files
+        for name in rotated[:max(0, len(rotated) - (self.max_files - 1))]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class TrafficRecorder:
+    """Background thread turning raw captured exchanges into JSONL records"""
+
+    def __init__(self, directory: str = CAPTURE_DIR, max_bytes: int = CAPTURE_MAX_BYTES,
+                 max_files: int = CAPTURE_MAX_FILES, salt: str = CAPTURE_SALT, max_batch: int = 256):
+        self.output = _RotatingJsonl(directory, max_bytes, max_files)
+        self.anonymizer = _Anonymizer(salt)
+        self.max_batch = max_batch
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=10000)
+        threading.Thread(target=self._loop, name="traffic-capture", daemon=True).start()
+
+    def submit(self, exchange: dict):
+        try:
+            self._queue.put_nowait(exchange)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until queued exchanges have been written"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def record(self, exchange: dict) -> dict:
+        path = exchange["path"]
+        data = None
+        if exchange["response_json"]:
+            try:
+                data = json.loads(exchange["response_body"])
+            except ValueError:
+                pass
+        return {
+            "v": CAPTURE_VERSION,
+            "ts": exchange["ts"],
+            "path": path,
+            "client": self.anonymizer.digest(exchange["client"]),
+            "request": self.anonymizer.request(path, exchange["request_body"], exchange["request_size"],
+                                               exchange["headers"]),
+            "status": exchange["status"],
+            "latency_ms": exchange["latency_ms"],
+            **response_outcome(path, exchange["status"] or 0, data),
+        }
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.output.write([json.dumps(self.record(exchange)) + "\n" for exchange in batch])
+                self.recorded += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"Traffic capture failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> TrafficRecorder:
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = TrafficRecorder()
+        return _recorder
+
+
+def stats() -> dict:
+    return {
+        "enabled": CAPTURE_ENABLED,
+        "directory": CAPTURE_DIR,
+        "sample_rate": CAPTURE_SAMPLE_RATE,
+        "recorded": _recorder.recorded if _recorder is not None else 0,
+        "dropped": _recorder.dropped if _recorder is not None else 0,
+    }
+
+
+class CaptureMiddleware:
+    """
+    ASGI middleware recording sampled requests to the given paths. Bodies
+    are only copied here; parsing and anonymizing happen on the recorder's
+    thread.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if (not CAPTURE_ENABLED or scope["type"] != "http" or scope["path"] not in self.paths
+                or random.random() >= CAPTURE_SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        exchange = {
+            "ts": time.time(),
+            "path": scope["path"],
+            "client": scope["client"][0] if scope.get("client") else None,
+            "headers": {"x-request-deadline-ms": headers.get("x-request-deadline-ms")},
+            "request_body": bytearray(),
+            "request_size": 0,
+            "status": None,
+            "response_json": False,
+            "response_body": bytearray(),
+        }
+        started = time.perf_counter()
+
+        async def receive_and_copy():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                exchange["request_size"] += len(chunk)
+                room = _MAX_REQUEST_BYTES - len(exchange["request_body"])
+                if room > 0:
+                    exchange["request_body"] += chunk[:room]
+            return message
+
+        async def send_and_copy(message):
+            if message["type"] == "http.response.start":
+                exchange["status"] = message["status"]
+                exchange["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                content_type = Headers(raw=message.get("headers", [])).get("content-type", "")
+                exchange["response_json"] = content_type.startswith("application/json")
+            elif message["type"] == "http.response.body" and exchange["response_json"]:
+                if len(exchange["response_body"]) + len(message.get("body", b"")) <= _MAX_RESPONSE_BYTES:
+                    exchange["response_body"] += message.get("body", b"")
+                else:
+                    exchange["response_json"] = False
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_copy, send_and_copy)
+        finally:
+            exchange.setdefault("latency_ms", round((time.perf_counter() - started) * 1000, 1))
+            exchange["request_body"] = bytes(exchange["request_body"])
+            exchange["response_body"] = bytes(exchange["response_body"])
+            get_recorder().submit(exchange)
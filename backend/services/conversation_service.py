@@ -0,0 +1,309 @@
+"""
+Conversation Service - Server-side state for conversational /ask
+POST /sessions returns a session_id; /ask with that id no longer needs the
+client to resend the history. Each session keeps its turns (question, a
+condensed answer, the question's embedding and the PMIDs cited), the
+condensed context used for the next retrieval query, and the candidate
+papers retrieved so far with their embeddings. A follow-up close to the
+previous question re-ranks those candidates instead of querying PubMed again.
+Sessions expire after CONVERSATION_TTL seconds without use, the least
+recently used are dropped beyond CONVERSATION_MAX_SESSIONS, and each one is
+trimmed (oldest candidates, then oldest turns) to CONVERSATION_SESSION_MAX_BYTES.
+
+After each turn the turns, context and filters are written to
+CONVERSATION_DIR, so every API process sharing that directory continues the
+same conversation. Candidate papers stay with the process that retrieved
+them; a turn served elsewhere searches PubMed again.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from backend.services import retrieval_service
+from backend.utils.config import (
+    CONVERSATION_TTL, CONVERSATION_MAX_SESSIONS, CONVERSATION_SESSION_MAX_BYTES,
+    CONVERSATION_CONTEXT_TURNS, CONVERSATION_ANSWER_CHARS, CONVERSATION_REUSE_THRESHOLD, CONVERSATION_DIR
+)
+
+if retrieval_service.HAS_ML_PACKAGES:
+    import numpy as np
+
+
+class ConversationNotFound(KeyError):
+    """Raised when a session_id is unknown or its session has expired"""
+
+    def __str__(self):
+        return "Conversation session not found or expired. Please start a new conversation."
+
+
+def condense_answer(answer: str, max_chars: int = CONVERSATION_ANSWER_CHARS) -> str:
+    """The opening of an answer, cut at a sentence end where possible"""
+    answer = " ".join((answer or "").split())
+    if len(answer) <= max_chars:
+        return answer
+    cut = answer[:max_chars]
+    end = cut.rfind(". ")
+    return cut[:end + 1] if end >= max_chars // 2 else cut.rstrip() + "..."
+
+
+def embed_question(question: str):
+    """Normalized question embedding, or None without the embedding model"""
+    if not (retrieval_service.HAS_ML_PACKAGES and retrieval_service.HAS_EMBEDDINGS):
+        return None
+    try:
+        embedding = retrieval_service.embed_queries([question])[0]
+        return embedding / (np.linalg.norm(embedding) + 1e-8)
+    except Exception as e:
+        print(f"Question embedding failed: {e}")
+        return None
+
+
+def _paper_key(paper: dict):
+    return paper.get("pmid") or paper.get("title")
+
+
+def _paper_bytes(paper: dict, embedding) -> int:
+    size = sum(sys.getsizeof(value) for value in paper.values())
+    return size + (embedding.nbytes if embedding is not None else 0)
+
+
+class Turn:
+    __slots__ = ("question", "answer", "embedding", "pmids", "reused", "nbytes")
+
+    def __init__(self, question: str, answer: str, embedding, pmids: list, reused: bool):
+        self.question = question
+        self.answer = answer
+        self.embedding = embedding
+        self.pmids = pmids
+        self.reused = reused
+        self.nbytes = (sys.getsizeof(question) + sys.getsizeof(answer)
+                       + sum(sys.getsizeof(pmid) for pmid in pmids)
+                       + (embedding.nbytes if embedding is not None else 0))
+
+
+class Conversation:
+    """Turns, condensed context and candidate papers of one conversation"""
+
+    def __init__(self, session_id: str, max_bytes: int = CONVERSATION_SESSION_MAX_BYTES):
+        self.session_id = session_id
+        self.max_bytes = max_bytes
+        self.turns = []
+        self.turn_count = 0
+        self.context = ""
+        self.filters = {}
+        # paper key -> (paper, embedding), oldest first
+        self._candidates = OrderedDict()
+        self._candidate_bytes = 0
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        # mtime of the shared file this copy matches
+        self.synced_ns = None
+        # Serializes turns of one session; other sessions are not blocked
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.context) + sum(turn.nbytes for turn in self.turns) + self._candidate_bytes
+
+    def retrieval_query(self, question: str) -> str:
+        """The question with the condensed context of the last turns, for scoring"""
+        if not self.context:
+            return question
+        return f"Context: {self.context}\nNew question: {question}"
+
+    def candidates(self) -> list:
+        """(paper, embedding) pairs retrieved in earlier turns"""
+        return list(self._candidates.values())
+
+    def is_follow_up(self, embedding, filters: dict = None) -> bool:
+        """Whether a question is close enough to the last one (under the same filters) to reuse its candidates"""
+        if embedding is None or not self.turns or self.turns[-1].embedding is None or not self._candidates:
+            return False
+        if (filters or {}) != self.filters:
+            return False
+        return float(embedding @ self.turns[-1].embedding) >= CONVERSATION_REUSE_THRESHOLD
+
+    def record(self, question: str, answer: str, embedding, papers: list, candidates: list, reused: bool,
+               filters: dict = None):
+        """Append a turn, merge its candidates and refresh the condensed context"""
+        self.filters = filters or {}
+        for paper, paper_embedding in candidates:
+            key = _paper_key(paper)
+            if not key:
+                continue
+            paper = {name: value for name, value in paper.items() if name not in ("hybrid_score", "rerank_score")}
+            previous = self._candidates.pop(key, None)
+            if previous is not None:
+                self._candidate_bytes -= _paper_bytes(*previous)
+                paper_embedding = paper_embedding if paper_embedding is not None else previous[1]
+            self._candidates[key] = (paper, paper_embedding)
+            self._candidate_bytes += _paper_bytes(paper, paper_embedding)
+        pmids = [paper.get("pmid") for paper in papers if paper.get("pmid")]
+        self.turns.append(Turn(question, condense_answer(answer), embedding, pmids, reused))
+        self.turn_count += 1
+        self._trim()
+        self.context = "".join(
+            f"Previous question: {turn.question}\nPrevious answer: {turn.answer}\n"
+            for turn in self.turns[-CONVERSATION_CONTEXT_TURNS:]
+        ) if CONVERSATION_CONTEXT_TURNS > 0 else ""
+
+    def _trim(self):
+        """Drop the oldest candidates, then the oldest turns, until within max_bytes"""
+        while self.nbytes > self.max_bytes and self._candidates:
+            _, oldest = self._candidates.popitem(last=False)
+            self._candidate_bytes -= _paper_bytes(*oldest)
+        # The latest turn is always kept
+        while self.nbytes > self.max_bytes and len(self.turns) > 1:
+            self.turns.pop(0)
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "last_access": self.last_access,
+            "turn_count": self.turn_count,
+            "turns": [
+                {"question": turn.question, "answer": turn.answer, "pmids": turn.pmids, "reused_candidates": turn.reused}
+                for turn in self.turns
+            ],
+            "candidates": len(self._candidates),
+            "nbytes": self.nbytes,
+        }
+
+    def state(self) -> dict:
+        """What another process needs to continue the conversation (no candidates or embeddings)"""
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "turn_count": self.turn_count,
+            "context": self.context,
+            "filters": self.filters,
+            "turns": [{"question": turn.question, "answer": turn.answer, "pmids": turn.pmids,
+                       "reused": turn.reused} for turn in self.turns],
+        }
+
+    def restore(self, state: dict):
+        """Take over turns and context written by another process"""
+        self.created_at = state["created_at"]
+        self.turn_count = state["turn_count"]
+        self.context = state["context"]
+        self.filters = state["filters"]
+        self.turns = [Turn(turn["question"], turn["answer"], None, turn["pmids"], turn["reused"])
+                      for turn in state["turns"]]
+
+
+class ConversationStore:
+    """TTL-bounded LRU of conversations, written through to a shared directory"""
+
+    def __init__(self, ttl: float, max_sessions: int, session_max_bytes: int, directory: str):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.session_max_bytes = session_max_bytes
+        self.directory = directory
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def create(self) -> Conversation:
+        conversation = Conversation(uuid.uuid4().hex, self.session_max_bytes)
+        self.save(conversation)
+        with self._lock:
+            self._sessions[conversation.session_id] = conversation
+            while len(self._sessions) > max(self.max_sessions, 1):
+                self._sessions.popitem(last=False)
+        self._sweep()
+        return conversation
+
+    def save(self, conversation: Conversation):
+        """Write a conversation's state after a turn, for the other processes"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(conversation.state(), f)
+        path = self._path(conversation.session_id)
+        os.replace(tmp_path, path)
+        conversation.synced_ns = os.stat(path).st_mtime_ns
+
+    def get(self, session_id: str) -> Conversation:
+        """Return the live conversation for session_id or raise ConversationNotFound"""
+        if not session_id or not session_id.isalnum():
+            raise ConversationNotFound(session_id)
+        now = time.time()
+        path = self._path(session_id)
+        try:
+            # Touched on every use, so its mtime is the last use by any process
+            stat = os.stat(path)
+        except OSError:
+            # Deleted, or expired, by some process
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            raise ConversationNotFound(session_id)
+        if now - stat.st_mtime > self.ttl:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            raise ConversationNotFound(session_id)
+        with self._lock:
+            conversation = self._sessions.get(session_id)
+            if conversation is None:
+                conversation = Conversation(session_id, self.session_max_bytes)
+                self._sessions[session_id] = conversation
+                while len(self._sessions) > max(self.max_sessions, 1):
+                    self._sessions.popitem(last=False)
+            conversation.last_access = now
+            self._sessions.move_to_end(session_id)
+        # Another process has answered a turn since this copy was written; a
+        # turn running here holds the lock and will write its own state
+        if conversation.synced_ns != stat.st_mtime_ns and conversation.lock.acquire(blocking=False):
+            try:
+                with open(path) as f:
+                    conversation.restore(json.load(f))
+            except (OSError, ValueError, KeyError):
+                raise ConversationNotFound(session_id)
+            finally:
+                conversation.lock.release()
+        try:
+            os.utime(path)
+            conversation.synced_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+        return conversation
+
+    def delete(self, session_id: str):
+        with self._lock:
+            known = self._sessions.pop(session_id, None) is not None
+        try:
+            os.remove(self._path(session_id))
+        except (OSError, ValueError):
+            if not known:
+                raise ConversationNotFound(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _sweep(self):
+        """Drop expired conversations, and files unused by any process, at most once a minute"""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        with self._lock:
+            for session_id in [sid for sid, c in self._sessions.items() if now - c.last_access > self.ttl]:
+                del self._sessions[session_id]
+        for item in os.scandir(self.directory):
+            try:
+                if now - item.stat().st_mtime > self.ttl:
+                    os.remove(item.path)
+            except OSError:
+                pass
+
+
+conversations = ConversationStore(CONVERSATION_TTL, CONVERSATION_MAX_SESSIONS, CONVERSATION_SESSION_MAX_BYTES,
+                                  CONVERSATION_DIR)
@@ -0,0 +1,117 @@
+"""
+Corpus Service - Ingestion and filtered search over the local corpus
+Ties together the article store, metadata bitmaps, BM25 postings and the
+compressed dense index; all of them are addressed by store row id.
+"""
+import os
+
+from backend.services.article_store_service import build_article_store, ArticleStore, get_article_store
+from backend.services.dedup_service import NearDuplicateIndexBuilder
+from backend.services.metadata_filter_service import MetadataIndexBuilder, get_metadata_index
+from backend.services.sparse_index_service import SparseIndexBuilder, get_sparse_index, HAS_NUMPY
+from backend.services.vector_index_service import get_dense_index
+from backend.services import retrieval_service
+from backend.services.tracing_service import span
+from backend.utils.config import DENSE_INDEX_MODE, DEDUP_ENABLED
+
+if HAS_NUMPY:
+    import numpy as np
+
+
+def ingest_corpus(papers, path: str, dense_mode: str = DENSE_INDEX_MODE,
+                  collapse_duplicates: bool = DEDUP_ENABLED) -> int:
+    """
+    Build a local corpus directory in one pass over papers: article store,
+    metadata bitmaps, BM25 postings and MinHash signatures, then the dense
+    index if embeddings are available. With collapse_duplicates, articles
+    whose abstracts nearly match an earlier one are not stored.
+    Returns the number of articles stored.
+    """
+    metadata = MetadataIndexBuilder()
+    sparse = SparseIndexBuilder()
+    near_duplicates = NearDuplicateIndexBuilder(collapse=collapse_duplicates)
+    count = build_article_store(near_duplicates.unique(papers), path,
+                                observers=[metadata, sparse, near_duplicates])
+    metadata.save(path)
+    sparse.save(path)
+    near_duplicates.save(path)
+    if near_duplicates.collapsed:
+        print(f"Collapsed {near_duplicates.collapsed} near-duplicate articles")
+
+    if retrieval_service.HAS_ML_PACKAGES and retrieval_service.HAS_EMBEDDINGS and count:
+        store = ArticleStore.open(path)
+        try:
+            retrieval_service.build_store_dense_index(store, os.path.join(path, "dense"), mode=dense_mode)
+        finally:
+            store.close()
+    return count
+
+
+def search_local_corpus(query: str, top_k: int = 10, filters=None, candidates: int = 100) -> list:
+    """
+    Filtered hybrid search over the local corpus.
+    Filters resolve to a row bitmap that is pushed into both the dense and
+    the BM25 search, so only matching rows are ever scored.
+    Returns materialized paper dicts (empty if no corpus is configured).
+    """
+    store = get_article_store()
+    sparse = get_sparse_index()
+    if store is None or sparse is None or not HAS_NUMPY:
+        return []
+
+    allowed_rows = None
+    if filters:
+        metadata = get_metadata_index()
+        if metadata is None:
+            return []
+        allowed = metadata.resolve(filters)
+        allowed_rows = np.asarray(allowed.to_rows(), dtype=np.int64)
+        if len(allowed_rows) == 0:
+            return []
+
+    with span("bm25.search", candidates=candidates, filtered=allowed_rows is not None):
+        bm25_scores, bm25_rows = sparse.search(retrieval_service._clean_text(query), candidates, allowed_rows)
+
+    dense = get_dense_index()
+    dense_by_row = {}
+    if dense is not None and retrieval_service.HAS_EMBEDDINGS:
+        try:
+            query_embedding = retrieval_service.embed_queries([query])
+            with span("faiss.search", candidates=candidates, filtered=allowed_rows is not None):
+                dense_scores, dense_rows = dense.search(query_embedding, candidates, rows=allowed_rows)[0]
+            # Exact dense scores for BM25-only candidates keep the fusion fair
+            missing = np.setdiff1d(bm25_rows, dense_rows)
+            if len(missing):
+                extra_scores, extra_rows = dense.search(query_embedding, len(missing), rows=missing)[0]
+                dense_scores = np.concatenate([dense_scores, extra_scores])
+                dense_rows = np.concatenate([dense_rows, extra_rows])
+            dense_by_row = dict(zip(dense_rows.tolist(), np.maximum(dense_scores, 0).tolist()))
+        except Exception as e:
+            print(f"Dense corpus search failed, using BM25 only: {e}")
+
+    rows = sorted(set(bm25_rows.tolist()) | set(dense_by_row))
+    if not rows:
+        return []
+
+    bm25_by_row = dict(zip(bm25_rows.tolist(), bm25_scores.tolist()))
+    bm25_array = np.array([bm25_by_row.get(r, 0.0) for r in rows], dtype=np.float32)
+    if dense_by_row:
+        dense_array = np.array([dense_by_row.get(r, 0.0) for r in rows], dtype=np.float32)
+        final_scores = retrieval_service._fuse_scores(dense_array, bm25_array)
+    else:
+        final_scores = bm25_array / (np.max(bm25_array) + 1e-8)
+
+    ranked = np.argsort(final_scores)[::-1][:top_k]
+    return store.materialize([rows[i] for i in ranked], final_scores[ranked])
+
+
+def merge_candidates(papers, extra) -> list:
+    """Append extra papers that are not already present (by PMID, else title)"""
+    merged = list(papers or [])
+    seen = {p.get("pmid") or p.get("title") for p in merged}
+    for paper in extra or []:
+        key = paper.get("pmid") or paper.get("title")
+        if key not in seen:
+            seen.add(key)
+            merged.append(paper)
+    return merged
@@ -0,0 +1,88 @@
+"""
+Deadline Service - Request time budgets for /ask
+A Deadline is created per request (X-Request-Deadline-Ms header, else
+ASK_DEADLINE_SECONDS) and passed down the pipeline. Each stage checks the
+remaining budget before starting and takes a cheaper path when it is short,
+recording the degradation so the response can report it:
+
+    cached_pubmed      PubMed skipped; cached search results and articles only
+    partial_fetch      efetch stopped early; the papers parsed so far are used
+    keyword_scoring    keyword scorer instead of embeddings
+    skipped_rerank     hybrid scores instead of the cross-encoder
+    extractive_answer  sentences extracted from the abstracts instead of an LLM answer
+"""
+import threading
+import time
+
+from backend.services.tracing_service import add_event
+from backend.utils.config import (
+    ASK_DEADLINE_SECONDS, DEADLINE_FETCH_MIN_SECONDS, DEADLINE_EMBED_MIN_SECONDS,
+    DEADLINE_RERANK_MIN_SECONDS, DEADLINE_LLM_MIN_SECONDS
+)
+
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+# Budget a stage needs to take its normal path
+STAGE_MIN_SECONDS = {
+    "fetch": DEADLINE_FETCH_MIN_SECONDS,
+    "embed": DEADLINE_EMBED_MIN_SECONDS,
+    "rerank": DEADLINE_RERANK_MIN_SECONDS,
+    "llm": DEADLINE_LLM_MIN_SECONDS,
+}
+
+
+class Deadline:
+    """A monotonic-clock expiry plus the degradations taken to meet it"""
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._degradations = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_header(cls, value=None, default: float = ASK_DEADLINE_SECONDS) -> "Deadline":
+        """Deadline from a header value in milliseconds (ignored if invalid)"""
+        try:
+            milliseconds = float(value)
+            if milliseconds > 0:
+                return cls(milliseconds / 1000)
+        except (TypeError, ValueError):
+            pass
+        return cls(default)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, stage: str) -> bool:
+        """Whether enough budget is left for a stage's normal path"""
+        return self.remaining() >= STAGE_MIN_SECONDS[stage]
+
+    def timeout(self, cap: float) -> float:
+        """A per-call timeout: cap, shortened to the remaining budget"""
+        return max(0.05, min(cap, self.remaining()))
+
+    def degrade(self, name: str):
+        add_event("degraded", degradation=name, remaining_ms=round(self.remaining() * 1000, 1))
+        with self._lock:
+            if name not in self._degradations:
+                self._degradations.append(name)
+
+    @property
+    def degradations(self) -> list:
+        with self._lock:
+            return list(self._degradations)
+
+    def summary(self) -> dict:
+        return {
+            "budget_ms": round(self.budget * 1000, 1),
+            "remaining_ms": round(self.remaining() * 1000, 1),
+        }
+
+
+def allows(deadline, stage: str) -> bool:
+    """Deadline.allows, treating a missing deadline as unlimited"""
+    return deadline is None or deadline.allows(stage)
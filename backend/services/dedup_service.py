@@ -0,0 +1,321 @@
+"""
+Dedup Service - MinHash/LSH near-duplicate collapsing
+PubMed returns errata, duplicate publications and reprints whose abstracts
+are near-identical; each would otherwise be embedded, cross-encoded and
+could fill several of the final top-k slots. Abstracts are reduced to
+DEDUP_NUM_PERM MinHash values over word DEDUP_SHINGLE_SIZE-shingles, and an
+LSH table of DEDUP_BANDS bands finds earlier articles that may match. A
+match whose estimated Jaccard similarity reaches DEDUP_THRESHOLD is dropped
+in favour of the article seen first. Abstracts shorter than
+MIN_ABSTRACT_WORDS (including PubMed's "No abstract available" placeholder)
+get no signature and are never collapsed: they say too little to tell
+distinct articles apart.
+
+Signatures are computed once per article: the local corpus stores them next
+to the article store at ingestion (minhash.u32, one row per store row), and
+fetched PubMed articles are kept in a process-wide LRU by PMID.
+"""
+import json
+import os
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+
+from backend.services.article_store_service import _map_file
+from backend.utils.config import (
+    DEDUP_ENABLED, DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_BANDS, DEDUP_SHINGLE_SIZE,
+    DEDUP_SIGNATURE_CACHE_SIZE
+)
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+SIGNATURES_FILE = "minhash.u32"
+SIGNATURES_MANIFEST = "minhash.json"
+SIGNATURES_VERSION = 1
+
+# Universal hashing modulo a Mersenne prime: (a * h + b) % P stays below
+# 2**62 for 31-bit h, so the numpy path never overflows uint64
+_PRIME = (1 << 31) - 1
+_SEED = 1
+# Row value for articles without a usable abstract (no hash reaches it)
+_EMPTY = 0xFFFFFFFF
+
+MIN_ABSTRACT_WORDS = 20
+
+_TOKEN = re.compile(r"\w+")
+
+
+class MinHasher:
+    """MinHash signatures of abstract word shingles"""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = _SEED,
+                 min_words: int = MIN_ABSTRACT_WORDS):
+        self.num_perm = num_perm
+        self.shingle_size = max(1, shingle_size)
+        self.min_words = max(1, min_words)
+        self.seed = seed
+        state = seed
+        params = []
+        for _ in range(2 * num_perm):
+            # Small LCG so signatures do not depend on the random module's algorithm
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            params.append(state >> 33)
+        self._a = [p % (_PRIME - 1) + 1 for p in params[:num_perm]]
+        self._b = [p % _PRIME for p in params[num_perm:]]
+        if HAS_NUMPY:
+            self._a_np = np.array(self._a, dtype=np.uint64)[:, None]
+            self._b_np = np.array(self._b, dtype=np.uint64)[:, None]
+
+    def shingles(self, text: str) -> set:
+        tokens = _TOKEN.findall((text or "").lower())
+        if len(tokens) < self.min_words:
+            return set()
+        k = min(self.shingle_size, len(tokens))
+        return {zlib.crc32(" ".join(tokens[i:i + k]).encode("utf-8")) % _PRIME
+                for i in range(len(tokens) - k + 1)}
+
+    def signature(self, text: str):
+        """array("I") of num_perm minimum hashes, or None for empty or too-short text"""
+        hashes = self.shingles(text)
+        if not hashes:
+            return None
+        if HAS_NUMPY:
+            values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))[None, :]
+            minimums = ((self._a_np * values + self._b_np) % _PRIME).min(axis=1)
+            return array("I", minimums.astype(np.uint32).tobytes())
+        return array("I", (min((a * h + b) % _PRIME for h in hashes) for a, b in zip(self._a, self._b)))
+
+    def manifest(self) -> dict:
+        return {"num_perm": self.num_perm, "shingle_size": self.shingle_size, "seed": self.seed,
+                "min_words": self.min_words}
+
+
+def similarity(first, second) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    if not first or not second or first[0] == _EMPTY or second[0] == _EMPTY:
+        return 0.0
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+class LSHIndex:
+    """
+    Banded LSH over signatures: two articles become candidates when all
+    rows of any band agree, then the full signatures are compared.
+    """
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, bands: int = DEDUP_BANDS, threshold: float = DEDUP_THRESHOLD):
+        self.bands = max(1, min(bands, num_perm))
+        self.rows_per_band = num_perm // self.bands
+        self.threshold = threshold
+        self._buckets = {}
+        self._signatures = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature):
+        width = self.rows_per_band
+        for band in range(self.bands):
+            yield band.to_bytes(2, "little") + signature[band * width:(band + 1) * width].tobytes()
+
+    def add(self, key, signature):
+        if signature is None:
+            return
+        self._signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(key)
+
+    def find(self, signature):
+        """Key of the most similar indexed article at or above threshold, else None"""
+        if signature is None:
+            return None
+        best, best_score = None, self.threshold
+        checked = set()
+        for band_key in self._band_keys(signature):
+            for key in self._buckets.get(band_key, ()):
+                if key in checked:
+                    continue
+                checked.add(key)
+                score = similarity(signature, self._signatures[key])
+                if score >= best_score:
+                    best, best_score = key, score
+        return best
+
+
+class NearDuplicateIndexBuilder:
+    """
+    Corpus ingestion: unique(papers) drops near-duplicates of articles
+    already written, and as a build_article_store observer it records each
+    written row's signature for save().
+    """
+
+    def __init__(self, collapse: bool = DEDUP_ENABLED, hasher: MinHasher = None):
+        self.collapse = collapse
+        self.hasher = hasher or MinHasher()
+        self.index = LSHIndex(self.hasher.num_perm)
+        self.collapsed = 0
+        self._pending = {}
+        self._rows = array("I")
+
+    def unique(self, papers):
+        # Rows are indexed in add(), which the store calls before pulling the
+        # next paper, so each paper is checked against everything written so far
+        passed = set()
+        for paper in papers:
+            pmid = int(paper["pmid"])
+            if pmid in passed:
+                # Repeated PMIDs are the store's to skip, not near-duplicates
+                yield paper
+                continue
+            signature = self.hasher.signature(paper.get("abstract", ""))
+            if self.collapse and self.index.find(signature) is not None:
+                self.collapsed += 1
+                continue
+            passed.add(pmid)
+            self._pending[pmid] = signature
+            yield paper
+
+    def add(self, row: int, paper: dict):
+        pmid = int(paper["pmid"])
+        if pmid in self._pending:
+            signature = self._pending.pop(pmid)
+        else:
+            signature = self.hasher.signature(paper.get("abstract", ""))
+        self.index.add(row, signature)
+        self._rows.extend(signature if signature is not None else [_EMPTY] * self.hasher.num_perm)
+
+    def save(self, path: str):
+        with open(os.path.join(path, SIGNATURES_FILE), "wb") as f:
+            self._rows.tofile(f)
+        manifest = dict(self.hasher.manifest(), version=SIGNATURES_VERSION,
+                        count=len(self._rows) // self.hasher.num_perm, collapsed=self.collapsed)
+        with open(os.path.join(path, SIGNATURES_MANIFEST), "w") as f:
+            json.dump(manifest, f)
+        self._pending.clear()
+
+
+class CorpusSignatures:
+    """Memory-mapped signatures of the local corpus, addressed by store row"""
+
+    def __init__(self, mm, view, num_perm: int):
+        self._mm = mm
+        self._view = view.cast("B").cast("I") if view.nbytes else memoryview(array("I"))
+        self.num_perm = num_perm
+
+    @classmethod
+    def open(cls, path: str, hasher: MinHasher) -> "CorpusSignatures":
+        with open(os.path.join(path, SIGNATURES_MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SIGNATURES_VERSION:
+            raise ValueError(f"Unsupported signature file version: {manifest.get('version')}")
+        if any(manifest.get(k) != v for k, v in hasher.manifest().items()):
+            raise ValueError("Corpus signatures were built with different MinHash settings")
+        mm, view = _map_file(os.path.join(path, SIGNATURES_FILE))
+        return cls(mm, view, manifest["num_perm"])
+
+    def signature(self, row: int):
+        start = int(row) * self.num_perm
+        values = array("I", self._view[start:start + self.num_perm])
+        return None if not values or values[0] == _EMPTY else values
+
+
+class _SignatureCache:
+    """LRU of PMID -> signature for articles outside the local corpus"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pmid):
+        with self._lock:
+            signature = self._entries.get(pmid)
+            if signature is not None:
+                self._entries.move_to_end(pmid)
+            return signature
+
+    def put(self, pmid, signature):
+        if self.max_entries <= 0 or signature is None:
+            return
+        with self._lock:
+            self._entries[pmid] = signature
+            self._entries.move_to_end(pmid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+hasher = MinHasher()
+signature_cache = _SignatureCache(DEDUP_SIGNATURE_CACHE_SIZE)
+
+_corpus_signatures = None
+_corpus_checked = False
+
+
+def get_corpus_signatures():
+    """Open the local corpus signatures once per process (None if absent or stale)"""
+    global _corpus_signatures, _corpus_checked
+    if not _corpus_checked:
+        _corpus_checked = True
+        from backend.utils.config import LOCAL_CORPUS_DIR
+        if LOCAL_CORPUS_DIR and os.path.exists(os.path.join(LOCAL_CORPUS_DIR, SIGNATURES_MANIFEST)):
+            try:
+                _corpus_signatures = CorpusSignatures.open(LOCAL_CORPUS_DIR, hasher)
+            except ValueError as e:
+                print(f"Ignoring corpus MinHash signatures: {e}")
+    return _corpus_signatures
+
+
+def paper_signature(paper: dict):
+    """Signature of a paper's abstract, reusing the corpus file or the PMID cache"""
+    pmid = paper.get("pmid")
+    if pmid:
+        signature = signature_cache.get(pmid)
+        if signature is not None:
+            return signature
+        corpus = get_corpus_signatures()
+        if corpus is not None:
+            from backend.services.article_store_service import get_article_store
+            store = get_article_store()
+            row = store.row_for_pmid(pmid) if store is not None else None
+            if row is not None:
+                signature = corpus.signature(row)
+                if signature is not None:
+                    return signature
+    signature = hasher.signature(paper.get("abstract", ""))
+    if pmid:
+        signature_cache.put(pmid, signature)
+    return signature
+
+
+class NearDuplicateFilter:
+    """Per-request collapsing of candidates; the first copy of each article wins"""
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.index = LSHIndex(hasher.num_perm, threshold=threshold)
+        self.collapsed = {}  # dropped PMID/title -> kept PMID/title
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, paper: dict) -> bool:
+        """Whether paper repeats one already kept; otherwise it is kept"""
+        signature = paper_signature(paper)
+        key = paper.get("pmid") or paper.get("title")
+        with self._lock:
+            kept = self.index.find(signature)
+            if kept is not None:
+                self.collapsed[key] = kept
+                return True
+            self.index.add(key, signature)
+            return False
+
+    def unique(self, papers) -> list:
+        return [paper for paper in papers if not self.is_duplicate(paper)]
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"collapsed": len(self.collapsed), "duplicates": dict(self.collapsed)}
@@ -0,0 +1,202 @@
+"""
+Extractive Service - Cited answers assembled from abstract sentences
+The low-latency alternative to the LLM (/ask with mode="fast") and the
+answer used when the LLM is unavailable or out of time. Abstracts are split
+into sentences, every sentence is scored against the question in one
+matrix product, and maximal marginal relevance picks relevant but
+non-redundant sentences until EXTRACTIVE_MAX_CHARS is reached. Each
+sentence is cited by its paper's position in the results.
+
+Sentence vectors are embeddings (cached per abstract) when the embedding
+model is available and the deadline allows, else TF-IDF over the papers.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from backend.services import retrieval_service
+from backend.services.deadline_service import allows
+from backend.services.tracing_service import span
+from backend.utils.config import EXTRACTIVE_MAX_CHARS, EXTRACTIVE_MMR_LAMBDA, EXTRACTIVE_SENTENCE_CACHE_SIZE
+
+np = retrieval_service.np
+
+# Structured-abstract headings ("RESULTS:") that start a sentence
+_HEADING = re.compile(r"^(?:[A-Z][A-Z&/ ]{2,40}):\s*")
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+_ABBREVIATIONS = ("et al.", "e.g.", "i.e.", "vs.", "approx.", "fig.", "no.", "dr.", "ref.")
+_MIN_SENTENCE_CHARS = 25
+
+# Nudge toward sentences from higher-ranked papers when relevance ties
+_PAPER_RANK_WEIGHT = 0.05
+# Sentences less similar to the question than this share of the best one are left out
+_MIN_RELATIVE_SIMILARITY = 0.5
+
+_NOTE = "Note: Sentences extracted from the abstracts without an LLM; consult medical professionals for detailed analysis."
+
+
+def split_sentences(text: str) -> list:
+    """Sentences of an abstract, without section headings or fragments"""
+    sentences = []
+    for piece in _BOUNDARY.split((text or "").strip()):
+        if sentences and sentences[-1].lower().endswith(_ABBREVIATIONS):
+            sentences[-1] = f"{sentences[-1]} {piece}"
+        else:
+            sentences.append(piece)
+    sentences = [_HEADING.sub("", " ".join(s.split())) for s in sentences]
+    return [s for s in sentences if len(s) >= _MIN_SENTENCE_CHARS]
+
+
+class _SentenceCache:
+    """LRU of abstract digest -> normalized sentence embeddings"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(abstract: str) -> bytes:
+        return hashlib.blake2b(abstract.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key):
+        with self._lock:
+            embeddings = self._entries.get(key)
+            if embeddings is not None:
+                self._entries.move_to_end(key)
+            return embeddings
+
+    def put(self, key, embeddings):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = embeddings
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+sentence_embeddings = _SentenceCache(EXTRACTIVE_SENTENCE_CACHE_SIZE)
+
+
+def _normalize(matrix):
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-8)
+
+
+def _embedding_vectors(query: str, abstracts: list, sentences_by_paper: list):
+    """(query vector, sentence matrix) from the embedding model, encoding only uncached abstracts"""
+    keys = [_SentenceCache.key(abstract) for abstract in abstracts]
+    blocks = [sentence_embeddings.get(key) for key in keys]
+    missing = [i for i, block in enumerate(blocks) if block is None]
+    if missing:
+        texts = [s for i in missing for s in sentences_by_paper[i]]
+        encoded = _normalize(np.asarray(retrieval_service.embed_model.encode(texts), dtype=np.float32))
+        start = 0
+        for i in missing:
+            block = encoded[start:start + len(sentences_by_paper[i])]
+            start += len(sentences_by_paper[i])
+            sentence_embeddings.put(keys[i], block)
+            blocks[i] = block
+    query_vector = _normalize(retrieval_service.embed_queries([query]))[0]
+    return query_vector, np.concatenate(blocks)
+
+
+def _tfidf_vectors(query: str, sentences: list):
+    """(query vector, sentence matrix) of L2-normalized TF-IDF over these sentences"""
+    tokenized = [retrieval_service._clean_text(s) for s in sentences]
+    vocabulary = {}
+    for tokens in tokenized:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+    counts = np.zeros((len(sentences) + 1, max(1, len(vocabulary))), dtype=np.float32)
+    for row, tokens in enumerate(tokenized):
+        for token in tokens:
+            counts[row, vocabulary[token]] += 1
+    for token in retrieval_service._clean_text(query):
+        if token in vocabulary:
+            counts[-1, vocabulary[token]] += 1
+    document_frequency = np.count_nonzero(counts[:-1], axis=0)
+    vectors = _normalize(counts * np.log((1 + len(sentences)) / (1 + document_frequency)))
+    return vectors[-1], vectors[:-1]
+
+
+def _select(similarity, relevance, vectors, lengths, max_chars: int, mmr_lambda: float) -> list:
+    """Greedy MMR over sentence indices within the character budget"""
+    selected = []
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    # The best sentence is always eligible, even with no overlap at all
+    available = similarity >= max(0.0, float(similarity.max())) * _MIN_RELATIVE_SIMILARITY
+    available[int(np.argmax(relevance))] = True
+    budget = max_chars
+    while budget > 0:
+        available &= lengths <= budget
+        if not available.any():
+            break
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(np.where(available, mmr, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        budget -= lengths[best]
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+
+def extractive_answer(query: str, papers: list, max_chars: int = EXTRACTIVE_MAX_CHARS,
+                      mmr_lambda: float = EXTRACTIVE_MMR_LAMBDA, deadline=None) -> str:
+    """Cited answer built from the papers' most relevant, least redundant sentences"""
+    if not papers:
+        return "No papers available to generate answer."
+
+    sentences, paper_of = [], []
+    sentences_by_paper, abstracts = [], []
+    for index, paper in enumerate(papers):
+        abstract = paper.get("abstract") or ""
+        paper_sentences = split_sentences(abstract) or ([abstract.strip()] if abstract.strip() else [])
+        # A sentence longer than the whole budget is cut so it can still be quoted
+        paper_sentences = [s if len(s) < max_chars else s[:max_chars - 2].rstrip() + "…" for s in paper_sentences]
+        sentences_by_paper.append(paper_sentences)
+        abstracts.append(abstract)
+        sentences.extend(paper_sentences)
+        paper_of.extend([index] * len(paper_sentences))
+    if not sentences:
+        return "The retrieved papers have no abstracts to answer from."
+
+    if np is None:
+        # Without numpy: the lead sentence of each paper, in rank order
+        selected, start, budget = [], 0, max_chars
+        for block in sentences_by_paper:
+            if block and len(block[0]) + 1 <= budget:
+                selected.append(start)
+                budget -= len(block[0]) + 1
+            start += len(block)
+    else:
+        query_vector = vectors = None
+        with span("answer.extractive", sentences=len(sentences)) as answer_span:
+            if retrieval_service.HAS_EMBEDDINGS and allows(deadline, "embed"):
+                try:
+                    query_vector, vectors = _embedding_vectors(query, abstracts, sentences_by_paper)
+                except Exception as e:
+                    print(f"Sentence embedding failed, using TF-IDF: {e}")
+            if vectors is None:
+                answer_span.set("tfidf", True)
+                query_vector, vectors = _tfidf_vectors(query, sentences)
+        ranks = np.asarray(paper_of, dtype=np.float32)
+        similarity = vectors @ query_vector
+        relevance = similarity + _PAPER_RANK_WEIGHT * (1 - ranks / len(papers))
+        lengths = np.fromiter((len(s) + 1 for s in sentences), dtype=np.int64, count=len(sentences))
+        selected = _select(similarity, relevance, vectors, lengths, max_chars, mmr_lambda)
+
+    lines = ["Key findings from the retrieved literature:", ""]
+    cited = set()
+    for i in selected:
+        cited.add(paper_of[i])
+        lines.append(f"- {sentences[i]} [{paper_of[i] + 1}]")
+
+    lines += ["", "Sources:"]
+    for index in sorted(cited):
+        paper = papers[index]
+        pmid = f" (PMID {paper['pmid']})" if paper.get("pmid") else ""
+        lines.append(f"[{index + 1}] {paper.get('title', 'Unknown')}{pmid}")
+    lines += ["", _NOTE]
+    return "\n".join(lines)
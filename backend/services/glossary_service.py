@@ -0,0 +1,206 @@
+"""
+Glossary Service - Plain-language definitions for /explain-term
+Definitions come from a tab-separated file (GLOSSARY_PATH) of
+"term|alias...<TAB>definition" lines, held in a character trie. Exact and
+prefix lookups walk the trie; misspellings are found with a bounded
+Levenshtein walk that prunes any branch already over the edit budget.
+Definitions fetched from the LLM on a glossary miss are remembered.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from backend.utils.config import GLOSSARY_PATH, GLOSSARY_MAX_EDITS, GLOSSARY_CACHE_SIZE
+
+_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+class GlossaryEntry(NamedTuple):
+    term: str
+    definition: str
+    aliases: tuple
+
+
+class GlossaryMatch(NamedTuple):
+    entry: GlossaryEntry
+    key: str
+    distance: int
+
+
+def normalize_term(term: str) -> str:
+    """Lowercase words joined by single spaces: "A-Fib " -> "a fib" """
+    return " ".join(_TOKEN_PATTERN.findall(term.lower()))
+
+
+class _Node:
+    __slots__ = ("children", "entry", "key")
+
+    def __init__(self):
+        self.children = {}
+        self.entry = None
+        self.key = None
+
+
+class Glossary:
+    """Trie of normalized terms and aliases, each pointing at its entry"""
+
+    def __init__(self, max_edits: int = GLOSSARY_MAX_EDITS, cache_size: int = GLOSSARY_CACHE_SIZE):
+        self._root = _Node()
+        self.max_edits = max_edits
+        self.cache_size = cache_size
+        self._learned = OrderedDict()
+        # Normalized misspelling -> fuzzy lookup result (None for a miss)
+        self._misspelled = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def add(self, term: str, definition: str, aliases=()):
+        entry = GlossaryEntry(term, definition, tuple(aliases))
+        for key in (term, *aliases):
+            key = normalize_term(key)
+            if not key:
+                continue
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, _Node())
+            if node.entry is None:
+                self.size += 1
+            node.entry = entry
+            node.key = key
+
+    def _find(self, key: str):
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix: str, limit: int = 10) -> list:
+        """Entries whose term or alias starts with prefix, shortest keys first"""
+        key = normalize_term(prefix)
+        node = self._find(key)
+        if node is None:
+            return []
+        found = []
+        level = [node]
+        while level and len(found) < limit:
+            next_level = []
+            for current in level:
+                if current.entry is not None:
+                    found.append(GlossaryMatch(current.entry, current.key, 0))
+                next_level.extend(child for _, child in sorted(current.children.items()))
+            level = next_level
+        return found[:limit]
+
+    def fuzzy(self, term: str, max_edits: int = None) -> list:
+        """Entries within max_edits Levenshtein edits of term, closest first"""
+        key = normalize_term(term)
+        max_edits = self.max_edits if max_edits is None else max_edits
+        found = []
+        width = len(key)
+        over = max_edits + 1
+        first_row = [min(column, over) for column in range(width + 1)]
+        # Depth-first over the trie, carrying one DP row per node. Only the
+        # band of columns within max_edits of the depth can stay in budget;
+        # everything outside it is clamped to max_edits + 1.
+        stack = [(child, char, 1, first_row) for char, child in self._root.children.items()]
+        while stack:
+            node, char, depth, previous = stack.pop()
+            low = max(1, depth - max_edits)
+            high = min(width, depth + max_edits)
+            row = [over] * (width + 1)
+            row[0] = min(depth, over)
+            best = row[0]
+            for column in range(low, high + 1):
+                cost = min(
+                    row[column - 1] + 1,
+                    previous[column] + 1,
+                    previous[column - 1] + (key[column - 1] != char),
+                    over,
+                )
+                row[column] = cost
+                if cost < best:
+                    best = cost
+            if node.entry is not None and row[width] <= max_edits:
+                found.append(GlossaryMatch(node.entry, node.key, row[width]))
+            # No extension of this prefix can come back under the budget
+            if best <= max_edits:
+                for next_char, child in node.children.items():
+                    stack.append((child, next_char, depth + 1, row))
+        found.sort(key=lambda match: (match.distance, len(match.key), match.key))
+        return found
+
+    def lookup(self, term: str):
+        """
+        Best GlossaryMatch for a term, or None: an exact term or alias, then a
+        remembered LLM definition, then the closest spelling within an edit
+        budget that grows with the term's length (none for 1-3 letters).
+        Fuzzy results are memoized, since the trie walk costs about a
+        millisecond against a few microseconds for an exact hit.
+        """
+        key = normalize_term(term)
+        if not key:
+            return None
+        node = self._find(key)
+        if node is not None and node.entry is not None:
+            return GlossaryMatch(node.entry, key, 0)
+        with self._lock:
+            entry = self._learned.get(key)
+            if entry is not None:
+                self._learned.move_to_end(key)
+                return GlossaryMatch(entry, key, 0)
+            if key in self._misspelled:
+                self._misspelled.move_to_end(key)
+                return self._misspelled[key]
+        budget = min(self.max_edits, 0 if len(key) <= 3 else 1 if len(key) <= 6 else 2)
+        matches = self.fuzzy(key, budget) if budget else []
+        match = matches[0] if matches else None
+        self._remember(self._misspelled, key, match)
+        return match
+
+    def learn(self, term: str, definition: str):
+        """Remember a definition from outside the glossary (LRU-bounded)"""
+        key = normalize_term(term)
+        if not key:
+            return
+        self._remember(self._learned, key, GlossaryEntry(term, definition, ()))
+        with self._lock:
+            self._misspelled.pop(key, None)
+
+    def _remember(self, cache: OrderedDict, key: str, value):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+
+def load_glossary(path: str = GLOSSARY_PATH) -> Glossary:
+    """Build a Glossary from a "term|alias...<TAB>definition" file"""
+    glossary = Glossary()
+    if path and os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.lstrip().startswith("#") or "\t" not in line:
+                    continue
+                names, definition = line.rstrip("\n").split("\t", 1)
+                names = [name.strip() for name in names.split("|") if name.strip()]
+                if names and definition.strip():
+                    glossary.add(names[0], definition.strip(), names[1:])
+    return glossary
+
+
+_glossary = None
+
+
+def get_glossary() -> Glossary:
+    """Process-wide glossary loaded from GLOSSARY_PATH on first use"""
+    global _glossary
+    if _glossary is None:
+        _glossary = load_glossary()
+    return _glossary
@@ -0,0 +1,200 @@
+"""
+Lexicon Service - Aho-Corasick matcher for allergen / medication vocabularies
+Vocabularies are plain text files (one term per line, '#' comments) named
+after their category, e.g. allergens.txt and medications.txt. Terms are
+matched on whole words over a single linear scan of the text, with overlaps
+(e.g. "beta blocker" and "blocker") all reported with their span offsets.
+"""
+import os
+import re
+from collections import deque
+from typing import NamedTuple
+
+from backend.utils.config import LEXICON_DIR
+
+# Words are runs of letters/digits; matching works on this token alphabet,
+# so every match starts and ends on a word boundary
+_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+class LexiconMatch(NamedTuple):
+    start: int
+    end: int
+    term: str
+    category: str
+
+
+def trie_pattern(words, separator: str = None) -> str:
+    """
+    Regex for a set of literals shaped as a prefix trie, so the engine does
+    one character test per step instead of trying every alternative.
+    With a separator, each space in a word matches that pattern instead.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [(separator if char == ' ' and separator else re.escape(char)) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional, so the longest keyword at a position wins
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+def _tokens(text: str) -> list:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class Lexicon:
+    """
+    Aho-Corasick automaton over word tokens. Add terms, then build() the
+    failure links once; matching is linear in the number of words scanned.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        # Per node: (term, category, term length in words)
+        self._output = [[]]
+        self._built = False
+        self._entry = None
+        self._longest = 1
+        # Normalized term -> categories
+        self._categories = {}
+        self.size = 0
+
+    def add(self, term: str, category: str):
+        tokens = _tokens(term)
+        if not tokens:
+            return
+        node = 0
+        for token in tokens:
+            next_node = self._goto[node].get(token)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][token] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._longest = max(self._longest, len(tokens))
+        entry = (" ".join(tokens), category, len(tokens))
+        if entry not in self._output[node]:
+            self._output[node].append(entry)
+            self._categories.setdefault(entry[0], set()).add(category)
+            self.size += 1
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first and merge suffix outputs"""
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                self._output[child] = self._output[child] + [
+                    entry for entry in self._output[self._fail[child]] if entry not in self._output[child]
+                ]
+        # Whole-token pattern for the terms' first words: the scan jumps
+        # straight to these instead of stepping through every word
+        if self._goto[0]:
+            self._entry = re.compile(r"(?<![^\W_])" + trie_pattern(self._goto[0]) + r"(?![^\W_])")
+        self._built = True
+        return self
+
+    def iter_matches(self, text: str, categories=None):
+        """Yield LexiconMatch for every (possibly overlapping) term in text"""
+        if not self._built:
+            self.build()
+        if self._entry is None:
+            return
+        goto, fail, output = self._goto, self._fail, self._output
+        lowered = text.lower()
+        # Lowercasing can change offsets (rare non-ASCII); then step every word
+        skip = len(lowered) == len(text)
+        if not skip:
+            lowered = text
+
+        position = 0
+        while True:
+            if skip:
+                entry = self._entry.search(lowered, position)
+                if entry is None:
+                    return
+                position = entry.start()
+            # Run the automaton until it falls back to the root
+            starts = deque(maxlen=self._longest)
+            node = 0
+            for match in _TOKEN_PATTERN.finditer(lowered, position):
+                token = match.group() if skip else match.group().lower()
+                while node and token not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(token, 0)
+                if node == 0:
+                    # Words that leave the automaton at the root never
+                    # belong to a match, so their offsets are not needed
+                    if skip:
+                        position = match.end()
+                        break
+                    continue
+                starts.append(match.start())
+                for term, category, length in output[node]:
+                    if categories is None or category in categories:
+                        yield LexiconMatch(starts[-length], match.end(), term, category)
+            else:
+                return
+
+    def terms(self) -> list:
+        """Every term, normalized to lowercase words joined by spaces"""
+        return list(self._categories)
+
+    def categories_of(self, phrase: str) -> set:
+        """Categories of a term, given as text it would match"""
+        return self._categories.get(" ".join(_tokens(phrase)), set())
+
+    def find(self, text: str, categories=None) -> list:
+        return list(self.iter_matches(text, categories))
+
+    def categories_in(self, text: str) -> set:
+        return {match.category for match in self.iter_matches(text)}
+
+
+def load_lexicon(directory: str = LEXICON_DIR) -> Lexicon:
+    """Build a Lexicon from every <category>.txt vocabulary in directory"""
+    lexicon = Lexicon()
+    if directory and os.path.isdir(directory):
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".txt"):
+                continue
+            category = filename[:-4]
+            with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                for line in f:
+                    term = line.split("#", 1)[0].strip()
+                    if term:
+                        lexicon.add(term, category)
+    return lexicon.build()
+
+
+_lexicon = None
+
+
+def get_lexicon() -> Lexicon:
+    """Process-wide lexicon loaded from LEXICON_DIR on first use"""
+    global _lexicon
+    if _lexicon is None:
+        _lexicon = load_lexicon()
+    return _lexicon
@@ -1,4 +1,14 @@
-from backend.utils.config import NVIDIA_MODEL, NVIDIA_API_KEY
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from backend.utils.config import NVIDIA_MODEL, NVIDIA_API_KEY, NVIDIA_BASE_URL
+from backend.utils.config import REPORT_CONTEXT_CHUNKS
+from backend.services.lexicon_service import Lexicon, get_lexicon
+from backend.services.report_index_service import ReportIndex, format_chunks
+from backend.services.deadline_service import allows
+from backend.services.extractive_service import extractive_answer
+from backend.services.profiling_service import propagate
+from backend.services.tracing_service import span, add_event
 
 # Try to import langchain with fallback
 try:
@@ -13,6 +23,14 @@ except ImportError:
 # Initialize LLM lazily
 _llm = None
 
+# Answer calls run here so a request deadline can stop waiting for them.
+# A call that missed its deadline keeps its worker until the model replies,
+# so requests with a deadline take a free slot or degrade at once instead
+# of queueing behind abandoned calls.
+_LLM_WORKERS = 8
+_llm_executor = ThreadPoolExecutor(max_workers=_LLM_WORKERS, thread_name_prefix="llm")
+_llm_slots = threading.BoundedSemaphore(_LLM_WORKERS)
+
 def _get_llm():
     global _llm
     if _llm is None:
@@ -20,21 +38,47 @@ def _get_llm():
             raise ImportError("langchain-nvidia-ai-endpoints not installed")
         if not NVIDIA_API_KEY:
             raise ValueError("NVIDIA_API_KEY not configured")
-        _llm = ChatNVIDIA(model=NVIDIA_MODEL)
+        _llm = ChatNVIDIA(model=NVIDIA_MODEL, base_url=NVIDIA_BASE_URL) if NVIDIA_BASE_URL else ChatNVIDIA(model=NVIDIA_MODEL)
     return _llm
 
-def generate_answer(query, papers):
+def llm_available() -> bool:
+    """True when the NVIDIA chat model can be called"""
+    return HAS_LANGCHAIN and bool(NVIDIA_API_KEY)
+
+def _invoke(prompt: str) -> str:
+    """Call the chat model in an llm.invoke span recording token counts"""
+    with span("llm.invoke", model=NVIDIA_MODEL, prompt_chars=len(prompt)) as llm_span:
+        response = _get_llm().invoke([HumanMessage(content=prompt)])
+        text = response.content if hasattr(response, 'content') else str(response)
+        # Estimated at ~4 characters per token when the reply has no usage data
+        usage = getattr(response, "usage_metadata", None) or {}
+        llm_span.set_attributes(
+            prompt_tokens=usage.get("input_tokens", len(prompt) // 4),
+            completion_tokens=usage.get("output_tokens", len(text) // 4),
+            tokens_estimated=not usage,
+        )
+    return text
+
+def complete_prompt(prompt: str) -> str:
+    """Send one prompt to the chat model and return the reply text"""
+    return _invoke(prompt)
+
+def generate_answer(query, papers, deadline=None):
     """
     Generate an answer using LLM based on query and papers.
-    Falls back to summary if LLM is not available.
+    Falls back to an extractive answer if LLM is not available, if every
+    LLM worker is still busy, or if the request deadline leaves too little
+    time for it or passes while waiting.
     """
     if not papers:
         return "No papers available to generate answer."
     
     # If LLM is available, use it
-    if HAS_LANGCHAIN:
+    if HAS_LANGCHAIN and not allows(deadline, "llm"):
+        deadline.degrade("extractive_answer")
+    elif HAS_LANGCHAIN:
         try:
-            llm = _get_llm()
+            _get_llm()
             
             context = "\n\n".join(
                 [f"Title: {p.get('title', 'Unknown')}\nAbstract: {p.get('abstract', 'N/A')}" 
@@ -53,32 +97,70 @@ Abstracts:
 {context}
 """
 
-            response = llm.invoke([HumanMessage(content=prompt)])
-            return response.content if hasattr(response, 'content') else str(response)
+            if not _llm_slots.acquire(blocking=deadline is None):
+                print("LLM workers all busy, using extractive answer")
+                add_event("fallback", to="extractive_answer", reason="llm_saturated")
+                deadline.degrade("extractive_answer")
+                return extractive_answer(query, papers, deadline=deadline)
+            try:
+                future = _llm_executor.submit(propagate(_invoke), prompt)
+            except BaseException:
+                _llm_slots.release()
+                raise
+            future.add_done_callback(lambda _: _llm_slots.release())
+            return future.result(timeout=deadline.remaining() if deadline is not None else None)
+        except FutureTimeout:
+            print("LLM generation missed the request deadline, using extractive answer")
+            deadline.degrade("extractive_answer")
         except Exception as e:
-            print(f"LLM generation failed: {e}, using fallback summary")
-    
-    # Fallback: Return a structured summary
-    answer = f"Based on the retrieved medical literature regarding '{query}':\n\n"
+            print(f"LLM generation failed: {e}, using extractive answer")
+            add_event("fallback", to="extractive_answer", reason=str(e))
     
-    for i, paper in enumerate(papers, 1):
-        title = paper.get('title', 'Unknown')
-        abstract = paper.get('abstract', 'No abstract available')
-        score = paper.get('rerank_score', paper.get('hybrid_score', 0))
-        
-        answer += f"{i}. [{title}]\n"
-        answer += f"   {abstract[:300]}...\n"
-        if score > 0:
-            answer += f"   (Relevance Score: {score:.3f})\n\n"
-    
-    answer += "\nNote: For detailed analysis, please consult with medical professionals."
-    return answer
+    return extractive_answer(query, papers, deadline=deadline)
+
+# Question words that route a report question to a handler
+REPORT_QUESTION_ROUTES = {
+    "allergy": ["allergy", "allergies", "allergic", "allergen", "allergens"],
+    "medication": ["medication", "medications", "medicine", "medicines", "drug", "drugs", "med", "meds"],
+    "diagnosis": ["diagnosis", "diagnoses", "diagnosed"],
+    "vital": ["vital", "vitals", "blood pressure", "heart rate"],
+}
+
+_route_lexicon = Lexicon()
+for _route, _words in REPORT_QUESTION_ROUTES.items():
+    for _word in _words:
+        _route_lexicon.add(_word, _route)
+_route_lexicon.build()
+
 
-def answer_report_question(query: str, report_text: str) -> str:
+def _report_lines(report_text: str, session=None):
+    """(lines, lowercased lines) of a report, reusing the session's copies"""
+    if session is not None:
+        return session.lines, session.lines_lower
+    return report_text.split('\n'), report_text.lower().split('\n')
+
+
+def _lines_naming(report_text: str, session, terms: set) -> list:
+    """Report lines that mention any of the given lexicon terms, in order"""
+    if session is not None:
+        return session.lines_naming(terms)
+    lines = {}
+    for match in get_lexicon().iter_matches(report_text):
+        if match.term in terms:
+            start = report_text.rfind('\n', 0, match.start) + 1
+            end = report_text.find('\n', match.end)
+            line = report_text[start:end if end != -1 else len(report_text)].strip()
+            lines[line] = None
+    return list(lines)
+
+
+def answer_report_question(query: str, report_text: str, session=None) -> str:
     """
     Answer a question about a medical report.
     Does NOT require papers - works directly with report text.
     Uses extraction logic by default for reliability.
+    A report session (see report_session_service) supplies the report
+    already split, lowercased and indexed, so nothing is re-scanned.
     """
     if not report_text or not query:
         return "Please provide both a report and a question."
@@ -91,16 +173,23 @@ def answer_report_question(query: str, report_text: str) -> str:
     
     # Use extraction logic for reliability (skip LLM for now)
     query_lower = query.lower()
-    report_lower = report_text.lower()
+    routes = _route_lexicon.categories_in(query)
+    # Specific allergens / medications named in the question
+    named = {}
+    for match in get_lexicon().iter_matches(query):
+        named.setdefault(match.category, set()).add(match.term)
     
-    if any(word in query_lower for word in ['allerg']):
+    if "allergy" in routes:
         print(f"[DEBUG] Detected allergy question")
-        lines = report_text.split('\n')
+        if "allergens" in named:
+            mentions = _lines_naming(report_text, session, named["allergens"])
+            if mentions:
+                return "Allergies in your report:\n" + "\n".join(mentions)
+        lines, lines_lower = _report_lines(report_text, session)
         
         # Find allergy section
         for i, line in enumerate(lines):
-            line_lower = line.lower()
-            if 'allerg' in line_lower:
+            if 'allerg' in lines_lower[i]:
                 print(f"[DEBUG] Found allergy keyword at line {i}: '{line}'")
                 # Get allergy lines  
                 allergy_lines = []
@@ -118,45 +207,49 @@ def answer_report_question(query: str, report_text: str) -> str:
         print(f"[DEBUG] No allergies found in report")
         return "No allergy information found in your report."
     
-    elif any(word in query_lower for word in ['medication', 'medicine', 'drug', 'med']):
+    elif "medication" in routes or "medications" in named:
         print(f"[DEBUG] Detected medication question")
-        lines = report_text.split('\n')
+        if "medications" in named:
+            mentions = _lines_naming(report_text, session, named["medications"])
+            if mentions:
+                return "Medications in your report:\n" + "\n".join(mentions)
+        lines, lines_lower = _report_lines(report_text, session)
         for i, line in enumerate(lines):
-            if any(word in line.lower() for word in ['medication', 'drug', 'medicine']):
+            if any(word in lines_lower[i] for word in ['medication', 'drug', 'medicine']):
                 med_lines = []
                 for j in range(i, min(i+5, len(lines))):
                     stripped = lines[j].strip()
-                    if stripped and not any(x in stripped.lower() for x in ['vital', 'diagnosis', 'procedure']):
+                    if stripped and not any(x in lines_lower[j] for x in ['vital', 'diagnosis', 'procedure']):
                         med_lines.append(stripped)
                 
                 if med_lines:
                     return "Medications in your report:\n" + "\n".join(med_lines)
         return "No medication information found in your report."
     
-    elif any(word in query_lower for word in ['diagnosis']):
+    elif "diagnosis" in routes:
         print(f"[DEBUG] Detected diagnosis question")
-        lines = report_text.split('\n')
+        lines, lines_lower = _report_lines(report_text, session)
         for i, line in enumerate(lines):
-            if 'diagnosis' in line.lower():
+            if 'diagnosis' in lines_lower[i]:
                 diag_lines = []
                 for j in range(i, min(i+5, len(lines))):
                     stripped = lines[j].strip()
-                    if stripped and not any(x in stripped.lower() for x in ['vital', 'medication']):
+                    if stripped and not any(x in lines_lower[j] for x in ['vital', 'medication']):
                         diag_lines.append(stripped)
                 
                 if diag_lines:
                     return "Diagnoses in your report:\n" + "\n".join(diag_lines)
         return "No diagnosis information found in your report."
     
-    elif any(word in query_lower for word in ['vital', 'blood pressure', 'heart rate']):
+    elif "vital" in routes:
         print(f"[DEBUG] Detected vital signs question")
-        lines = report_text.split('\n')
+        lines, lines_lower = _report_lines(report_text, session)
         for i, line in enumerate(lines):
-            if 'vital' in line.lower():
+            if 'vital' in lines_lower[i]:
                 vital_lines = []
                 for j in range(i, min(i+6, len(lines))):
                     stripped = lines[j].strip()
-                    if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'medication']):
+                    if stripped and not any(x in lines_lower[j] for x in ['diagnosis', 'medication']):
                         vital_lines.append(stripped)
                 
                 if vital_lines:
@@ -165,4 +258,24 @@ def answer_report_question(query: str, report_text: str) -> str:
     
     else:
         print(f"[DEBUG] Generic search - no specific handler for: {query_lower}")
+        index = session.index if session is not None else ReportIndex.build(report_text)
+        chunks = index.top_chunks(query, REPORT_CONTEXT_CHUNKS)
+        if chunks:
+            context = format_chunks(chunks)
+            if llm_available():
+                try:
+                    prompt = f"""You are helping a patient understand their medical report.
+Answer ONLY using the report excerpts below and cite their page and lines.
+If the excerpts do not contain the answer, say so.
+
+Question:
+{query}
+
+Report excerpts:
+{context}
+"""
+                    return complete_prompt(prompt)
+                except Exception as e:
+                    print(f"LLM report answer failed: {e}, returning report excerpts")
+            return "Most relevant parts of your report:\n\n" + context
         return f"Unable to find specific information about '{query}' in your report. Try asking about:\n- Allergies\n- Medications\n- Diagnoses\n- Vital signs"
\ No newline at end of file
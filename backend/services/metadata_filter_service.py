@@ -0,0 +1,286 @@
+"""
+Metadata Filter Service - Year / publication type / MeSH pre-filters
+Row sets are held in roaring-style bitmaps (2^16-row chunks stored as sorted
+arrays when sparse and bitsets when dense), one per year, publication type
+and MeSH descriptor of the local corpus.
+"""
+import json
+import mmap
+import os
+from array import array
+from functools import lru_cache
+
+FILTER_FIELDS = ("min_year", "max_year", "publication_types", "mesh_terms")
+
+METADATA_FILE = "metadata.json"
+BITMAPS_FILE = "metadata.bin"
+
+_CHUNK_BITS = 16
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+_BITSET_BYTES = (1 << _CHUNK_BITS) // 8
+# Above this many rows a chunk is cheaper as a bitset than as a uint16 array
+_ARRAY_LIMIT = 4096
+
+_ARRAY, _BITSET = 0, 1
+
+# Set-bit positions for every byte value
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+
+def _bitset_to_array(bits: int) -> array:
+    values = array("H")
+    for byte_index, byte in enumerate(bits.to_bytes(_BITSET_BYTES, "little")):
+        if byte:
+            base = byte_index * 8
+            values.extend(base + bit for bit in _BYTE_BITS[byte])
+    return values
+
+
+def _array_to_bitset(values) -> int:
+    bits = 0
+    for value in values:
+        bits |= 1 << value
+    return bits
+
+
+def _container(values=None, bits=None):
+    """Pick the compact representation for a chunk (None if empty)"""
+    if bits is not None:
+        count = bits.bit_count()
+        if count == 0:
+            return None
+        return bits if count > _ARRAY_LIMIT else _bitset_to_array(bits)
+    if not values:
+        return None
+    return _array_to_bitset(values) if len(values) > _ARRAY_LIMIT else values
+
+
+class RowBitmap:
+    """Compressed set of row ids supporting fast AND / OR"""
+
+    def __init__(self, containers=None):
+        self._containers = containers or {}
+
+    @classmethod
+    def from_rows(cls, rows) -> "RowBitmap":
+        chunks = {}
+        for row in sorted(set(int(r) for r in rows)):
+            chunks.setdefault(row >> _CHUNK_BITS, array("H")).append(row & _CHUNK_MASK)
+        return cls({high: _container(values=values) for high, values in chunks.items()})
+
+    def __len__(self):
+        return sum(c.bit_count() if isinstance(c, int) else len(c) for c in self._containers.values())
+
+    def __contains__(self, row):
+        container = self._containers.get(row >> _CHUNK_BITS)
+        if container is None:
+            return False
+        low = row & _CHUNK_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        return low in container
+
+    def __and__(self, other: "RowBitmap") -> "RowBitmap":
+        result = {}
+        for high in self._containers.keys() & other._containers.keys():
+            a, b = self._containers[high], other._containers[high]
+            if isinstance(a, int) and isinstance(b, int):
+                container = _container(bits=a & b)
+            elif isinstance(a, int) or isinstance(b, int):
+                bits, values = (a, b) if isinstance(a, int) else (b, a)
+                container = _container(values=array("H", (v for v in values if bits >> v & 1)))
+            else:
+                container = _container(values=array("H", sorted(set(a).intersection(b))))
+            if container is not None:
+                result[high] = container
+        return RowBitmap(result)
+
+    def __or__(self, other: "RowBitmap") -> "RowBitmap":
+        result = dict(self._containers)
+        for high, b in other._containers.items():
+            a = result.get(high)
+            if a is None:
+                result[high] = b
+                continue
+            if isinstance(a, int) or isinstance(b, int):
+                bits = (a if isinstance(a, int) else _array_to_bitset(a)) | \
+                       (b if isinstance(b, int) else _array_to_bitset(b))
+                result[high] = _container(bits=bits)
+            else:
+                result[high] = _container(values=array("H", sorted(set(a).union(b))))
+        return RowBitmap(result)
+
+    def to_rows(self) -> list:
+        """Sorted row ids"""
+        rows = []
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            values = _bitset_to_array(container) if isinstance(container, int) else container
+            base = high << _CHUNK_BITS
+            rows.extend(base + v for v in values)
+        return rows
+
+    def serialize(self) -> bytes:
+        header = array("I", [len(self._containers)])
+        payload = bytearray()
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, int):
+                header.extend((high, _BITSET, _BITSET_BYTES))
+                payload += container.to_bytes(_BITSET_BYTES, "little")
+            else:
+                header.extend((high, _ARRAY, len(container)))
+                payload += container.tobytes()
+        return header.tobytes() + bytes(payload)
+
+    @classmethod
+    def deserialize(cls, buffer) -> "RowBitmap":
+        buffer = memoryview(buffer)
+        count = int.from_bytes(buffer[:4], "little")
+        header = array("I")
+        header.frombytes(buffer[4:4 + 12 * count])
+        position = 4 + 12 * count
+        containers = {}
+        for i in range(count):
+            high, kind, length = header[3 * i:3 * i + 3]
+            if kind == _BITSET:
+                containers[high] = int.from_bytes(buffer[position:position + length], "little")
+                position += length
+            else:
+                values = array("H")
+                values.frombytes(buffer[position:position + 2 * length])
+                containers[high] = values
+                position += 2 * length
+        return cls(containers)
+
+
+def normalize_filters(values: dict):
+    """Drop unset filter fields; returns None when no filter is active"""
+    filters = {}
+    for field in FILTER_FIELDS:
+        value = (values or {}).get(field)
+        if value is None or value == [] or value == "":
+            continue
+        if field in ("publication_types", "mesh_terms"):
+            value = [v.strip() for v in value if v and v.strip()]
+            if not value:
+                continue
+        filters[field] = value
+    return filters or None
+
+
+def paper_matches_filters(paper: dict, filters) -> bool:
+    """
+    Check a fetched paper against filters. Values are OR'ed within a field
+    and AND'ed across fields; papers missing a filtered field do not match.
+    """
+    if not filters:
+        return True
+    year = paper.get("year")
+    if "min_year" in filters and (year is None or year < filters["min_year"]):
+        return False
+    if "max_year" in filters and (year is None or year > filters["max_year"]):
+        return False
+    for field in ("publication_types", "mesh_terms"):
+        if field in filters:
+            wanted = {v.lower() for v in filters[field]}
+            if not wanted & {v.lower() for v in paper.get(field) or []}:
+                return False
+    return True
+
+
+def _paper_keys(paper: dict) -> set:
+    keys = set()
+    if paper.get("year") is not None:
+        keys.add(f"year:{int(paper['year'])}")
+    for value in paper.get("publication_types") or []:
+        keys.add(f"pt:{value.lower()}")
+    for value in paper.get("mesh_terms") or []:
+        keys.add(f"mesh:{value.lower()}")
+    return keys
+
+
+class MetadataIndexBuilder:
+    """Collects per-key row lists while the article store is written"""
+
+    def __init__(self):
+        self._rows = {}
+
+    def add(self, row: int, paper: dict):
+        for key in _paper_keys(paper):
+            self._rows.setdefault(key, []).append(row)
+
+    def save(self, path: str):
+        offsets = {}
+        position = 0
+        with open(os.path.join(path, BITMAPS_FILE), "wb") as f:
+            for key in sorted(self._rows):
+                data = RowBitmap.from_rows(self._rows[key]).serialize()
+                f.write(data)
+                offsets[key] = [position, len(data)]
+                position += len(data)
+        with open(os.path.join(path, METADATA_FILE), "w") as f:
+            json.dump({"version": 1, "keys": offsets}, f)
+
+
+class MetadataIndex:
+    """Read-only bitmap index; bitmaps are decoded lazily from an mmap"""
+
+    def __init__(self, keys: dict, buffer):
+        self._keys = keys
+        self._buffer = memoryview(buffer)
+        self._years = sorted(int(k[5:]) for k in keys if k.startswith("year:"))
+        self.bitmap = lru_cache(maxsize=1024)(self._load_bitmap)
+
+    @classmethod
+    def open(cls, path: str) -> "MetadataIndex":
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            manifest = json.load(f)
+        with open(os.path.join(path, BITMAPS_FILE), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                buffer = b""
+            else:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(manifest["keys"], buffer)
+
+    def _load_bitmap(self, key: str) -> RowBitmap:
+        if key not in self._keys:
+            return RowBitmap()
+        start, length = self._keys[key]
+        return RowBitmap.deserialize(self._buffer[start:start + length])
+
+    def _union(self, keys) -> RowBitmap:
+        result = RowBitmap()
+        for key in keys:
+            result = result | self.bitmap(key)
+        return result
+
+    def resolve(self, filters):
+        """Turn filters into the set of allowed rows (None means unfiltered)"""
+        if not filters:
+            return None
+
+        allowed = None
+        if "min_year" in filters or "max_year" in filters:
+            low = filters.get("min_year", float("-inf"))
+            high = filters.get("max_year", float("inf"))
+            allowed = self._union(f"year:{y}" for y in self._years if low <= y <= high)
+        for field, prefix in (("publication_types", "pt"), ("mesh_terms", "mesh")):
+            if field in filters:
+                bitmap = self._union(f"{prefix}:{v.lower()}" for v in filters[field])
+                allowed = bitmap if allowed is None else allowed & bitmap
+        return allowed
+
+
+_metadata_index = None
+
+
+def get_metadata_index():
+    """Load the local corpus metadata bitmaps once per process (None if absent)"""
+    global _metadata_index
+    if _metadata_index is None:
+        from backend.utils.config import LOCAL_CORPUS_DIR
+        if not LOCAL_CORPUS_DIR or not os.path.exists(os.path.join(LOCAL_CORPUS_DIR, METADATA_FILE)):
+            return None
+        _metadata_index = MetadataIndex.open(LOCAL_CORPUS_DIR)
+    return _metadata_index
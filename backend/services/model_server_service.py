@@ -0,0 +1,352 @@
+"""
+Model Server Service - One process owning the embedding and rerank models
+With MODEL_SERVER_SOCKET set, retrieval_service and reranker_service do not
+load the SentenceTransformer / CrossEncoder themselves; embed_model and
+cross_encoder become clients that send encode / score requests to this
+server over a Unix domain socket. Every uvicorn worker then shares one copy
+of the models, and requests from all workers arriving within
+MODEL_SERVER_BATCH_WAIT_MS are run as one model call.
+Each client connection registers a shared-memory buffer of
+MODEL_SERVER_SHM_BYTES that the server writes float32 results into; larger
+results are sent inline on the socket.
+
+Run as: python -m backend.services.model_server_service [--socket PATH]
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+from backend.utils.config import (
+    MODEL_SERVER_SOCKET, MODEL_SERVER_MAX_BATCH, MODEL_SERVER_BATCH_WAIT_MS,
+    MODEL_SERVER_SHM_BYTES, MODEL_SERVER_TIMEOUT
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Every message is a 4-byte big-endian header length, a JSON header and
+# header["nbytes"] bytes of payload
+_LENGTH = struct.Struct(">I")
+
+
+class ModelServerError(RuntimeError):
+    """Raised when the model server is unreachable or rejects a request"""
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("model server connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b""):
+    header = json.dumps(dict(header, nbytes=len(payload))).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(header)) + header + payload)
+
+
+def _recv(sock: socket.socket):
+    header = json.loads(_recv_exact(sock, _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))[0]))
+    payload = _recv_exact(sock, header["nbytes"]) if header.get("nbytes") else b""
+    return header, payload
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Open a client's buffer without letting this process unlink it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the segment with the resource tracker
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Batcher:
+    """Collects requests from every connection into one model call per batch"""
+
+    def __init__(self, run, max_batch: int, wait_seconds: float):
+        self._run = run
+        self.max_batch = max_batch
+        self.wait_seconds = wait_seconds
+        self._queue = queue.Queue()
+        self.calls = 0
+        self.items = 0
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, items: list) -> Future:
+        future = Future()
+        self._queue.put((items, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.perf_counter() + self.wait_seconds
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            inputs = [item for items, _ in batch for item in items]
+            try:
+                outputs = np.asarray(self._run(inputs), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.calls += 1
+            self.items += len(inputs)
+            start = 0
+            for items, future in batch:
+                future.set_result(outputs[start:start + len(items)])
+                start += len(items)
+
+
+class ModelServer:
+    """
+    Unix socket server over an embedder (.encode(texts)) and a scorer
+    (.predict(pairs)); either may be None if that model is not available.
+    """
+
+    def __init__(self, path: str, embedder, scorer, max_batch: int = MODEL_SERVER_MAX_BATCH,
+                 batch_wait_ms: float = MODEL_SERVER_BATCH_WAIT_MS):
+        self.path = path
+        self.started = time.time()
+        wait = batch_wait_ms / 1000
+        self._batchers = {}
+        if embedder is not None:
+            self._batchers["encode"] = _Batcher(embedder.encode, max_batch, wait)
+        if scorer is not None:
+            self._batchers["score"] = _Batcher(scorer.predict, max_batch, wait)
+        self._sock = None
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._sock.listen(128)
+        print(f"Model server listening on {self.path} (models: {', '.join(self._batchers) or 'none'})")
+        try:
+            while True:
+                conn, _ = self._sock.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "models": sorted(self._batchers),
+            "uptime_s": round(time.time() - self.started, 1),
+            "batches": {op: {"calls": b.calls, "items": b.items} for op, b in self._batchers.items()},
+        }
+
+    def _handle(self, conn: socket.socket):
+        shm = None
+        try:
+            while True:
+                try:
+                    header, _ = _recv(conn)
+                except ConnectionError:
+                    return
+                op = header.get("op")
+                if op == "hello":
+                    if shm is not None:
+                        shm.close()
+                    shm = _attach(header["shm"]) if header.get("shm") else None
+                    _send(conn, {"ok": True, "models": sorted(self._batchers)})
+                    continue
+                if op == "stats":
+                    _send(conn, dict(self.stats(), ok=True))
+                    continue
+                batcher = self._batchers.get(op)
+                if batcher is None:
+                    _send(conn, {"ok": False, "error": f"model for '{op}' is not loaded"})
+                    continue
+                try:
+                    result = batcher.submit(header["items"]).result()
+                except Exception as e:
+                    _send(conn, {"ok": False, "error": str(e)})
+                    continue
+                data = result.tobytes()
+                reply = {"ok": True, "shape": list(result.shape)}
+                if shm is not None and len(data) <= shm.size:
+                    shm.buf[:len(data)] = data
+                    _send(conn, dict(reply, shm_bytes=len(data)))
+                else:
+                    _send(conn, reply, data)
+        finally:
+            if shm is not None:
+                shm.close()
+            conn.close()
+
+
+class _Connection:
+    """One socket plus the shared-memory buffer the server writes results into"""
+
+    def __init__(self, path: str, timeout: float, shm_bytes: int):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.shm = None
+        try:
+            self.sock.connect(path)
+            if shm_bytes > 0:
+                self.shm = shared_memory.SharedMemory(create=True, size=shm_bytes)
+            _send(self.sock, {"op": "hello", "shm": self.shm.name if self.shm is not None else None})
+            _recv(self.sock)
+        except Exception:
+            self.close()
+            raise
+
+    def request(self, op: str, items: list):
+        _send(self.sock, {"op": op, "items": items})
+        header, payload = _recv(self.sock)
+        if not header.get("ok"):
+            raise ModelServerError(header.get("error", "model server error"))
+        if "shm_bytes" in header:
+            payload = bytes(self.shm.buf[:header["shm_bytes"]])
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+    def close(self):
+        self.sock.close()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class ModelServerClient:
+    """Thread-safe client; each concurrent caller gets its own pooled connection"""
+
+    def __init__(self, path: str = MODEL_SERVER_SOCKET, timeout: float = MODEL_SERVER_TIMEOUT,
+                 shm_bytes: int = MODEL_SERVER_SHM_BYTES):
+        self.path = path
+        self.timeout = timeout
+        self.shm_bytes = shm_bytes
+        self._idle = queue.LifoQueue()
+
+    def request(self, op: str, items: list):
+        """float32 results for op ("encode" or "score") over items"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = _Connection(self.path, self.timeout, self.shm_bytes)
+            except OSError as e:
+                raise ModelServerError(f"model server at {self.path} is unavailable: {e}") from e
+        try:
+            result = conn.request(op, items)
+        except ModelServerError:
+            self._idle.put(conn)
+            raise
+        except Exception as e:
+            conn.close()
+            raise ModelServerError(f"model server request failed: {e}") from e
+        self._idle.put(conn)
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class RemoteEmbedder:
+    """Stands in for SentenceTransformer: encode(texts) -> float32 array"""
+
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def encode(self, texts, **kwargs):
+        return self.client.request("encode", list(texts))
+
+
+class RemoteCrossEncoder:
+    """Stands in for CrossEncoder: predict(pairs) -> float32 scores"""
+
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def predict(self, pairs, **kwargs):
+        return self.client.request("score", [list(pair) for pair in pairs])
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_model_client() -> ModelServerClient:
+    """The process-wide client for MODEL_SERVER_SOCKET"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ModelServerClient(MODEL_SERVER_SOCKET)
+    return _client
+
+
+def load_models():
+    """
+    (embedder, scorer) for the server: the models retrieval_service and
+    reranker_service loaded, or fresh ones when those are remote clients
+    """
+    from backend.services import retrieval_service, reranker_service
+    embedder, scorer = retrieval_service.embed_model, reranker_service.cross_encoder
+    if isinstance(embedder, RemoteEmbedder) or isinstance(scorer, RemoteCrossEncoder):
+        try:
+            from sentence_transformers import SentenceTransformer, CrossEncoder
+        except ImportError:
+            return None, None
+        embedder = SentenceTransformer(retrieval_service.EMBED_MODEL_NAME)
+        scorer = CrossEncoder(reranker_service.RERANK_MODEL_NAME)
+    return embedder, scorer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the embedding and rerank models to API workers")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET, help="Unix socket path to listen on")
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("set MODEL_SERVER_SOCKET or pass --socket")
+    if np is None:
+        parser.error("numpy is required")
+    embedder, scorer = load_models()
+    if embedder is None:
+        parser.error("sentence-transformers is not installed")
+    ModelServer(args.socket, embedder, scorer).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
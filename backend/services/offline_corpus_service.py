@@ -0,0 +1,290 @@
+"""
+Offline Corpus Service - Ranked retrieval with no network access
+A versioned pack file (zip) bundles articles, BM25 postings and, when the
+embedding model was available at build time, precomputed MiniLM embeddings.
+It is loaded once per process and answers /ask when NCBI is unreachable or
+OFFLINE_MODE is set, which also makes it the fixture for CI and benchmarks.
+
+Build as: python -m backend.services.offline_corpus_service [--output PATH]
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import zipfile
+from array import array
+from collections import Counter
+
+from backend.services import retrieval_service
+from backend.services.query_planner_service import STOPWORDS
+from backend.services.sparse_index_service import BM25_K1, BM25_B
+from backend.services.vector_index_service import build_dense_index
+from backend.utils.config import OFFLINE_PACK_PATH, OFFLINE_CORPUS_SOURCE
+
+PACK_FORMAT = "automedrag-offline-pack"
+PACK_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+ARTICLES_FILE = "articles.jsonl"
+TERMS_FILE = "terms.json"
+ROWS_FILE = "postings_rows.i32"
+TFS_FILE = "postings_tfs.u16"
+DOC_LENS_FILE = "doc_lens.i32"
+EMBEDDINGS_FILE = "embeddings.f32"
+
+# Query terms found in more than this share of articles ("therapy",
+# "patients") are too generic to qualify an article on their own
+KEYWORD_MAX_DF = 0.1
+
+
+def _index_text(article: dict) -> str:
+    # The topic keyword is repeated so it outweighs generic words like "therapy"
+    topic = article.get('topic') or ''
+    return f"{article.get('title') or ''} {article.get('abstract') or ''} {topic} {topic} {topic}"
+
+
+def load_source(path: str = OFFLINE_CORPUS_SOURCE) -> list:
+    """Articles from a JSONL file of {id, topic, title, abstract} objects"""
+    articles = []
+    if path and os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    articles.append(json.loads(line))
+    return articles
+
+
+def source_digest(path: str = OFFLINE_CORPUS_SOURCE) -> str:
+    """sha256 of the source JSONL, or None when it is missing"""
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _postings(articles: list):
+    """BM25 postings in the sparse_index_service layout"""
+    by_term = {}
+    doc_lens = array("i")
+    for row, article in enumerate(articles):
+        tokens = retrieval_service._clean_text(_index_text(article))
+        doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            rows, tfs = by_term.setdefault(term, (array("i"), array("H")))
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+    terms = {}
+    all_rows, all_tfs = array("i"), array("H")
+    for term in sorted(by_term):
+        rows, tfs = by_term[term]
+        terms[term] = [len(all_rows), len(all_rows) + len(rows)]
+        all_rows.extend(rows)
+        all_tfs.extend(tfs)
+    return terms, all_rows, all_tfs, doc_lens
+
+
+def _embed(articles: list):
+    """Abstract embeddings as a flat float32 array, or None without the model"""
+    if not (retrieval_service.HAS_ML_PACKAGES and retrieval_service.HAS_EMBEDDINGS) or not articles:
+        return None, 0
+    vectors = retrieval_service.embed_model.encode([a.get("abstract") or a.get("title") or "" for a in articles])
+    vectors = retrieval_service.np.asarray(vectors, dtype="float32")
+    return array("f", vectors.ravel().tobytes()), vectors.shape[1]
+
+
+def build_offline_pack(articles: list, path: str, source_sha256: str = None) -> dict:
+    """Write a pack file for articles; returns its manifest"""
+    terms, rows, tfs, doc_lens = _postings(articles)
+    embeddings, dim = _embed(articles)
+    manifest = {
+        "format": PACK_FORMAT,
+        "version": PACK_VERSION,
+        "count": len(articles),
+        "avgdl": (sum(doc_lens) / len(doc_lens)) if doc_lens else 0.0,
+        "embedding_model": retrieval_service.EMBED_MODEL_NAME if embeddings is not None else None,
+        "dim": dim,
+        "source_sha256": source_sha256,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as pack:
+        pack.writestr(MANIFEST_FILE, json.dumps(manifest, indent=2))
+        pack.writestr(ARTICLES_FILE, "".join(json.dumps(a) + "\n" for a in articles))
+        pack.writestr(TERMS_FILE, json.dumps(terms))
+        pack.writestr(ROWS_FILE, rows.tobytes())
+        pack.writestr(TFS_FILE, tfs.tobytes())
+        pack.writestr(DOC_LENS_FILE, doc_lens.tobytes())
+        if embeddings is not None:
+            pack.writestr(EMBEDDINGS_FILE, embeddings.tobytes())
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def _column(data: bytes, typecode: str) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    return column
+
+
+class OfflineCorpus:
+    """
+    In-memory articles with BM25 postings and optional embeddings.
+    BM25 is scored in plain Python (packs are small), so offline retrieval
+    works even without numpy; embeddings add a fused dense score.
+    """
+
+    def __init__(self, articles: list, terms: dict, rows: array, tfs: array, doc_lens: array,
+                 avgdl: float, embeddings: array = None, dim: int = 0, manifest: dict = None):
+        self.articles = articles
+        self.manifest = manifest or {}
+        self._terms = terms
+        self._rows = rows
+        self._tfs = tfs
+        self._doc_lens = doc_lens
+        self._avgdl = avgdl or 1.0
+        self._topics = [set(retrieval_service._clean_text(a.get("topic"))) for a in articles]
+        self._dense = None
+        if embeddings is not None and dim and retrieval_service.HAS_ML_PACKAGES and retrieval_service.HAS_EMBEDDINGS:
+            vectors = retrieval_service.np.frombuffer(embeddings.tobytes(), dtype="float32").reshape(-1, dim)
+            self._dense = build_dense_index(vectors, "flat")
+
+    @classmethod
+    def open(cls, path: str, source: str = OFFLINE_CORPUS_SOURCE) -> "OfflineCorpus":
+        """
+        Load a pack file written by build_offline_pack. A pack built from a
+        different version of the source articles is rejected as stale.
+        """
+        with zipfile.ZipFile(path) as pack:
+            manifest = json.loads(pack.read(MANIFEST_FILE))
+            if manifest.get("format") != PACK_FORMAT or manifest.get("version") != PACK_VERSION:
+                raise ValueError(f"Unsupported offline pack: {manifest.get('format')} v{manifest.get('version')}")
+            digest = source_digest(source)
+            if digest and manifest.get("source_sha256") and manifest["source_sha256"] != digest:
+                raise ValueError(f"Offline pack is stale: built from another version of {source}")
+            articles = [json.loads(line) for line in pack.read(ARTICLES_FILE).decode("utf-8").splitlines() if line]
+            if len(articles) != manifest["count"]:
+                raise ValueError("Offline pack manifest does not match its articles")
+            embeddings = None
+            # Embeddings are only usable with the model that will embed queries
+            if (manifest.get("embedding_model") == retrieval_service.EMBED_MODEL_NAME
+                    and EMBEDDINGS_FILE in pack.namelist()):
+                embeddings = _column(pack.read(EMBEDDINGS_FILE), "f")
+            return cls(articles, json.loads(pack.read(TERMS_FILE)),
+                       _column(pack.read(ROWS_FILE), "i"), _column(pack.read(TFS_FILE), "H"),
+                       _column(pack.read(DOC_LENS_FILE), "i"), manifest["avgdl"],
+                       embeddings, manifest.get("dim", 0), manifest)
+
+    @classmethod
+    def from_articles(cls, articles: list) -> "OfflineCorpus":
+        """Index articles in memory (BM25 only) when no pack file exists"""
+        terms, rows, tfs, doc_lens = _postings(articles)
+        avgdl = (sum(doc_lens) / len(doc_lens)) if doc_lens else 0.0
+        return cls(articles, terms, rows, tfs, doc_lens, avgdl, manifest={"format": PACK_FORMAT, "built": "in-memory"})
+
+    def __len__(self):
+        return len(self.articles)
+
+    def _bm25(self, query_terms) -> dict:
+        n = len(self.articles)
+        scores = {}
+        for term in set(query_terms):
+            span = self._terms.get(term)
+            if span is None:
+                continue
+            df = span[1] - span[0]
+            idf = math.log((n - df + 0.5) / (df + 0.5) + 1)
+            for i in range(span[0], span[1]):
+                row, tf = self._rows[i], self._tfs[i]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lens[row] / self._avgdl)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def _matching_rows(self, query_terms) -> set:
+        """Rows whose topic is a query term or that contain a specific, non-stopword query term"""
+        rows = {row for row, topic in enumerate(self._topics) if topic and not topic.isdisjoint(query_terms)}
+        max_df = max(1, int(len(self.articles) * KEYWORD_MAX_DF))
+        for term in query_terms - STOPWORDS:
+            span = self._terms.get(term)
+            if span is not None and span[1] - span[0] <= max_df:
+                rows.update(self._rows[span[0]:span[1]])
+        return rows
+
+    def search(self, query: str, top_k: int = 3) -> list:
+        """
+        Ranked paper dicts for a query. Like the topic matching it replaces,
+        only articles whose topic the query names, or that share a specific
+        query term with it, are returned; generic words alone match nothing.
+        """
+        query_terms = set(retrieval_service._clean_text(query))
+        matching = self._matching_rows(query_terms)
+        bm25 = {row: score for row, score in self._bm25(query_terms).items() if row in matching}
+        if not bm25:
+            return []
+        rows = sorted(bm25)
+        scores = [bm25[row] for row in rows]
+        if self._dense is not None:
+            try:
+                np = retrieval_service.np
+                dense_scores, dense_rows = self._dense.search(retrieval_service.embed_queries([query]), len(self))[0]
+                dense = np.zeros(len(self), dtype=np.float32)
+                dense[dense_rows] = np.maximum(dense_scores, 0)
+                scores = retrieval_service._fuse_scores(dense[rows], np.asarray(scores, dtype=np.float32)).tolist()
+            except Exception as e:
+                print(f"Offline dense search failed, using BM25 only: {e}")
+        ranked = sorted(range(len(rows)), key=lambda i: (-scores[i], rows[i]))[:top_k]
+        return [self._paper(rows[i]) for i in ranked]
+
+    def _paper(self, row: int) -> dict:
+        article = self.articles[row]
+        return {
+            "title": article["title"],
+            "abstract": article["abstract"],
+            "topic": article.get("topic"),
+            "source": "offline",
+        }
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_offline_corpus() -> OfflineCorpus:
+    """
+    The process-wide offline corpus: OFFLINE_PACK_PATH if it exists,
+    otherwise the bundled source articles indexed in memory
+    """
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                corpus = None
+                if OFFLINE_PACK_PATH and os.path.isfile(OFFLINE_PACK_PATH):
+                    try:
+                        corpus = OfflineCorpus.open(OFFLINE_PACK_PATH)
+                    except Exception as e:
+                        print(f"Offline pack {OFFLINE_PACK_PATH} unusable ({e}), indexing source articles")
+                _corpus = corpus or OfflineCorpus.from_articles(load_source())
+    return _corpus
+
+
+def search_offline_corpus(query: str, top_k: int = 3) -> list:
+    """Ranked offline papers for a query (empty when nothing matches)"""
+    return get_offline_corpus().search(query, top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline corpus pack")
+    parser.add_argument("--source", default=OFFLINE_CORPUS_SOURCE, help="JSONL articles")
+    parser.add_argument("--output", default=OFFLINE_PACK_PATH, help="pack file to write")
+    args = parser.parse_args()
+    manifest = build_offline_pack(load_source(args.source), args.output, source_digest(args.source))
+    print(f"Wrote {args.output}: {manifest['count']} articles, "
+          f"embeddings: {manifest['embedding_model'] or 'none (model not installed)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Pipeline Service - Streaming producer/consumer chain for /ask
+fetch (esearch + streamed efetch parse) -> embedding batcher -> early rerank.
+Embedding starts on the first parsed articles while efetch is still
+streaming, and confident candidates are cross-encoded while the rest of the
+batch is still being embedded, so wall-clock approaches max(stage).
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from backend.services import pubmed_service, retrieval_service, reranker_service
+from backend.services.deadline_service import allows
+from backend.services.dedup_service import NearDuplicateFilter
+from backend.services.profiling_service import propagate
+from backend.services.tracing_service import span, current_span
+from backend.services.metadata_filter_service import paper_matches_filters
+from backend.services.offline_corpus_service import search_offline_corpus
+from backend.utils.config import (
+    PIPELINE_EMBED_BATCH, EARLY_RERANK_THRESHOLD, ARTICLE_CACHE_SIZE, OFFLINE_MODE, DEDUP_ENABLED
+)
+
+if retrieval_service.HAS_ML_PACKAGES:
+    import numpy as np
+
+_DONE = object()
+
+
+class StageTimer:
+    """Records when each stage first starts / last ends and its busy time"""
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._stages = {}
+        self._notes = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage; it is also traced as a pipeline.<name> span"""
+        started = time.perf_counter()
+        try:
+            with span(f"pipeline.{name}"):
+                yield
+        finally:
+            ended = time.perf_counter()
+            with self._lock:
+                entry = self._stages.setdefault(name, [started, ended, 0.0])
+                entry[0] = min(entry[0], started)
+                entry[1] = max(entry[1], ended)
+                entry[2] += ended - started
+
+    def note(self, name: str, value):
+        """Attach a non-timing detail (e.g. collapsed duplicates) to the summary"""
+        with self._lock:
+            self._notes[name] = value
+
+    def summary(self) -> dict:
+        """Per-stage start/end offsets and busy time (ms) plus overall wall-clock"""
+        total = time.perf_counter() - self._origin
+        stages = {
+            name: {
+                "start_ms": round((start - self._origin) * 1000, 1),
+                "end_ms": round((end - self._origin) * 1000, 1),
+                "busy_ms": round(busy * 1000, 1),
+            }
+            for name, (start, end, busy) in self._stages.items()
+        }
+        return {
+            "stages": stages,
+            "total_ms": round(total * 1000, 1),
+            "sum_of_stages_ms": round(sum(s["end_ms"] - s["start_ms"] for s in stages.values()), 1),
+            **self._notes,
+        }
+
+
+class _ArticleCache:
+    """LRU of PMID -> (paper, abstract embedding) shared across requests"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pmid):
+        if not pmid:
+            return None
+        with self._lock:
+            entry = self._entries.get(pmid)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(pmid)
+            else:
+                self.misses += 1
+            return entry
+
+    def put(self, pmid, paper, embedding):
+        if not pmid or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[pmid] = (paper, embedding)
+            self._entries.move_to_end(pmid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "capacity": self.max_entries,
+        }
+
+
+article_cache = _ArticleCache(ARTICLE_CACHE_SIZE)
+
+
+def _cached_articles(question, max_results, filters):
+    """(paper, embedding) pairs for PMIDs earlier searches found, without calling NCBI"""
+    pairs = []
+    for pmid in pubmed_service.cached_pubmed_ids(question, max_results, filters):
+        cached = article_cache.get(pmid)
+        if cached is not None:
+            pairs.append(cached)
+    return pairs
+
+
+def _produce(question, filters, extra_papers, max_results, out, timer, prior=None, fetch=True, deadline=None,
+             near_duplicates=None):
+    """
+    Producer: local hits, earlier candidates, cached PMIDs, then streamed
+    efetch articles. Near-duplicates of an emitted article are dropped here,
+    before they reach the embedder.
+    """
+    seen = set()
+    produced = 0
+    cache_hits = 0
+
+    def emit(paper, embedding=None):
+        nonlocal produced
+        key = paper.get("pmid") or paper.get("title")
+        if key in seen:
+            return
+        seen.add(key)
+        if near_duplicates is not None and near_duplicates.is_duplicate(paper):
+            return
+        produced += 1
+        out.put((paper, embedding))
+
+    try:
+        with timer.stage("fetch"):
+            for paper in extra_papers or []:
+                cached = article_cache.get(paper.get("pmid"))
+                emit(paper, cached[1] if cached is not None else None)
+            for paper, embedding in prior or []:
+                if paper_matches_filters(paper, filters):
+                    emit(paper, embedding)
+
+            if fetch and not OFFLINE_MODE and not allows(deadline, "fetch"):
+                deadline.degrade("cached_pubmed")
+                for cached in _cached_articles(question, max_results, filters):
+                    emit(*cached)
+            elif fetch:
+                try:
+                    if OFFLINE_MODE:
+                        raise ConnectionError("OFFLINE_MODE is set")
+                    id_list = pubmed_service.search_pubmed_ids(question, max_results, filters, deadline)
+                    missing = []
+                    for pmid in id_list:
+                        cached = article_cache.get(pmid)
+                        if cached is not None:
+                            cache_hits += 1
+                            emit(*cached)
+                        else:
+                            missing.append(pmid)
+                    current_span().set_attributes(pmids=len(id_list), article_cache_hits=cache_hits)
+                    if missing:
+                        for paper in pubmed_service.iter_pubmed_articles(missing, deadline):
+                            if paper_matches_filters(paper, filters):
+                                emit(paper)
+                except Exception as e:
+                    print(f"PubMed API error: {e}, using offline corpus")
+                    current_span().add_event("fallback", to="offline_corpus", reason=str(e))
+
+            if produced == 0:
+                for paper in search_offline_corpus(question, max_results if OFFLINE_MODE else 3):
+                    if paper_matches_filters(paper, filters):
+                        emit(paper)
+    finally:
+        if near_duplicates is not None:
+            timer.note("near_duplicates", near_duplicates.summary())
+        out.put(_DONE)
+
+
+def _early_rerank(query, candidates, scores, timer, deadline=None):
+    """Rerank worker: cross-encodes confident candidates as they arrive"""
+    while True:
+        batch = [candidates.get()]
+        while batch[-1] is not _DONE:
+            try:
+                batch.append(candidates.get_nowait())
+            except queue.Empty:
+                break
+        done = batch[-1] is _DONE
+        batch = [item for item in batch if item is not _DONE]
+
+        if batch and allows(deadline, "rerank"):
+            with timer.stage("rerank"):
+                try:
+                    batch_scores = reranker_service.score_pairs(query, [abstract for _, abstract in batch])
+                    for (idx, _), score in zip(batch, batch_scores or []):
+                        scores[idx] = score
+                except Exception as e:
+                    print(f"Early rerank failed: {e}")
+        if done:
+            return
+
+
+def _sequential(question, retrieval_query, filters, extra_papers, max_results, top_k, rerank_k, timer,
+                prior=None, fetch=True, scored=None, deadline=None, near_duplicates=None):
+    """Stage-by-stage path used when embeddings are not available (or there is no time for them)"""
+    with timer.stage("fetch"):
+        if not fetch:
+            papers = []
+        elif not OFFLINE_MODE and not allows(deadline, "fetch"):
+            deadline.degrade("cached_pubmed")
+            papers = [paper for paper, _ in _cached_articles(question, max_results, filters)]
+            papers = papers or search_offline_corpus(question)
+        else:
+            papers = pubmed_service.fetch_pubmed(question, max_results, filters=filters, deadline=deadline) or []
+        if filters:
+            papers = [p for p in papers if paper_matches_filters(p, filters)]
+        seen = {p.get("pmid") or p.get("title") for p in papers}
+        extra_papers = list(extra_papers or []) + [p for p, _ in prior or [] if paper_matches_filters(p, filters)]
+        for paper in extra_papers:
+            key = paper.get("pmid") or paper.get("title")
+            if key not in seen:
+                seen.add(key)
+                papers.append(paper)
+        if near_duplicates is not None:
+            papers = near_duplicates.unique(papers)
+            timer.note("near_duplicates", near_duplicates.summary())
+    if scored is not None:
+        scored.extend((paper, None) for paper in papers)
+    with timer.stage("retrieve"):
+        retrieved = retrieval_service.hybrid_retrieve(retrieval_query, papers, top_k, deadline)
+    with timer.stage("rerank"):
+        top_papers = reranker_service.rerank(retrieval_query, retrieved, rerank_k, deadline)
+    return top_papers
+
+
+def run_ask_pipeline(question, retrieval_query, filters=None, extra_papers=None,
+                     max_results=20, top_k=10, rerank_k=3, prior=None, fetch=True, scored=None, deadline=None):
+    """
+    Fetch, retrieve and rerank papers for /ask with overlapping stages.
+    question is sent to PubMed; retrieval_query (which may carry conversation
+    context) is used for scoring. prior holds (paper, embedding) pairs from
+    earlier turns of a conversation; with fetch=False only they and
+    extra_papers are ranked. If scored is a list, every scored
+    (paper, embedding) pair is appended to it. Stages check deadline (see
+    deadline_service) and take cheaper paths when it is close. Unless
+    DEDUP_ENABLED is off, near-duplicate articles are collapsed before
+    scoring and listed in timings["near_duplicates"].
+    Returns (top_papers, timings).
+    """
+    timer = StageTimer()
+    near_duplicates = NearDuplicateFilter() if DEDUP_ENABLED else None
+
+    if not (retrieval_service.HAS_ML_PACKAGES and retrieval_service.HAS_EMBEDDINGS) or not allows(deadline, "embed"):
+        top_papers = _sequential(question, retrieval_query, filters, extra_papers, max_results, top_k, rerank_k, timer,
+                                 prior, fetch, scored, deadline, near_duplicates)
+        return top_papers, timer.summary()
+
+    articles = queue.Queue()
+    producer = threading.Thread(target=propagate(_produce), daemon=True,
+                                args=(question, filters, extra_papers, max_results, articles, timer, prior, fetch,
+                                      deadline, near_duplicates))
+    producer.start()
+
+    candidates = queue.Queue()
+    rerank_scores = {}
+    reranker = None
+    if reranker_service.HAS_CROSS_ENCODER:
+        reranker = threading.Thread(target=propagate(_early_rerank), daemon=True,
+                                    args=(retrieval_query, candidates, rerank_scores, timer, deadline))
+        reranker.start()
+
+    papers, embeddings, dense_scores = [], [], []
+    try:
+        with timer.stage("embed"):
+            query_embedding = retrieval_service.embed_queries([retrieval_query])[0]
+            query_norm = np.linalg.norm(query_embedding) + 1e-8
+
+        # Consumer: micro-batch whatever has arrived so far
+        finished = False
+        while not finished:
+            batch = [articles.get()]
+            while batch[-1] is not _DONE and len(batch) < PIPELINE_EMBED_BATCH:
+                try:
+                    batch.append(articles.get_nowait())
+                except queue.Empty:
+                    break
+            finished = batch[-1] is _DONE
+            batch = [item for item in batch if item is not _DONE]
+            if not batch:
+                continue
+
+            with timer.stage("embed"):
+                to_encode = [i for i, (_, embedding) in enumerate(batch) if embedding is None]
+                current_span().set_attributes(batch_size=len(to_encode), cached_embeddings=len(batch) - len(to_encode))
+                if to_encode:
+                    encoded = retrieval_service.embed_model.encode([batch[i][0].get("abstract", "") for i in to_encode])
+                    for i, embedding in zip(to_encode, encoded):
+                        paper = batch[i][0]
+                        embedding = np.asarray(embedding, dtype=np.float32)
+                        batch[i] = (paper, embedding)
+                        article_cache.put(paper.get("pmid"), paper, embedding)
+
+                for paper, embedding in batch:
+                    # Same dense score as the FAISS IndexFlatL2 path in rank_rows
+                    dense_scores.append(float(1 / (1 + np.sum((embedding - query_embedding) ** 2))))
+                    cosine = float(embedding @ query_embedding / ((np.linalg.norm(embedding) + 1e-8) * query_norm))
+                    if reranker is not None and cosine >= EARLY_RERANK_THRESHOLD:
+                        candidates.put((len(papers), paper.get("abstract", "")))
+                    papers.append(paper)
+                    embeddings.append(embedding)
+    except Exception as e:
+        print(f"Streaming pipeline failed, finishing sequentially: {e}")
+        producer.join()
+        while True:
+            item = articles.get()
+            if item is _DONE:
+                break
+            papers.append(item[0])
+        if scored is not None:
+            scored.extend((paper, None) for paper in papers)
+        if reranker is not None:
+            candidates.put(_DONE)
+            reranker.join()
+        with timer.stage("retrieve"):
+            retrieved = retrieval_service.hybrid_retrieve(retrieval_query, papers, top_k, deadline)
+        with timer.stage("rerank"):
+            top_papers = reranker_service.rerank(retrieval_query, retrieved, rerank_k, deadline)
+        return top_papers, timer.summary()
+
+    if reranker is not None:
+        candidates.put(_DONE)
+        reranker.join()
+
+    if scored is not None:
+        scored.extend(zip(papers, embeddings))
+
+    if not papers:
+        return [], timer.summary()
+
+    with timer.stage("score"):
+        abstracts = [p.get("abstract", "") for p in papers]
+        rows, hybrid_scores = retrieval_service.rank_with_dense_scores(retrieval_query, abstracts, dense_scores, top_k)
+
+    with timer.stage("rerank"):
+        fallback_scores = list(hybrid_scores)
+        if reranker is not None and not allows(deadline, "rerank"):
+            deadline.degrade("skipped_rerank")
+        elif reranker is not None:
+            pending = [row for row in rows if row not in rerank_scores]
+            try:
+                for row, score in zip(pending, reranker_service.score_pairs(retrieval_query, [abstracts[r] for r in pending]) or []):
+                    rerank_scores[row] = score
+                fallback_scores = [rerank_scores.get(row) for row in rows]
+            except Exception as e:
+                print(f"Cross-encoder failed, using hybrid scores: {e}")
+        order = sorted(range(len(rows)), key=lambda i: fallback_scores[i] if fallback_scores[i] is not None else float("-inf"),
+                       reverse=True)[:rerank_k]
+
+    top_papers = [
+        dict(papers[rows[i]], hybrid_score=hybrid_scores[i],
+             rerank_score=fallback_scores[i] if fallback_scores[i] is not None else hybrid_scores[i])
+        for i in order
+    ]
+    return top_papers, timer.summary()
@@ -0,0 +1,317 @@
+"""
+Profiling Service - Opt-in sampling profiles of single requests
+A request sent with "X-Profile: 1" (or ?profile=1) and a valid
+"X-Admin-Token" is profiled: every PROFILE_INTERVAL_MS a sampler thread
+reads the Python stack of each thread working on that request - the
+request's worker thread plus pipeline, PubMed, LLM and map-reduce threads
+it starts through propagate() - and counts the collapsed stacks.
+propagate() also runs those threads in the caller's contextvars context, so
+they see its trace span (tracing_service).
+
+The finished profile is written to PROFILE_DIR (the newest
+PROFILE_MAX_COUNT are kept) and can be fetched as speedscope JSON or as
+collapsed stacks for flamegraph.pl. Without a profiled request in flight
+no sampler thread runs.
+"""
+import contextvars
+import hmac
+import json
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.responses import JSONResponse
+
+from backend.utils.config import ADMIN_TOKEN, PROFILE_INTERVAL_MS, PROFILE_DIR, PROFILE_MAX_COUNT
+
+PROFILE_HEADER = "X-Profile"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_STDLIB = sysconfig.get_paths()["stdlib"]
+_FRAME = re.compile(r"^(.*) \((.*):(\d+)\)$")
+
+# The profile of the request being handled, set by the API middleware
+request_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+class ProfileNotFound(KeyError):
+    """Raised for unknown or expired profile ids"""
+
+    def __str__(self):
+        return f"Profile not found: {self.args[0]}"
+
+
+def admin_authorized(token) -> bool:
+    """Whether token matches ADMIN_TOKEN (always False when none is configured)"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(str(token or ""), ADMIN_TOKEN)
+
+
+def _frame_name(code) -> str:
+    path = code.co_filename
+    if "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[-1]
+    elif path.startswith(_ROOT):
+        path = os.path.relpath(path, _ROOT)
+    elif path.startswith(_STDLIB):
+        path = os.path.relpath(path, _STDLIB)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class Profile:
+    """Collapsed-stack sample counts for one request"""
+
+    def __init__(self, endpoint: str, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.profile_id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.interval_ms = interval_ms
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.stacks = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, label: str, frame):
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        names.append(label)
+        with self._lock:
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def finish(self):
+        self.duration_ms = round((time.time() - self.started_at) * 1000, 1)
+
+    def metadata(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "endpoint": self.endpoint,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "interval_ms": self.interval_ms,
+            "samples": self.samples,
+        }
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return dict(self.metadata(), stacks=dict(self.stacks))
+
+
+class _Sampler:
+    """One daemon thread sampling the attached threads while any are attached"""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._attached = {}  # thread ident -> (profile, label)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def attach(self, profile: Profile, label: str):
+        with self._lock:
+            self._attached[threading.get_ident()] = (profile, label)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def detach(self):
+        with self._lock:
+            self._attached.pop(threading.get_ident(), None)
+
+    def profile_of_current_thread(self):
+        entry = self._attached.get(threading.get_ident())
+        return entry[0] if entry is not None else None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._attached:
+                    self._thread = None
+                    return
+                attached = list(self._attached.items())
+            frames = sys._current_frames()
+            for ident, (profile, label) in attached:
+                frame = frames.get(ident)
+                if frame is not None:
+                    profile.record(label, frame)
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = _Sampler()
+
+
+@contextmanager
+def sampled(label: str):
+    """Sample the current thread for the active request profile, if any"""
+    profile = request_profile.get()
+    if profile is None:
+        yield
+        return
+    sampler.attach(profile, label)
+    try:
+        yield
+    finally:
+        sampler.detach()
+
+
+def propagate(func):
+    """
+    Wrap a thread or pool target so it runs in the calling thread's context
+    and, if the caller is being profiled, is sampled with its profile.
+    """
+    context = contextvars.copy_context()
+    profile = sampler.profile_of_current_thread() if sampler._attached else None
+    if profile is None:
+        # A fresh copy per call: one context cannot be entered by two threads at once
+        return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+    label = getattr(func, "__name__", "worker")
+
+    def run(*args, **kwargs):
+        sampler.attach(profile, label)
+        try:
+            return context.copy().run(func, *args, **kwargs)
+        finally:
+            sampler.detach()
+    return run
+
+
+class ProfileStore:
+    """Finished profiles as JSON files, keeping the newest max_count"""
+
+    def __init__(self, path: str = PROFILE_DIR, max_count: int = PROFILE_MAX_COUNT):
+        self.path = path
+        self.max_count = max_count
+
+    def _file(self, profile_id: str) -> str:
+        if not re.fullmatch(r"[0-9a-f]{32}", profile_id or ""):
+            raise ProfileNotFound(profile_id)
+        return os.path.join(self.path, f"{profile_id}.json")
+
+    def save(self, profile: Profile):
+        os.makedirs(self.path, exist_ok=True)
+        target = self._file(profile.profile_id)
+        with open(target + ".tmp", "w") as f:
+            json.dump(profile.to_dict(), f)
+        os.replace(target + ".tmp", target)
+        for old in self._files()[self.max_count:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _files(self) -> list:
+        """Profile files, newest first"""
+        if not os.path.isdir(self.path):
+            return []
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".json")]
+        return sorted(files, key=os.path.getmtime, reverse=True)
+
+    def get(self, profile_id: str) -> dict:
+        try:
+            with open(self._file(profile_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ProfileNotFound(profile_id)
+
+    def list(self) -> list:
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        for path in self._files():
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            data.pop("stacks", None)
+            profiles.append(data)
+        return profiles
+
+
+def to_collapsed(data: dict) -> str:
+    """Brendan Gregg's collapsed format: "root;caller;callee count" per line"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(data["stacks"].items()))
+
+
+def to_speedscope(data: dict) -> dict:
+    """A speedscope "sampled" profile, each sample weighted by the interval"""
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in data["stacks"].items():
+        sample = []
+        for name in stack.split(";"):
+            if name not in index:
+                index[name] = len(frames)
+                match = _FRAME.match(name)
+                frames.append({"name": match.group(1), "file": match.group(2), "line": int(match.group(3))}
+                              if match else {"name": name})
+            sample.append(index[name])
+        samples.append(sample)
+        weights.append(count * data["interval_ms"])
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{data['endpoint']} {data['profile_id']}",
+        "exporter": "automedrag",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": data["endpoint"],
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+profiles = ProfileStore()
+
+
+class ProfileMiddleware:
+    """
+    ASGI middleware profiling requests to paths that ask for it. The profile
+    is saved when the response starts (the request's threads are done by
+    then) and its id returned in the X-Profile-Id header.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        flag = headers.get(PROFILE_HEADER) or QueryParams(scope["query_string"]).get("profile")
+        if not flag or flag.lower() in ("0", "false", "no"):
+            return await self.app(scope, receive, send)
+        if not admin_authorized(headers.get(ADMIN_TOKEN_HEADER)):
+            response = JSONResponse(status_code=403, content={
+                "error": f"Profiling requires a valid {ADMIN_TOKEN_HEADER}", "status": "error"})
+            return await response(scope, receive, send)
+
+        profile = Profile(scope["path"].strip("/"))
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                profile.finish()
+                await run_in_threadpool(profiles.save, profile)
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile.profile_id)
+            await send(message)
+
+        token = request_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            request_profile.reset(token)
@@ -1,182 +1,290 @@
+import threading
+import time
 import requests
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 
-def fetch_pubmed(query: str, max_results: int = 20):
+from backend.services.offline_corpus_service import search_offline_corpus
+from backend.services.query_planner_service import plan_queries, combine_queries, merge_results
+from backend.services.profiling_service import propagate
+from backend.services.tracing_service import span, add_event, current_span
+from backend.utils.config import (
+    NCBI_API_KEY, NCBI_MAX_RPS, NCBI_EUTILS_URL, PUBMED_QUERY_FANOUT, OFFLINE_MODE, PUBMED_SEARCH_CACHE_SIZE
+)
+
+ESEARCH_URL = f"{NCBI_EUTILS_URL.rstrip('/')}/esearch.fcgi"
+EFETCH_URL = f"{NCBI_EUTILS_URL.rstrip('/')}/efetch.fcgi"
+
+
+class _RateLimiter:
+    """Spaces out requests process-wide to stay within the NCBI budget"""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, deadline=None):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if deadline is not None and slot - now >= deadline.remaining():
+                raise TimeoutError("request deadline reached waiting for the NCBI rate limit")
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# NCBI allows 3 requests/second without an API key and 10 with one
+_NCBI_RPS = NCBI_MAX_RPS or (10 if NCBI_API_KEY else 3)
+_rate_limiter = _RateLimiter(_NCBI_RPS)
+
+# One esearch per variant plus the efetch would queue ~1.3 s behind the
+# 3 req/s limit, so below 10 req/s the variants share one esearch
+_FANOUT = PUBMED_QUERY_FANOUT == "true" or (PUBMED_QUERY_FANOUT == "auto" and _NCBI_RPS >= 10)
+_COMBINED_VARIANTS = ("raw", "mesh")
+
+# Pooled keep-alive connections shared by all requests in this process
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pubmed")
+
+
+class _SearchCache:
+    """LRU of recent esearch results, (term, max_results) -> PMIDs"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            pmids = self._entries.get(key)
+            if pmids is not None:
+                self._entries.move_to_end(key)
+            return pmids
+
+    def put(self, key, pmids):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = pmids
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Lets a request short on time reuse what earlier searches found
+_search_cache = _SearchCache(PUBMED_SEARCH_CACHE_SIZE)
+
+
+def _ncbi_get(url: str, params: dict, deadline=None, trace_span=None, **kwargs):
     """
-    Fetch papers from PubMed API based on a search query.
-    If real API fails, returns mock data for demonstration.
+    GET an E-utilities endpoint through the pooled, rate-limited client.
+    The 10 s timeout is shortened to what is left of the request deadline.
     """
-    try:
-        search_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-        fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+    if NCBI_API_KEY:
+        params = dict(params, api_key=NCBI_API_KEY)
+    waited = time.perf_counter()
+    _rate_limiter.wait(deadline)
+    (trace_span or current_span()).set("ncbi.rate_limit_wait_ms", round((time.perf_counter() - waited) * 1000, 1))
+    timeout = deadline.timeout(10) if deadline is not None else 10
+    return _session.get(url, params=params, timeout=timeout, **kwargs)
+
+def build_search_term(query: str, filters=None) -> str:
+    """
+    Translate structured filters into esearch field tags.
+    Values are OR'ed within a field and AND'ed across fields.
+    """
+    if not filters:
+        return query
+
+    clauses = [f"({query})"]
+    if "min_year" in filters or "max_year" in filters:
+        clauses.append(f"({filters.get('min_year', 1800)}:{filters.get('max_year', 3000)}[dp])")
+    for field, tag in (("publication_types", "pt"), ("mesh_terms", "mh")):
+        if field in filters:
+            values = " OR ".join(f'"{v}"[{tag}]' for v in filters[field])
+            clauses.append(f"({values})")
+    return " AND ".join(clauses)
+
+def _parse_year(article):
+    """Publication year from PubDate/Year, falling back to MedlineDate"""
+    year_elem = article.find(".//PubDate/Year")
+    text = year_elem.text if year_elem is not None else None
+    if not text:
+        medline_elem = article.find(".//PubDate/MedlineDate")
+        text = medline_elem.text if medline_elem is not None else None
+    if text and text[:4].isdigit():
+        return int(text[:4])
+    return None
 
-        search_params = {
-            "db": "pubmed",
-            "term": query,
-            "retmax": max_results,
-            "retmode": "json"
-        }
+def _parse_article(article):
+    """Convert a PubmedArticle element to a paper dict (None if it has no abstract)"""
+    title_elem = article.find(".//ArticleTitle")
+    abstract_elem = article.find(".//AbstractText")
+    pmid_elem = article.find(".//PMID")
+    
+    if title_elem is None or abstract_elem is None:
+        return None
+    return {
+        "pmid": pmid_elem.text if pmid_elem is not None else None,
+        "title": title_elem.text or "Unknown Title",
+        "abstract": abstract_elem.text or "No abstract available",
+        "year": _parse_year(article),
+        "publication_types": [e.text for e in article.findall(".//PublicationType") if e.text],
+        "mesh_terms": [e.text for e in article.findall(".//MeshHeading/DescriptorName") if e.text]
+    }
 
-        search_res = requests.get(search_url, params=search_params, timeout=10).json()
-        id_list = search_res.get("esearchresult", {}).get("idlist", [])
+def _esearch(term: str, max_results: int, deadline=None) -> list:
+    """Run a single esearch and return the matching PMIDs"""
+    search_params = {
+        "db": "pubmed",
+        "term": term,
+        "retmax": max_results,
+        "retmode": "json"
+    }
 
-        if not id_list:
-            return _get_mock_papers(query)
+    with span("pubmed.esearch", term=term, max_results=max_results) as search_span:
+        response = _ncbi_get(ESEARCH_URL, search_params, deadline)
+        search_res = response.json()
+        pmids = search_res.get("esearchresult", {}).get("idlist", [])
+        search_span.set_attributes(pmids=len(pmids), **{"http.response.body.size": len(response.content)})
+    _search_cache.put((term, max_results), pmids)
+    return pmids
 
-        fetch_params = {
-            "db": "pubmed",
-            "id": ",".join(id_list),
-            "retmode": "xml"
-        }
+def _search_terms(query: str, filters=None) -> list:
+    """(weight, esearch term) pairs to run for a query under PUBMED_QUERY_FANOUT"""
+    if _FANOUT:
+        return [(weight, build_search_term(term, filters)) for _, term, weight in plan_queries(query)]
+    if PUBMED_QUERY_FANOUT == "auto":
+        plan = plan_queries(query, _COMBINED_VARIANTS)
+        if plan:
+            return [(1.0, build_search_term(combine_queries(plan), filters))]
+    return [(1.0, build_search_term(query, filters))]
 
-        fetch_res = requests.get(fetch_url, params=fetch_params, timeout=10)
+def search_pubmed_ids(query: str, max_results: int = 20, filters=None, deadline=None) -> list:
+    """
+    Run the planned query variants (raw, keywords, MeSH, synonyms)
+    concurrently and merge their PMIDs with per-variant weights; below the
+    API-key budget raw and MeSH go out as a single OR'ed esearch.
+    Variants still running when the deadline passes are dropped.
+    Raises only if every variant failed.
+    """
+    terms = _search_terms(query, filters)
+    if len(terms) == 1:
+        return _esearch(terms[0][1], max_results, deadline)
 
-        root = ET.fromstring(fetch_res.content)
+    with span("pubmed.search", query=query) as search_span:
+        esearch = propagate(_esearch)
+        futures = [
+            (weight, _executor.submit(esearch, term, max_results, deadline))
+            for weight, term in terms
+        ]
+        if deadline is not None:
+            wait([future for _, future in futures], timeout=deadline.remaining())
 
-        papers = []
-        for article in root.findall(".//PubmedArticle"):
+        results, errors = [], []
+        for weight, future in futures:
+            if not future.done():
+                errors.append(TimeoutError("request deadline reached during esearch"))
+                continue
             try:
-                title_elem = article.find(".//ArticleTitle")
-                abstract_elem = article.find(".//AbstractText")
-                
-                if title_elem is not None and abstract_elem is not None:
-                    papers.append({
-                        "title": title_elem.text or "Unknown Title",
-                        "abstract": abstract_elem.text or "No abstract available"
-                    })
+                results.append((weight, future.result()))
             except Exception as e:
-                print(f"Error parsing article: {e}")
-                continue
+                errors.append(e)
+        search_span.set_attributes(variants=len(terms), failed_variants=len(errors))
+        if errors and not results:
+            raise errors[0]
+        return merge_results(results, max_results)
 
-        # If no papers found, return mock data
-        if not papers:
-            return _get_mock_papers(query)
-        
-        return papers
-        
-    except Exception as e:
-        print(f"PubMed API error: {e}, using mock data")
-        return _get_mock_papers(query)
-
-def _get_mock_papers(query: str):
-    """Return mock papers for demonstration/testing purposes"""
-    mock_data = {
-        "diabetes": [
-            {"title": "Type 2 Diabetes Management and Metabolic Control", "abstract": "Recent advances in diabetes treatment include GLP-1 receptor agonists and SGLT2 inhibitors. These medications have shown significant benefits in glycemic control and cardiovascular protection."},
-            {"title": "Insulin Resistance and Metformin Therapy", "abstract": "Metformin remains the most commonly prescribed medication for type 2 diabetes. Its mechanism involves increasing insulin sensitivity and reducing hepatic glucose production."},
-            {"title": "Lifestyle Interventions in Diabetes Prevention", "abstract": "Comprehensive lifestyle modifications can prevent or delay the onset of type 2 diabetes by 58% over 3 years according to the Diabetes Prevention Program."}
-        ],
-        "hiv": [
-            {"title": "Antiretroviral Therapy Advances in HIV Treatment", "abstract": "Modern antiretroviral therapy (ART) with integrase inhibitors can achieve undetectable viral loads. U=U (Undetectable equals Untransmittable) is well-established in clinical practice."},
-            {"title": "Pre-Exposure Prophylaxis (PrEP) for HIV Prevention", "abstract": "PrEP with tenofovir/emtricitabine shows >90% efficacy in preventing HIV transmission when taken consistently for high-risk populations."},
-            {"title": "Long-Acting HIV Drugs and Treatment Adherence", "abstract": "Long-acting formulations of HIV medications administered monthly improve treatment adherence and patient satisfaction rates significantly."}
-        ],
-        "pneumonia": [
-            {"title": "Community-Acquired Pneumonia Treatment Guidelines", "abstract": "Community-acquired pneumonia remains a leading cause of infectious disease mortality. Empirical antibiotic therapy based on severity provides optimal outcomes."},
-            {"title": "Respiratory Support in Severe Pneumonia", "abstract": "Mechanically ventilated patients with pneumonia require lung-protective ventilation strategies. Early recognition of ARDS is crucial for improved survival."},
-            {"title": "Viral vs Bacterial Pneumonia Management", "abstract": "Distinguishing between viral and bacterial pneumonia helps guide appropriate antimicrobial therapy and reduces unnecessary antibiotic use."}
-        ],
-        "spondylitis": [
-            {"title": "Ankylosing Spondylitis and Spinal Inflammation", "abstract": "Ankylosing spondylitis is a chronic inflammatory disease affecting the spine and joints. TNF inhibitors have revolutionized treatment outcomes for spondylitis patients."},
-            {"title": "Biological Therapies in Spondyloarthritis Management", "abstract": "TNF-alpha inhibitors and IL-17 inhibitors show significant efficacy in reducing inflammation and improving mobility in ankylosing spondylitis."},
-            {"title": "Physiotherapy and Exercise in Ankylosing Spondylitis", "abstract": "Regular physical therapy and specific exercises help maintain spinal mobility and reduce pain in spondylitis patients."}
-        ],
-        "arthritis": [
-            {"title": "Rheumatoid Arthritis: Biologic Disease-Modifying Therapies", "abstract": "Disease-modifying antirheumatic drugs (DMARDs) and biologic agents have transformed rheumatoid arthritis outcomes. Early intervention improves long-term prognosis."},
-            {"title": "Osteoarthritis Management and Joint Preservation", "abstract": "Osteoarthritis treatment includes pharmacological and non-pharmacological approaches. Weight loss and exercise are fundamental non-drug interventions."},
-            {"title": "Anti-TNF Therapies in Rheumatoid Arthritis", "abstract": "TNF inhibitors significantly reduce joint inflammation and slow disease progression in rheumatoid arthritis patients."}
-        ],
-        "asthma": [
-            {"title": "Asthma Control and Inhaled Corticosteroid Therapy", "abstract": "Inhaled corticosteroids remain the gold standard for asthma management. Regular controller therapy prevents acute exacerbations."},
-            {"title": "Severe Asthma and Biologic Therapeutics", "abstract": "Monoclonal antibodies targeting IL-5, IgE, and IL-4 receptors have improved outcomes in severe asthma phenotypes."},
-            {"title": "Asthma Action Plans and Patient Education", "abstract": "Written asthma action plans and patient education improve medication adherence and reduce emergency department visits."}
-        ],
-        "cancer": [
-            {"title": "Immunotherapy Revolution in Oncology", "abstract": "Checkpoint inhibitors and CAR-T cell therapies have transformed cancer treatment. Response rates of 30-50% in previously difficult-to-treat cancers."},
-            {"title": "Precision Oncology and Genomic Profiling", "abstract": "Genomic profiling enables targeted cancer therapy based on tumor genetics. Personalized treatments show improved efficacy and reduced side effects."},
-            {"title": "Combination Chemotherapy in Advanced Cancers", "abstract": "Multi-agent chemotherapy regimens provide synergistic effects. Clinical trials demonstrate improved overall survival with combination approaches."}
-        ],
-        "hypertension": [
-            {"title": "Blood Pressure Management and Antihypertensive Agents", "abstract": "Current guidelines emphasize individualized blood pressure targets. ACE inhibitors and ARBs remain first-line agents for cardiovascular protection."},
-            {"title": "Resistant Hypertension and Combination Therapy", "abstract": "Combination therapy with two or more antihypertensive agents is required for resistant hypertension. Fixed-dose combinations improve adherence."},
-            {"title": "Lifestyle Modifications in Hypertension Control", "abstract": "Dietary sodium reduction, weight loss, and regular exercise significantly lower blood pressure and reduce cardiovascular risk."}
-        ],
-        "covid": [
-            {"title": "COVID-19 mRNA Vaccines and Pandemic Prevention", "abstract": "mRNA vaccines show >95% efficacy against severe COVID-19 disease. Vaccination campaigns have reduced hospitalizations worldwide."},
-            {"title": "Post-COVID Syndrome and Long-Term Complications", "abstract": "Approximately 10-30% of COVID-19 patients experience prolonged symptoms. Long COVID impacts multiple organ systems."},
-            {"title": "SARS-CoV-2 Antiviral Treatments and Therapeutics", "abstract": "Monoclonal antibodies and oral antivirals reduce severe COVID-19 outcomes when used early in infection."}
-        ],
-        "kidney": [
-            {"title": "Chronic Kidney Disease and Renal Function Preservation", "abstract": "ACE inhibitors and SGLT2 inhibitors slow CKD progression. Early intervention can preserve remaining renal function."},
-            {"title": "Glomerulonephritis and Kidney Inflammation", "abstract": "Immunosuppressive therapy is essential in rapidly progressive glomerulonephritis. Early diagnosis and treatment prevent progression to ESRD."},
-            {"title": "Dialysis and Renal Replacement Therapy Management", "abstract": "Hemodialysis and peritoneal dialysis maintain fluid and electrolyte balance in end-stage renal disease patients."}
-        ],
-        "gout": [
-            {"title": "Acute Gout Attack Management and NSAIDs", "abstract": "Acute gout is treated with NSAIDs, colchicine, or corticosteroids. Rapid inflammation reduction prevents chronic complications."},
-            {"title": "Uric Acid Lowering Therapy in Gout Prophylaxis", "abstract": "Allopurinol and febuxostat reduce serum uric acid levels. Xanthine oxidase inhibitors prevent recurrent gout attacks."},
-            {"title": "Purine-Restricted Diets and Lifestyle Modifications", "abstract": "Limiting purine-rich foods and alcohol reduces uric acid production. Weight loss and hydration improve gout outcomes."}
-        ],
-        "alzheimer": [
-            {"title": "Amyloid and Tau Pathology in Alzheimer's Disease", "abstract": "Alzheimer's disease involves accumulation of amyloid-beta plaques and tau tangles. Recent anti-amyloid monoclonal antibodies show promise in slowing cognitive decline in early stages."},
-            {"title": "Cognitive Decline Prevention and Lifestyle Interventions", "abstract": "Mediterranean diet, cognitive training, and physical exercise reduce Alzheimer's risk by up to 30%. Sleep quality and social engagement also play crucial roles."},
-            {"title": "Biomarkers and Early Detection of Neurodegenerative Disease", "abstract": "Plasma phosphorylated tau and amyloid-beta ratios enable early detection decades before symptom onset. Precision medicine approaches personalize treatment strategies."}
-        ],
-        "heart": [
-            {"title": "Coronary Artery Disease and Stent Interventions", "abstract": "Percutaneous coronary intervention (PCI) with bare-metal or drug-eluting stents treats acute coronary syndromes. Dual antiplatelet therapy reduces thrombotic complications."},
-            {"title": "Heart Failure Management with SGLT2 Inhibitors", "abstract": "SGLT2 inhibitors reduce hospitalizations and mortality in heart failure with reduced ejection fraction. Benefits extend across diabetic and non-diabetic populations."},
-            {"title": "Cardiovascular Risk Stratification and Prevention", "abstract": "Risk calculators incorporating lipid profiles, blood pressure, and inflammatory markers guide preventive strategies. Statins and ACE inhibitors remain cornerstone therapies."}
-        ],
-        "stroke": [
-            {"title": "Acute Ischemic Stroke Thrombolysis and Thrombectomy", "abstract": "Intravenous thrombolysis and mechanical thrombectomy restore cerebral blood flow. Time-is-brain principle emphasizes rapid intervention within critical windows."},
-            {"title": "Stroke Prevention in Atrial Fibrillation", "abstract": "Anticoagulation with DOACs reduces stroke risk by 65% in atrial fibrillation patients. Left atrial appendage closure offers alternative for anticoagulation-intolerant patients."},
-            {"title": "Neuroplasticity and Rehabilitation after Stroke", "abstract": "Intensive physical therapy and constraint-induced movement therapy promote neuroplastic recovery. Speech and occupational therapy improve functional outcomes post-stroke."}
-        ],
-        "depression": [
-            {"title": "Antidepressant Efficacy and Selective Serotonin Reuptake Inhibitors", "abstract": "SSRIs remain first-line pharmacotherapy for major depressive disorder. Response rates reach 60-70% with adequate dosing and treatment duration."},
-            {"title": "Psychotherapy and Cognitive Behavioral Therapy Outcomes", "abstract": "Cognitive behavioral therapy shows efficacy comparable to antidepressants. Combination therapy of medication and psychotherapy provides superior outcomes."},
-            {"title": "Treatment-Resistant Depression and Ketamine", "abstract": "Esketamine nasal spray provides rapid symptom improvement in treatment-resistant depression. Neuroplasticity changes occur within hours of administration."}
-        ],
-        "obesity": [
-            {"title": "GLP-1 Receptor Agonists for Weight Management", "abstract": "Semaglutide and tirzepatide produce 15-20% weight loss in obese patients. Cardiovascular benefits extend beyond weight reduction with improved metabolic parameters."},
-            {"title": "Bariatric Surgery and Metabolic Outcomes", "abstract": "Gastric bypass and sleeve gastrectomy produce sustained weight loss and remission of type 2 diabetes. Long-term nutritional monitoring prevents deficiency states."},
-            {"title": "Childhood Obesity Prevention and Family Interventions", "abstract": "Early lifestyle interventions during childhood prevent obesity trajectory. Parental involvement and school-based programs show 20-30% weight reduction rates."}
-        ],
-        "hepatitis": [
-            {"title": "Direct-Acting Antivirals in Hepatitis C Treatment", "abstract": "Sofosbuvir-based regimens achieve cure rates >95% in hepatitis C. Treatment duration of 8-12 weeks eliminates viral replication across genotypes."},
-            {"title": "Hepatitis B Immunization and Viral Suppression", "abstract": "Hepatitis B vaccines prevent infection in 95% of recipients. Antiviral agents like tenofovir or entecavir suppress viral replication and prevent cirrhosis."},
-            {"title": "Cirrhosis Prevention and Liver Function Preservation", "abstract": "Early treatment of hepatitis prevents progression to cirrhosis. Screening for hepatocellular carcinoma using ultrasound and AFP improves detection at early stages."}
-        ],
-        "crohns": [
-            {"title": "Inflammatory Bowel Disease and TNF Inhibitor Therapy", "abstract": "Infliximab and adalimumab induce remission in 60-70% of Crohn's disease patients. TNF inhibitors reduce hospitalizations and surgery requirements significantly."},
-            {"title": "Vedolizumab and Gut-Specific Integrin Blockade", "abstract": "Vedolizumab selectively targets gut immune cells with minimal systemic immunosuppression. Efficacy in Crohn's disease reaches 50-60% at 6 weeks."},
-            {"title": "Nutritional Management in Inflammatory Bowel Disease", "abstract": "Exclusive enteral nutrition achieves remission rates comparable to corticosteroids. Anti-inflammatory diets reduce flare frequency and improve quality of life."}
-        ],
-        "thyroid": [
-            {"title": "Hypothyroidism Management and Levothyroxine Replacement", "abstract": "Levothyroxine monotherapy treats most hypothyroidism cases effectively. TSH-suppressive therapy prevents thyroid cancer recurrence after total thyroidectomy."},
-            {"title": "Graves' Disease and Hyperthyroidism Treatment", "abstract": "Antithyroid medications, beta-blockers, and radioiodine therapy manage Graves' disease. Thyroid-stimulating immunoglobulin monitoring guides treatment decisions."},
-            {"title": "Thyroid Cancer Screening and Radioactive Iodine Ablation", "abstract": "Thyroid ultrasound and fine-needle aspiration biopsy diagnose thyroid malignancies. Radioactive iodine ablation treats differentiated thyroid cancer with excellent survival rates."}
-        ],
-        "lupus": [
-            {"title": "Systemic Lupus Erythematosus and Antimalarial Drugs", "abstract": "Hydroxychloroquine prevents lupus flares and reduces cumulative organ damage. Long-term use decreases mortality by 50% and prevents thrombosis."},
-            {"title": "Immunosuppressive Therapy in lupus nephritis", "abstract": "Cyclophosphamide or mycophenolate mofetil preserve renal function in lupus nephritis. Combined therapy with corticosteroids achieves remission in 70-80% of patients."},
-            {"title": "Lupus Anticoagulant and Thrombotic Manifestations", "abstract": "Antiphospholipid antibodies increase thrombotic risk in lupus. Anticoagulation with warfarin or DOACs prevents recurrent thrombosis in antiphospholipid syndrome."}
-        ],
-        "parkinson": [
-            {"title": "Dopamine Replacement Therapy in Parkinson's Disease", "abstract": "Levodopa with carbidopa remains gold standard for motor symptom management. Extended-release formulations provide continuous dopaminergic stimulation."},
-            {"title": "Deep Brain Stimulation for Advanced Parkinson's Disease", "abstract": "DBS reduces motor complications and improves quality of life in advanced Parkinson's. Subthalamic nucleus stimulation decreases dyskinesia by 60-70%."},
-            {"title": "Neuroprotective Strategies and Disease Modification", "abstract": "MAO-B inhibitors and GLP-1 agonists show potential neuroprotective effects. Experimental therapies targeting alpha-synuclein aggregation are in advanced trials."}
-        ]
+def cached_pubmed_ids(query: str, max_results: int = 20, filters=None) -> list:
+    """PMIDs earlier searches found for the same query variants, without calling NCBI"""
+    results = []
+    for weight, term in _search_terms(query, filters):
+        pmids = _search_cache.get((term, max_results))
+        if pmids is not None:
+            results.append((weight, pmids))
+    return merge_results(results, max_results) if results else []
+
+def iter_pubmed_articles(id_list, deadline=None):
+    """
+    Stream efetch XML and yield paper dicts as each PubmedArticle is parsed,
+    so downstream stages can start before the whole response has arrived.
+    Stops early (recording partial_fetch) once the deadline has passed.
+    """
+    fetch_params = {
+        "db": "pubmed",
+        "id": ",".join(id_list),
+        "retmode": "xml"
     }
-    
-    # Try to find matching mock data - exact keyword match first
-    query_lower = query.lower()
-    for keyword, papers in mock_data.items():
-        if keyword in query_lower:
-            return papers[:3]
-    
-    # If no exact match, search in content
-    for keyword, papers in mock_data.items():
-        if any(word in query_lower for word in keyword.split()):
-            return papers[:3]
-    
-    # Return empty if no match - don't return random data
+
+    # Not made current: the caller's own spans run between the yields
+    fetch_span = span("pubmed.efetch", ids=len(id_list))
+    articles = 0
+    fetch_res = None
+    try:
+        with _ncbi_get(EFETCH_URL, fetch_params, deadline, fetch_span, stream=True) as fetch_res:
+            fetch_res.raise_for_status()
+            fetch_res.raw.decode_content = True
+            for _, elem in ET.iterparse(fetch_res.raw, events=("end",)):
+                if elem.tag != "PubmedArticle":
+                    continue
+                if deadline is not None and deadline.expired():
+                    deadline.degrade("partial_fetch")
+                    fetch_span.set("partial", True)
+                    return
+                try:
+                    paper = _parse_article(elem)
+                    if paper is not None:
+                        articles += 1
+                        yield paper
+                except Exception as e:
+                    print(f"Error parsing article: {e}")
+                finally:
+                    elem.clear()
+    except Exception as e:
+        fetch_span.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        fetch_span.set("articles", articles)
+        if fetch_res is not None:
+            fetch_span.set("http.response.body.size", fetch_res.raw.tell())
+        fetch_span.end()
+
+def fetch_pubmed(query: str, max_results: int = 20, filters=None, deadline=None):
+    """
+    Fetch papers from PubMed API based on a search query.
+    Filters (see metadata_filter_service) are sent as esearch field tags.
+    If the API fails or finds nothing, falls back to the offline corpus;
+    with OFFLINE_MODE the offline corpus is searched directly.
+    """
+    if OFFLINE_MODE:
+        return search_offline_corpus(query, max_results)
+    with span("pubmed.fetch", query=query, max_results=max_results) as fetch_span:
+        try:
+            id_list = search_pubmed_ids(query, max_results, filters, deadline)
+
+            if not id_list:
+                add_event("fallback", to="offline_corpus", reason="no_pmids")
+                return search_offline_corpus(query)
+
+            papers = list(iter_pubmed_articles(id_list, deadline))
+            fetch_span.set("papers", len(papers))
+
+            # If no papers found, use the offline corpus
+            if not papers:
+                add_event("fallback", to="offline_corpus", reason="no_articles")
+                return search_offline_corpus(query)
+            
+            return papers
+            
+        except Exception as e:
+            print(f"PubMed API error: {e}, using offline corpus")
+            add_event("fallback", to="offline_corpus", reason=str(e))
+            return search_offline_corpus(query)
@@ -0,0 +1,107 @@
+"""
+Query Planner Service - PubMed query variants and result merging
+Produces the raw question, a keyword-only query and synonym / MeSH
+expansions, each with a weight used when merging their PMID lists.
+"""
+from backend.services.retrieval_service import MEDICAL_SYNONYMS, _clean_text
+
+# Question words that only dilute an implicit-AND PubMed query
+STOPWORDS = {
+    'what', 'which', 'who', 'when', 'where', 'why', 'how', 'are', 'the', 'for', 'and',
+    'with', 'does', 'can', 'should', 'latest', 'best', 'about', 'there', 'from', 'that',
+    'this', 'these', 'those', 'any', 'new', 'recent', 'current', 'patients', 'people',
+}
+
+# MeSH descriptors for the MEDICAL_SYNONYMS topics
+MESH_DESCRIPTORS = {
+    'pneumonia': 'Pneumonia',
+    'diabetes': 'Diabetes Mellitus',
+    'cancer': 'Neoplasms',
+    'hiv': 'HIV Infections',
+    'heart': 'Heart Diseases',
+    'infection': 'Infections',
+    'covid': 'COVID-19',
+    'hypertension': 'Hypertension',
+    'arthritis': 'Arthritis',
+    'spondylitis': 'Spondylitis',
+    'asthma': 'Asthma',
+    'kidney': 'Kidney Diseases',
+    'liver': 'Liver Diseases',
+    'thyroid': 'Thyroid Diseases',
+    'depression': 'Depression',
+    'alzheimer': 'Alzheimer Disease',
+    'migraine': 'Migraine Disorders',
+    'stroke': 'Stroke',
+    'obesity': 'Obesity',
+    'gout': 'Gout',
+}
+
+# Reciprocal-rank constant used when merging variant result lists
+RRF_K = 60
+
+# Weights per variant; the raw question is trusted most
+VARIANT_WEIGHTS = {
+    "raw": 1.0,
+    "keywords": 0.8,
+    "mesh": 0.7,
+    "synonyms": 0.5,
+}
+
+
+def plan_queries(question: str, names=None) -> list:
+    """
+    Build the list of (name, term, weight) query variants for a question,
+    limited to the given variant names if any.
+    Empty or duplicate variants are dropped.
+    """
+    variants = [("raw", question.strip())]
+
+    keywords = [w for w in _clean_text(question) if w not in STOPWORDS]
+    if keywords:
+        variants.append(("keywords", " ".join(keywords)))
+
+        topics = [w for w in keywords if w in MESH_DESCRIPTORS]
+        if topics:
+            others = [w for w in keywords if w not in MESH_DESCRIPTORS]
+            mesh = " AND ".join(f'"{MESH_DESCRIPTORS[w]}"[mh]' for w in topics)
+            variants.append(("mesh", " ".join([mesh] + others)))
+
+            expanded = []
+            for word in keywords:
+                if word in MEDICAL_SYNONYMS:
+                    # Synonyms include stems such as 'arthr', so truncate them;
+                    # PubMed rejects truncation of very short terms
+                    synonyms = [f"{s}*[tiab]" if len(s) >= 4 else f"{s}[tiab]"
+                                for s in MEDICAL_SYNONYMS[word] if len(s) >= 3 and s != word]
+                    expanded.append("(" + " OR ".join([word] + synonyms) + ")")
+                else:
+                    expanded.append(word)
+            variants.append(("synonyms", " AND ".join(expanded)))
+
+    plan = []
+    seen = set()
+    for name, term in variants:
+        if names is not None and name not in names:
+            continue
+        if term and term.lower() not in seen:
+            seen.add(term.lower())
+            plan.append((name, term, VARIANT_WEIGHTS[name]))
+    return plan
+
+
+def combine_queries(plan) -> str:
+    """One esearch term matching any of the planned variants"""
+    terms = [term for _, term, _ in plan]
+    return terms[0] if len(terms) == 1 else " OR ".join(f"({term})" for term in terms)
+
+
+def merge_results(results, max_results: int) -> list:
+    """
+    Merge per-variant PMID lists with weighted reciprocal-rank fusion.
+    results is a list of (weight, id_list); returns the deduped top PMIDs.
+    """
+    scores = {}
+    for weight, id_list in results:
+        for rank, pmid in enumerate(id_list):
+            scores[pmid] = scores.get(pmid, 0.0) + weight / (RRF_K + rank + 1)
+    return sorted(scores, key=lambda pmid: scores[pmid], reverse=True)[:max_results]
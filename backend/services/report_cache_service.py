@@ -0,0 +1,192 @@
+"""
+Report Cache Service - Upload size limits, spooling and a content-addressed cache
+UploadLimitMiddleware refuses upload bodies over REPORT_MAX_BYTES while they
+arrive, before the framework spools them. Accepted uploads are copied to a
+temporary file in chunks while being hashed (SHA-256); the hash keys a
+size-bounded LRU of parsed text, key sections and summary, so byte-identical
+re-uploads are answered without re-parsing.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from backend.services.report_extraction_service import ExtractionLimitError
+from backend.utils.config import REPORT_CACHE_DIR, REPORT_CACHE_MAX_BYTES, REPORT_MAX_BYTES, UPLOAD_CHUNK_SIZE
+
+
+# Multipart boundaries and part headers around the file itself
+_MULTIPART_SLACK = 64 * 1024
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware answering 413 for request bodies over max_bytes on the
+    given paths: at once when Content-Length says so, otherwise as soon as
+    the streamed body passes the limit, whatever error the app then makes
+    of the cut-off body.
+    """
+
+    def __init__(self, app, paths, max_bytes: int = REPORT_MAX_BYTES + _MULTIPART_SLACK):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(status_code=413, content={
+            "error": f"Report is larger than the {REPORT_MAX_BYTES / 2**20:.0f} MB limit",
+            "status": "error",
+        })
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        length = Headers(scope=scope).get("content-length", "")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(scope, receive, send)
+
+        state = {"received": 0, "too_large": False, "responded": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > self.max_bytes:
+                    state["too_large"] = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def send_or_reject(message):
+            if state["too_large"]:
+                # Replace the app's own error for the cut-off body
+                if message["type"] == "http.response.start" and not state["responded"]:
+                    state["responded"] = True
+                    await self._reject(scope, receive, send)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, send_or_reject)
+        except _BodyTooLarge:
+            if not state["responded"]:
+                state["responded"] = True
+                await self._reject(scope, receive, send)
+
+
+async def spool_upload(file, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Copy an UploadFile to a temporary file chunk by chunk, hashing as it goes.
+    Returns (path, sha256 hex digest, size); the caller removes the file.
+    Starlette has already received the whole body by now (UploadLimitMiddleware
+    bounds it); this enforces REPORT_MAX_BYTES on the file itself.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    suffix = os.path.splitext(file.filename or "")[1]
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > REPORT_MAX_BYTES:
+                    raise ExtractionLimitError(
+                        f"Report is larger than the {REPORT_MAX_BYTES / 2**20:.0f} MB limit"
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest(), size
+
+
+def cache_key(sha256: str, filename: str) -> str:
+    """Content hash plus format, since the extension selects the parser"""
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".") or "bin"
+    return f"{sha256}.{extension}"
+
+
+class ReportCache:
+    """
+    On-disk JSON entries named by cache key. Recency is the file mtime
+    (touched on every hit), so eviction stays LRU across worker processes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        """Return the cached result dict, or None"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict):
+        """Store an entry atomically, then evict least recently used entries"""
+        if self.max_bytes <= 0:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for item in os.scandir(self.directory):
+                if item.name.endswith(".json"):
+                    try:
+                        stat = item.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+report_cache = ReportCache(REPORT_CACHE_DIR, REPORT_CACHE_MAX_BYTES)
@@ -0,0 +1,287 @@
+"""
+Report Extraction Service - Parallel, bounded text extraction for uploads
+PDF pages are split across a process pool; DOCX paragraphs and table cells
+are read in document order. Every document is held to byte, page and time
+limits, and per-page timings are reported alongside the text.
+"""
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader
+from docx import Document
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from backend.utils.config import (
+    REPORT_MAX_BYTES,
+    REPORT_MAX_PAGES,
+    REPORT_EXTRACT_TIMEOUT,
+    REPORT_EXTRACT_WORKERS,
+    REPORT_PARALLEL_MIN_PAGES,
+)
+
+
+class ExtractionLimitError(ValueError):
+    """Raised when a document exceeds the configured extraction limits"""
+
+
+def _source_size(source) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    return os.path.getsize(source)
+
+
+def _open_source(source):
+    """PdfReader/Document accept a path or a binary stream"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+
+def check_report_size(source):
+    """Reject documents above REPORT_MAX_BYTES before parsing them"""
+    size = _source_size(source)
+    if size > REPORT_MAX_BYTES:
+        raise ExtractionLimitError(
+            f"Report is {size / 2**20:.1f} MB; the limit is {REPORT_MAX_BYTES / 2**20:.0f} MB"
+        )
+
+
+def _extract_page_range(source, start: int, end: int) -> list:
+    """Worker: extract pages [start, end) and time each one"""
+    reader = PdfReader(_open_source(source))
+    results = []
+    for number in range(start, end):
+        started = time.perf_counter()
+        text = reader.pages[number].extract_text() or ""
+        results.append((number, text, (time.perf_counter() - started) * 1000))
+    return results
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Process pool shared by all uploads (spawned, so no fork of model threads)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=REPORT_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _discard_pool(pool, terminate: bool = False):
+    """
+    Stop using a pool; the next upload starts a fresh one. With terminate,
+    its workers are killed mid-page (other uploads using the pool then see
+    BrokenProcessPool and finish in-process).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # ProcessPoolExecutor has no public way to kill busy workers before 3.14
+    processes = list((getattr(pool, "_processes", None) or {}).values()) if terminate else []
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _spooled(source):
+    """
+    The source as a file path, written to a temporary file if given as
+    bytes, so each range task sends the path rather than a copy of the PDF.
+    Returns (path, temporary).
+    """
+    if not isinstance(source, (bytes, bytearray)):
+        return source, False
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(source)
+    return path, True
+
+
+def _extract_parallel(source, limit: int, deadline: float, results: dict) -> bool:
+    """Fan page ranges out to the pool; returns True if the deadline hit first"""
+    pool = _get_pool()
+    path, temporary = _spooled(source)
+    try:
+        chunk = max(1, -(-limit // (REPORT_EXTRACT_WORKERS * 2)))
+        pending = {
+            pool.submit(_extract_page_range, path, start, min(start + chunk, limit))
+            for start in range(0, limit, chunk)
+        }
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Ranges still parsing would keep the workers busy past the deadline
+                _discard_pool(pool, terminate=True)
+                return True
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                for number, text, elapsed_ms in future.result():
+                    results[number] = (text, elapsed_ms)
+        return False
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        if temporary:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _join_pages(pages) -> str:
+    """Join page texts in O(n), one trailing newline per page as before"""
+    buffer = io.StringIO()
+    for text in pages:
+        buffer.write(text)
+        buffer.write("\n")
+    return buffer.getvalue()
+
+
+def iter_pdf_pages(source, max_pages: int = None):
+    """
+    Yield (page_number, text) one page at a time for streaming consumers.
+    Stops at the page limit; runs in the calling process.
+    """
+    check_report_size(source)
+    reader = PdfReader(_open_source(source))
+    limit = min(len(reader.pages), max_pages or REPORT_MAX_PAGES)
+    for number in range(limit):
+        yield number, reader.pages[number].extract_text() or ""
+
+
+def extract_pdf(source, max_pages: int = None, timeout: float = None) -> dict:
+    """
+    Extract PDF text, splitting page ranges across the process pool for
+    long documents. Pages beyond the page limit or unfinished at the
+    deadline are skipped and reported via truncated / timed_out.
+    """
+    check_report_size(source)
+    started = time.perf_counter()
+    max_pages = max_pages or REPORT_MAX_PAGES
+    timeout = timeout or REPORT_EXTRACT_TIMEOUT
+
+    reader = PdfReader(_open_source(source))
+    page_count = len(reader.pages)
+    limit = min(page_count, max_pages)
+    deadline = started + timeout
+    results = {}
+    timed_out = False
+
+    parallel = REPORT_EXTRACT_WORKERS > 1 and limit >= REPORT_PARALLEL_MIN_PAGES
+    if parallel:
+        try:
+            timed_out = _extract_parallel(source, limit, deadline, results)
+        except BrokenProcessPool as e:
+            print(f"PDF extraction pool failed, extracting the remaining pages in-process: {e}")
+            parallel = False
+
+    if not parallel:
+        for number in range(limit):
+            if number in results:
+                continue
+            if time.perf_counter() > deadline:
+                timed_out = True
+                break
+            page_started = time.perf_counter()
+            text = reader.pages[number].extract_text() or ""
+            results[number] = (text, (time.perf_counter() - page_started) * 1000)
+
+    if not results and page_count:
+        raise ExtractionLimitError(f"No pages could be extracted within {timeout:.0f}s")
+
+    pages = [results[n][0] for n in sorted(results)]
+    return {
+        "text": _join_pages(pages),
+        "pages": pages,
+        "page_numbers": sorted(results),
+        "page_timings_ms": [round(results[n][1], 2) for n in sorted(results)],
+        "page_count": page_count,
+        "truncated": page_count > limit,
+        "timed_out": timed_out,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _cell_texts(table: Table) -> list:
+    """Row texts for a table, skipping repeated cells of merged ranges"""
+    rows = []
+    for row in table.rows:
+        seen = set()
+        cells = []
+        for cell in row.cells:
+            if id(cell._tc) in seen:
+                continue
+            seen.add(id(cell._tc))
+            text = " ".join(p.text for p in cell.paragraphs).strip()
+            if text:
+                cells.append(text)
+        if cells:
+            rows.append(" | ".join(cells))
+    return rows
+
+
+def iter_docx_blocks(source):
+    """Yield paragraph and table-row texts in document order"""
+    check_report_size(source)
+    doc = Document(_open_source(source))
+    for child in doc.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            yield Paragraph(child, doc).text
+        elif tag == "tbl":
+            yield from _cell_texts(Table(child, doc))
+
+
+def extract_docx(source, timeout: float = None) -> dict:
+    """Extract DOCX paragraphs and table cells within the time limit"""
+    started = time.perf_counter()
+    deadline = started + (timeout or REPORT_EXTRACT_TIMEOUT)
+    blocks = []
+    timed_out = False
+    for text in iter_docx_blocks(source):
+        blocks.append(text)
+        if time.perf_counter() > deadline:
+            timed_out = True
+            break
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return {
+        "text": _join_pages(blocks),
+        "pages": [_join_pages(blocks)],
+        "page_numbers": [0],
+        "page_timings_ms": [round(elapsed_ms, 2)],
+        "page_count": 1,
+        "truncated": False,
+        "timed_out": timed_out,
+        "elapsed_ms": round(elapsed_ms, 2),
+    }
+
+
+def iter_report_pages(source, filename: str):
+    """Incremental page iterator for any supported format"""
+    filename_lower = filename.lower()
+    if filename_lower.endswith('.pdf'):
+        yield from (text for _, text in iter_pdf_pages(source))
+    elif filename_lower.endswith('.docx') or filename_lower.endswith('.doc'):
+        yield _join_pages(iter_docx_blocks(source))
+    else:
+        check_report_size(source)
+        if isinstance(source, (bytes, bytearray)):
+            yield bytes(source).decode('utf-8')
+        else:
+            with open(source, encoding='utf-8') as f:
+                yield f.read()
@@ -0,0 +1,169 @@
+"""
+Report Index Service - Per-report chunk retrieval for questions and summaries
+A report is cut into line-aligned chunks that remember their page, line and
+character offsets. Chunks are embedded once with the MiniLM model already
+loaded by the retrieval service and scored together with BM25, so a question
+only ever sees its top few chunks, however long the report is.
+"""
+import threading
+
+from backend.services import retrieval_service
+from backend.services.vector_index_service import build_dense_index
+from backend.utils.config import REPORT_CHUNK_CHARS
+
+
+def _split_long_line(line: str, max_chars: int):
+    """Yield (offset, piece) windows of an over-long line, breaking at spaces"""
+    offset = 0
+    while offset < len(line):
+        end = min(len(line), offset + max_chars)
+        if end < len(line):
+            space = line.rfind(' ', offset, end)
+            if space > offset:
+                end = space + 1
+        yield offset, line[offset:end]
+        offset = end
+
+
+def page_line_starts(pages, page_numbers) -> list:
+    """(1-based page number, first line) pairs for text joined by _join_pages"""
+    starts = []
+    line = 0
+    for page, number in zip(pages, page_numbers):
+        starts.append((number + 1, line))
+        line += page.count('\n') + 1
+    return starts
+
+
+def chunk_report(text: str, page_line_starts=None, max_chars: int = REPORT_CHUNK_CHARS) -> list:
+    """
+    Group consecutive lines into chunks of up to max_chars characters.
+    Chunks never span a page break; page_line_starts is a list of
+    (page_number, first_line) pairs from extraction. Each chunk is a dict
+    with text, page, line_start, line_end (inclusive), char_start, char_end.
+    """
+    page_starts = sorted(page_line_starts or [(1, 0)], key=lambda p: p[1])
+    chunks = []
+    current = []
+
+    def flush():
+        if current:
+            chunks.append({
+                "text": "\n".join(piece for _, _, piece in current),
+                "page": page,
+                "line_start": current[0][0],
+                "line_end": current[-1][0],
+                "char_start": current[0][1],
+                "char_end": current[-1][1] + len(current[-1][2]),
+            })
+            current.clear()
+
+    page_index = 0
+    page = page_starts[0][0]
+    size = 0
+    offset = 0
+    for number, line in enumerate(text.split('\n')):
+        while page_index + 1 < len(page_starts) and page_starts[page_index + 1][1] <= number:
+            flush()
+            size = 0
+            page_index += 1
+            page = page_starts[page_index][0]
+        if line.strip():
+            for start, piece in _split_long_line(line, max_chars):
+                if current and size + len(piece) > max_chars:
+                    flush()
+                    size = 0
+                current.append((number, offset + start, piece))
+                size += len(piece) + 1
+        offset += len(line) + 1
+    flush()
+    return chunks
+
+
+class ReportIndex:
+    """Hybrid (dense + BM25) search over one report's chunks"""
+
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+        self._tokens = [retrieval_service._clean_text(chunk["text"]) for chunk in chunks]
+        self._bm25 = None
+        if retrieval_service.HAS_ML_PACKAGES and chunks:
+            self._bm25 = retrieval_service.BM25Okapi([tokens or [""] for tokens in self._tokens])
+
+        self._dense = None
+        self._embedded = False
+        self._lock = threading.Lock()
+
+    def _dense_index(self):
+        """Embed the chunks on first use; None without the embedding model"""
+        with self._lock:
+            if not self._embedded:
+                self._embedded = True
+                if retrieval_service.HAS_ML_PACKAGES and retrieval_service.HAS_EMBEDDINGS and self.chunks:
+                    try:
+                        embeddings = retrieval_service.embed_model.encode([chunk["text"] for chunk in self.chunks])
+                        self._dense = build_dense_index(embeddings, "flat")
+                    except Exception as e:
+                        print(f"Report chunk embedding failed, using BM25 only: {e}")
+        return self._dense
+
+    @classmethod
+    def build(cls, text: str, page_line_starts=None, max_chars: int = REPORT_CHUNK_CHARS) -> "ReportIndex":
+        return cls(chunk_report(text, page_line_starts, max_chars))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _lexical_scores(self, query_tokens):
+        if self._bm25 is not None:
+            return retrieval_service.np.asarray(self._bm25.get_scores(query_tokens), dtype="float32")
+        # Without rank_bm25: count query words present in each chunk
+        query = set(query_tokens)
+        return [float(len(query.intersection(tokens))) for tokens in self._tokens]
+
+    def search(self, query: str, k: int = 4) -> list:
+        """Top-k (score, chunk) pairs for a question, best first"""
+        if not self.chunks:
+            return []
+        lexical = self._lexical_scores(retrieval_service._clean_text(query))
+        dense_index = self._dense_index()
+        if dense_index is None:
+            order = sorted(range(len(self.chunks)), key=lambda i: lexical[i], reverse=True)[:k]
+            return [(float(lexical[i]), self.chunks[i]) for i in order]
+
+        np = retrieval_service.np
+        scores, rows = dense_index.search(retrieval_service.embed_queries([query]), len(self.chunks))[0]
+        dense = np.zeros(len(self.chunks), dtype=np.float32)
+        dense[rows] = np.maximum(scores, 0)
+        fused = retrieval_service._fuse_scores(dense, np.maximum(lexical, 0))
+        order = np.argsort(-fused, kind="stable")[:k]
+        return [(float(fused[i]), self.chunks[i]) for i in order]
+
+    def top_chunks(self, query: str, k: int) -> list:
+        """The k most relevant chunks that match the query at all, in report order"""
+        return sorted((chunk for score, chunk in self.search(query, k) if score > 0),
+                      key=lambda chunk: chunk["char_start"])
+
+    def context(self, query: str, max_chars: int, k: int = None) -> list:
+        """
+        The most relevant chunks that fit in max_chars, in report order.
+        Reports shorter than max_chars are returned whole.
+        """
+        if sum(len(chunk["text"]) for chunk in self.chunks) <= max_chars:
+            return list(self.chunks)
+        selected = []
+        size = 0
+        for _, chunk in self.search(query, k or len(self.chunks)):
+            if size + len(chunk["text"]) > max_chars:
+                continue
+            selected.append(chunk)
+            size += len(chunk["text"])
+        return sorted(selected, key=lambda chunk: chunk["char_start"])
+
+
+def format_chunks(chunks: list) -> str:
+    """Chunk texts labelled with their page and line range"""
+    return "\n\n".join(
+        f"[Page {chunk['page']}, lines {chunk['line_start'] + 1}-{chunk['line_end'] + 1}]\n{chunk['text']}"
+        for chunk in chunks
+    )
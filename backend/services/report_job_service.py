@@ -0,0 +1,348 @@
+"""
+Report Job Service - Background processing of uploaded reports
+POST /jobs/summarize-report keeps the upload and returns a job_id at once.
+A pool of REPORT_JOB_WORKERS threads runs the parse -> extract -> summarize
+stages and records each stage's progress and partial result in SQLite
+(REPORT_JOB_DB), so job status survives restarts and unfinished jobs are
+picked up again. Every API process sharing the table works on it: a job
+is leased to one process at a time and only requeued once that lease
+lapses. Submissions beyond REPORT_JOB_MAX_QUEUE pending jobs are refused
+rather than queued.
+"""
+import json
+import os
+import queue
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from backend.services.report_cache_service import cache_key, report_cache
+from backend.services.report_index_service import page_line_starts
+from backend.services.report_parser_service import extract_report
+from backend.services.report_session_service import report_sessions
+from backend.services.report_summarizer_service import summarize_report
+from backend.utils.config import (
+    REPORT_JOB_DB, REPORT_JOB_DIR, REPORT_JOB_WORKERS, REPORT_JOB_MAX_QUEUE, REPORT_JOB_RETENTION, REPORT_JOB_LEASE
+)
+
+# Stage -> overall progress once that stage has finished
+STAGE_PROGRESS = {"queued": 0.0, "parse": 0.4, "extract": 0.6, "summarize": 1.0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    progress REAL NOT NULL,
+    result TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+
+class ReportJobNotFound(KeyError):
+    """Raised for an unknown or purged job_id"""
+
+    def __str__(self):
+        return "Report job not found."
+
+
+class ReportJobQueueFull(RuntimeError):
+    """Raised when REPORT_JOB_MAX_QUEUE jobs are already waiting or running"""
+
+
+def process_report(path: str, filename: str, digest: str, on_stage=None):
+    """
+    Parse, index and summarize one spooled upload, using the report cache.
+    on_stage(stage, partial_result) is called after each stage.
+    Returns (result, session, cached); result includes report_text.
+    """
+    notify = on_stage or (lambda stage, partial: None)
+    key = cache_key(digest, filename)
+
+    # Byte-identical uploads are served from the parsed-report cache
+    result = report_cache.get(key)
+    if result is not None:
+        session = report_sessions.create(filename, result["report_text"],
+                                         result["extraction"].get("page_line_starts"))
+        return result, session, True
+
+    # Extract text from report (bounded by the extraction limits)
+    extraction = extract_report(path, filename)
+    report_text = extraction["text"]
+    line_starts = page_line_starts(extraction["pages"], extraction["page_numbers"])
+    result = {
+        "extraction": {
+            "page_count": extraction["page_count"],
+            "pages_extracted": len(extraction["page_numbers"]),
+            "page_timings_ms": extraction["page_timings_ms"],
+            "truncated": extraction["truncated"],
+            "timed_out": extraction["timed_out"],
+            "elapsed_ms": extraction["elapsed_ms"],
+            "page_line_starts": line_starts
+        }
+    }
+    notify("parse", result)
+
+    # Split, segment and index the report once for follow-up questions
+    session = report_sessions.create(filename, report_text, line_starts)
+    result["key_sections"] = session.key_sections()
+    notify("extract", dict(result, report_id=session.report_id))
+
+    summary_result = summarize_report(report_text, session=session)
+    result["summary"] = summary_result["summary"]
+    result["report_text"] = report_text
+    # Only complete extractions are cached so a retry can do better
+    if not extraction["timed_out"]:
+        report_cache.put(key, result)
+    return result, session, False
+
+
+class ReportJobQueue:
+    """
+    SQLite-backed job table shared by every API process, plus a worker pool
+    in each. A worker leases a queued job to its process (owner + heartbeat);
+    a running job is requeued only once its owner stops heartbeating for
+    REPORT_JOB_LEASE seconds, or, on the same host, is no longer running it.
+    """
+
+    def __init__(self, db_path: str, upload_dir: str, workers: int, max_queue: int, retention: float,
+                 lease: float):
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retention = retention
+        self.lease = lease
+        self.owner = None
+        self._wake = queue.Queue()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+            # Tables created before leases lack the owner columns
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    try:
+                        db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                    except sqlite3.OperationalError:
+                        pass  # added by another process meanwhile
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.row_factory = sqlite3.Row
+        return db
+
+    def start(self):
+        """Start this process's workers and lease heartbeat; unfinished jobs of stopped processes are picked up"""
+        with self._lock:
+            if self._threads:
+                return
+            # Set here rather than at import, so forked workers get their own
+            self.owner = f"{socket.gethostname()}:{os.getpid()}"
+            with self._connect() as db:
+                db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                           (time.time() - self.retention,))
+            self._reclaim()
+            self._threads.append(threading.Thread(target=self._heartbeat, name="report-job-heartbeat", daemon=True))
+            for number in range(self.workers):
+                self._threads.append(threading.Thread(target=self._work, name=f"report-job-{number}", daemon=True))
+            for thread in self._threads:
+                thread.start()
+            for _ in range(self.workers):
+                self._wake.put(None)
+
+    def submit(self, path: str, filename: str, digest: str) -> str:
+        """Take ownership of a spooled upload and queue it; returns the job_id"""
+        self.start()
+        job_id = uuid.uuid4().hex
+        stored = os.path.join(self.upload_dir, job_id + os.path.splitext(filename or "")[1])
+        db = self._connect()
+        try:
+            # Counting and inserting in one write transaction keeps the limit across processes
+            db.execute("BEGIN IMMEDIATE")
+            pending = self._depth(db)
+            if pending >= self.max_queue:
+                raise ReportJobQueueFull(f"{pending} reports are already being processed; try again shortly")
+            shutil.move(path, stored)
+            now = time.time()
+            db.execute("INSERT INTO jobs (job_id, filename, sha256, path, status, stage, progress, result, "
+                       "created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', 'queued', 0.0, '{}', ?, ?)",
+                       (job_id, filename, digest, stored, now, now))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._wake.put(None)
+        return job_id
+
+    def _row(self, job_id: str):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise ReportJobNotFound(job_id)
+        return row
+
+    def get(self, job_id: str) -> dict:
+        """Status, stage, progress and (partial) result of a job"""
+        row = self._row(job_id)
+        return {
+            "job_id": row["job_id"],
+            "filename": row["filename"],
+            "sha256": row["sha256"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "result": json.loads(row["result"]),
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    @staticmethod
+    def _depth(db) -> int:
+        return db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def depth(self) -> int:
+        """Jobs waiting or running, across all processes sharing the job table"""
+        with self._connect() as db:
+            return self._depth(db)
+
+    def _update(self, job_id: str, **fields) -> bool:
+        """Update a job this process holds the lease on; False once the lease is lost"""
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as db:
+            return db.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ? AND owner = ? AND status = 'running'",
+                              (*fields.values(), job_id, self.owner)).rowcount > 0
+
+    def _owner_stopped(self, owner: str) -> bool:
+        """Whether a lease holder on this host no longer runs the job (other hosts rely on the heartbeat)"""
+        host, _, pid = (owner or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        # os.kill(pid, 0) is only a liveness probe on POSIX
+        if owner == self.owner or os.name != "posix":
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _reclaim(self):
+        """Requeue running jobs whose lease expired or whose owner on this host has exited"""
+        now = time.time()
+        with self._connect() as db:
+            rows = db.execute("SELECT job_id, owner, heartbeat FROM jobs WHERE status = 'running'").fetchall()
+            requeued = 0
+            for row in rows:
+                mine_but_idle = row["owner"] == self.owner and row["job_id"] not in self._running
+                if (row["heartbeat"] or 0) >= now - self.lease and not mine_but_idle \
+                        and not self._owner_stopped(row["owner"]):
+                    continue
+                requeued += db.execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0.0, owner = NULL, "
+                    "updated_at = ? WHERE job_id = ? AND status = 'running' AND owner IS ?",
+                    (now, row["job_id"], row["owner"])).rowcount
+        for _ in range(min(requeued, self.workers)):
+            self._wake.put(None)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._connect() as db:
+                    db.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'",
+                               (time.time(), self.owner))
+                self._reclaim()
+            except sqlite3.Error as e:
+                print(f"Report job heartbeat failed: {e}")
+
+    def _claim(self):
+        """Lease the oldest queued job to this process; None when nothing is queued"""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is not None:
+                now = time.time()
+                db.execute("UPDATE jobs SET status = 'running', stage = 'parse', owner = ?, heartbeat = ?, "
+                           "updated_at = ? WHERE job_id = ?", (self.owner, now, now, row["job_id"]))
+                self._running.add(row["job_id"])
+            db.commit()
+            return row
+        finally:
+            db.close()
+
+    def _work(self):
+        while True:
+            # Woken by submissions here; otherwise poll for jobs queued elsewhere or requeued
+            try:
+                self._wake.get(timeout=self.lease / 3)
+            except queue.Empty:
+                pass
+            while True:
+                try:
+                    job = self._claim()
+                except sqlite3.Error as e:
+                    print(f"Report job claim failed: {e}")
+                    break
+                if job is None:
+                    break
+                try:
+                    self._run(job)
+                except Exception as e:
+                    print(f"Report job {job['job_id']} crashed: {e}")
+                finally:
+                    self._running.discard(job["job_id"])
+
+    def _run(self, job):
+        job_id, path = job["job_id"], job["path"]
+        if not os.path.exists(path):
+            self._update(job_id, status="failed", error="Upload was lost before processing")
+            return
+
+        def on_stage(stage, partial):
+            following = {"parse": "extract", "extract": "summarize"}[stage]
+            self._update(job_id, stage=following, progress=STAGE_PROGRESS[stage], result=partial)
+
+        try:
+            result, session, cached = process_report(path, job["filename"], job["sha256"], on_stage)
+            result = {key: value for key, value in result.items() if key != "report_text"}
+            result.update(report_id=session.report_id, cached=cached)
+            finished = self._update(job_id, status="done", stage="done", progress=1.0, result=result)
+        except Exception as e:
+            finished = self._update(job_id, status="failed", error=str(e))
+        # After a lost lease the upload belongs to whichever process took the job over
+        if finished:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+report_jobs = ReportJobQueue(REPORT_JOB_DB, REPORT_JOB_DIR, REPORT_JOB_WORKERS,
+                             REPORT_JOB_MAX_QUEUE, REPORT_JOB_RETENTION, REPORT_JOB_LEASE)
@@ -0,0 +1,207 @@
+"""
+Report Map-Reduce Service - Hierarchical summarization of long reports
+The report is split at section headers into chunks of up to
+REPORT_MAP_CHUNK_CHARS. Chunks are summarized in parallel (map), then the
+partial summaries are merged in batches until one remains (reduce).
+Every LLM call is memoized by a hash of its prompt, so a re-uploaded report
+with edits only re-summarizes the chunks that changed.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.services.report_index_service import chunk_report
+from backend.services.profiling_service import propagate
+from backend.utils.config import (
+    NVIDIA_MODEL, REPORT_MAP_CHUNK_CHARS, REPORT_SUMMARY_CONCURRENCY, REPORT_SUMMARY_CACHE_SIZE
+)
+
+# A short line ending in ':' ("Discharge Medications:") or in capitals
+# ("PHYSICAL EXAMINATION") starts a new section
+_HEADER_PATTERN = re.compile(r"^\s*(?:[A-Za-z][\w /&(),-]{1,60}:|[A-Z][A-Z /&(),-]{2,60})\s*$")
+
+# The text to work on always follows this line, so prompts only differ in it
+PAYLOAD_MARKER = "\n---\n"
+
+MAP_PROMPT = """Summarize this part of a patient's medical report. Keep every diagnosis,
+abnormal or critical value, medication with its dose, procedure, allergy and
+follow-up instruction. Be brief and do not add anything that is not in the text.""" + PAYLOAD_MARKER
+
+MERGE_PROMPT = """Merge these partial summaries of one medical report into a single shorter
+summary. Keep every diagnosis, critical value, medication, allergy and
+follow-up instruction.""" + PAYLOAD_MARKER
+
+FINAL_PROMPT = """Analyze this medical report and provide:
+1. A brief 2-3 sentence summary
+2. Key findings (list main diagnoses, test results, concerns)
+3. Recommended next steps
+4. Any important alerts or critical values
+
+Provide structured response with clear sections.""" + PAYLOAD_MARKER
+
+
+def split_sections(text: str) -> list:
+    """(first line, section text) pairs, cut before every header line"""
+    sections = []
+    start = 0
+    lines = text.split('\n')
+    for number, line in enumerate(lines):
+        if number > start and _HEADER_PATTERN.match(line):
+            sections.append((start, '\n'.join(lines[start:number])))
+            start = number
+    sections.append((start, '\n'.join(lines[start:])))
+    return [(first, section) for first, section in sections if section.strip()]
+
+
+def map_chunks(text: str, max_chars: int = REPORT_MAP_CHUNK_CHARS) -> list:
+    """
+    Section-aligned chunks of at most max_chars characters, as dicts with
+    text, line_start and line_end. Each section is its own chunk (split
+    line-wise when too long); sections under an eighth of max_chars join
+    the chunk before them. Boundaries only depend on nearby sections, so
+    an edit normally leaves every other chunk byte-identical.
+    """
+    chunks = []
+    for first, section in split_sections(text):
+        last = first + section.count('\n')
+        previous = chunks[-1] if chunks else None
+        if (previous is not None and len(section) < max_chars // 8
+                and len(previous["text"]) + 1 + len(section) <= max_chars):
+            previous["text"] += '\n' + section
+            previous["line_end"] = last
+            continue
+        if len(section) <= max_chars:
+            chunks.append({"text": section, "line_start": first, "line_end": last})
+            continue
+        for piece in chunk_report(section, max_chars=max_chars):
+            chunks.append({
+                "text": piece["text"],
+                "line_start": first + piece["line_start"],
+                "line_end": first + piece["line_end"],
+            })
+    return chunks
+
+
+class SummaryMemo:
+    """Thread-safe LRU of LLM replies keyed by a hash of model and prompt"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            reply = self._entries.get(key)
+            if reply is not None:
+                self._entries.move_to_end(key)
+            return reply
+
+    def put(self, key: str, reply: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = reply
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+summary_memo = SummaryMemo(REPORT_SUMMARY_CACHE_SIZE)
+
+
+class FakeLLM:
+    """
+    Deterministic local stand-in for the chat model, for tests and
+    benchmarks: sleeps for latency seconds, then "summarizes" by keeping the
+    first few non-empty lines of the prompt's payload.
+    """
+    model = "fake-local"
+
+    def __init__(self, latency: float = 0.0, keep_lines: int = 4):
+        self.latency = latency
+        self.keep_lines = keep_lines
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        payload = prompt.rsplit(PAYLOAD_MARKER, 1)[-1]
+        lines = [line.strip()[:120] for line in payload.split('\n') if line.strip()]
+        return '\n'.join(lines[:self.keep_lines])
+
+
+def _batches(summaries: list, max_chars: int) -> list:
+    """Consecutive groups of at least two summaries within max_chars each"""
+    batches = [[]]
+    size = 0
+    for summary in summaries:
+        if len(batches[-1]) >= 2 and size + len(summary) > max_chars:
+            batches.append([])
+            size = 0
+        batches[-1].append(summary)
+        size += len(summary) + 2
+    # A lone trailing summary joins the batch before it
+    if len(batches) > 1 and len(batches[-1]) == 1:
+        batches[-2].extend(batches.pop())
+    return batches
+
+
+def map_reduce_summarize(text: str, complete, concurrency: int = REPORT_SUMMARY_CONCURRENCY,
+                         max_chars: int = REPORT_MAP_CHUNK_CHARS, memo: SummaryMemo = summary_memo) -> dict:
+    """
+    Summarize a report of any length with complete(prompt) -> str, at most
+    concurrency calls in flight. Returns the summary plus chunk count, LLM
+    calls made, chunk summaries reused from memo, reduce levels and time.
+    """
+    started = time.perf_counter()
+    model = getattr(complete, "model", NVIDIA_MODEL)
+    stats = {"chunks": 0, "llm_calls": 0, "reused": 0, "levels": 0}
+
+    def run(prompts: list, level: str) -> list:
+        keys = [memo.key(model, prompt) for prompt in prompts]
+        replies = [memo.get(key) for key in keys]
+        missing = [i for i, reply in enumerate(replies) if reply is None]
+        if level == "map":
+            stats["reused"] += len(prompts) - len(missing)
+        stats["llm_calls"] += len(missing)
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(missing) or 1))) as pool:
+            for i, reply in zip(missing, pool.map(propagate(complete), [prompts[i] for i in missing])):
+                memo.put(keys[i], reply)
+                replies[i] = reply
+        return replies
+
+    chunks = map_chunks(text, max_chars)
+    stats["chunks"] = len(chunks)
+    if len(chunks) <= 1:
+        summary = run([FINAL_PROMPT + text], "final")[0]
+    else:
+        summaries = run([MAP_PROMPT + chunk["text"] for chunk in chunks], "map")
+        while True:
+            stats["levels"] += 1
+            batches = _batches(summaries, max_chars)
+            prompt = FINAL_PROMPT if len(batches) == 1 else MERGE_PROMPT
+            summaries = run([prompt + "\n\n".join(batch) for batch in batches], "reduce")
+            if len(summaries) == 1:
+                break
+        summary = summaries[0]
+
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return dict(stats, summary=summary)
@@ -2,127 +2,322 @@
 Report Parser Service - Extract text from medical reports
 Supports: PDF, DOCX, TXT
 """
-import io
-from pypdf import PdfReader
-from docx import Document
+import bisect
+import functools
+import re
 
+from backend.services.lexicon_service import get_lexicon, trie_pattern
+from backend.services.report_extraction_service import (
+    ExtractionLimitError,
+    extract_pdf,
+    extract_docx,
+    iter_report_pages,
+    check_report_size,
+)
 
-def parse_pdf(file_content: bytes) -> str:
-    """Extract text from PDF"""
+
+def parse_pdf(file_content) -> str:
+    """Extract text from PDF (bytes or a file path)"""
+    return parse_pdf_pages(file_content)["text"]
+
+
+def parse_pdf_pages(file_content) -> dict:
+    """Extract PDF text with per-page timings and limit flags"""
     try:
-        pdf_reader = PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        return extract_pdf(file_content)
+    except ExtractionLimitError:
+        raise
     except Exception as e:
         raise ValueError(f"Error parsing PDF: {e}")
 
 
-def parse_docx(file_content: bytes) -> str:
-    """Extract text from DOCX"""
+def parse_docx(file_content) -> str:
+    """Extract text from DOCX, including table cells"""
+    return parse_docx_blocks(file_content)["text"]
+
+
+def parse_docx_blocks(file_content) -> dict:
+    """Extract DOCX paragraphs and tables with timing and limit flags"""
     try:
-        doc = Document(io.BytesIO(file_content))
-        text = ""
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        return text
+        return extract_docx(file_content)
+    except ExtractionLimitError:
+        raise
     except Exception as e:
         raise ValueError(f"Error parsing DOCX: {e}")
 
 
-def parse_txt(file_content: bytes) -> str:
+def parse_txt(file_content) -> str:
     """Extract text from TXT"""
     try:
-        return file_content.decode('utf-8')
+        check_report_size(file_content)
+        if isinstance(file_content, (bytes, bytearray)):
+            return bytes(file_content).decode('utf-8')
+        with open(file_content, encoding='utf-8') as f:
+            return f.read()
+    except ExtractionLimitError:
+        raise
     except Exception as e:
         raise ValueError(f"Error parsing TXT: {e}")
 
 
-def extract_report_text(file_content: bytes, filename: str) -> str:
+def extract_report(file_content, filename: str) -> dict:
     """
-    Extract text from any supported report format
-    Automatically detects file type from filename
+    Extract text plus extraction stats (pages, per-page timings, truncation)
+    from any supported report format. file_content may be bytes or a path.
     """
     filename_lower = filename.lower()
     
     if filename_lower.endswith('.pdf'):
-        return parse_pdf(file_content)
+        return parse_pdf_pages(file_content)
     elif filename_lower.endswith('.docx') or filename_lower.endswith('.doc'):
-        return parse_docx(file_content)
+        return parse_docx_blocks(file_content)
     elif filename_lower.endswith('.txt'):
-        return parse_txt(file_content)
+        text = parse_txt(file_content)
+        return {
+            "text": text,
+            "pages": [text],
+            "page_numbers": [0],
+            "page_timings_ms": [0.0],
+            "page_count": 1,
+            "truncated": False,
+            "timed_out": False,
+            "elapsed_ms": 0.0,
+        }
     else:
         raise ValueError(f"Unsupported file format. Supported: PDF, DOCX, TXT")
 
 
+def extract_report_text(file_content, filename: str) -> str:
+    """
+    Extract text from any supported report format
+    Automatically detects file type from filename
+    """
+    return extract_report(file_content, filename)["text"]
+
+
+def iter_report_text(file_content, filename: str):
+    """Yield report text page by page for streaming consumers"""
+    return iter_report_pages(file_content, filename)
+
+
+# Markers for "no known (drug) allergies"
+NO_ALLERGY_MARKERS = ['nkda', 'no known allergy', 'nka']
+
+# Header-only lines that are never reported as allergies
+ALLERGY_HEADERS = {'allergy:', 'allergies:', 'drug allergy:'}
+
+# (section, header keywords, excluded keywords, break keywords, window, window includes header)
+SECTION_RULES = [
+    ("diagnoses", {'diagnosis', 'medical condition'},
+     {'medication', 'allergy', 'vital', 'procedure'}, {'medication'}, 7, False),
+    ("medications", {'medication', 'drug'},
+     {'diagnosis', 'allergy', 'vital', 'procedure'}, {'diagnosis', 'allergy', 'vital', 'procedure'}, 7, False),
+    ("procedures", {'procedure', 'surgery', 'test'},
+     {'diagnosis', 'medication', 'allergy'}, {'diagnosis', 'medication', 'allergy'}, 5, False),
+    ("vital_signs", {'vital'}, {'diagnosis', 'medication'}, set(), 7, True),
+]
+
+SECTION_INDEX = {rule[0]: i for i, rule in enumerate(SECTION_RULES)}
+
+_KEYWORDS = sorted(
+    {kw for rule in SECTION_RULES for group in rule[1:4] for kw in group}
+    | set(NO_ALLERGY_MARKERS) | {'allerg'},
+    key=len, reverse=True,
+)
+
+# Found-set entries for the lexicon categories named on a line
+_CATEGORY_MARK = "@"
+_ALLERGEN_MARK = _CATEGORY_MARK + "allergens"
+_MEDICATION_MARK = _CATEGORY_MARK + "medications"
+
+_WORD_CHAR = re.compile(r"[^\W_]")
+
+
+class _Separators(dict):
+    """str.translate table turning every non-word character into a space"""
+
+    def __missing__(self, code):
+        self[code] = code if _WORD_CHAR.match(chr(code)) else ord(" ")
+        return self[code]
+
+
+_SEPARATORS = _Separators()
+
+
+class _LineScanner:
+    """
+    Finds the section keywords (anywhere in a word) and the lexicon's terms
+    (whole words) in lowercased report text, as one found-set per line.
+    Keywords are plain substring searches. Terms are one regex scan over the
+    text with its separators turned into spaces, so every term follows a
+    literal space the engine can skip ahead to; a match hides the terms
+    starting inside it, which are re-checked at its inner word starts.
+    """
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        terms = lexicon.terms()
+        words = trie_pattern(terms, separator=" +") + "(?![^ ])"
+        self.term_at = re.compile(words) if terms else None
+        self.term_scan = re.compile(f" ({words})") if terms else None
+        self.first_words = {term.split(" ", 1)[0] for term in terms}
+        # Matched term text -> (category marks, offsets where another term may start)
+        self._terms = {}
+
+    def _term(self, text: str) -> tuple:
+        hit = self._terms.get(text)
+        if hit is None:
+            # Shorter terms the match starts with are hidden by it too
+            words = text.split()
+            categories = set()
+            for i in range(1, len(words) + 1):
+                categories |= self.lexicon.categories_of(" ".join(words[:i]))
+            offsets = [m.start() for m in re.finditer("[^ ]+", text)
+                       if m.start() and m.group() in self.first_words]
+            hit = (frozenset(_CATEGORY_MARK + category for category in categories), offsets)
+            if len(self._terms) < 65536:
+                self._terms[text] = hit
+        return hit
+
+    def by_line(self, text_lower: str) -> dict:
+        """Map line number -> keywords and lexicon category marks found on that line"""
+        newlines = [m.start() for m in re.finditer('\n', text_lower)]
+        line_of = functools.partial(bisect.bisect_left, newlines)
+        found = {}
+
+        for keyword in _KEYWORDS:
+            position = text_lower.find(keyword)
+            while position != -1:
+                found.setdefault(line_of(position), set()).add(keyword)
+                position = text_lower.find(keyword, position + 1)
+
+        if self.term_scan is not None:
+            # Same length as the text, so offsets still map to its lines
+            spaced = text_lower.translate(_SEPARATORS)
+
+            def add_term(start, text):
+                entries, offsets = self._term(text)
+                found.setdefault(line_of(start), set()).update(entries)
+                for offset in offsets:
+                    inner = self.term_at.match(spaced, start + offset)
+                    if inner:
+                        found.setdefault(line_of(inner.start()), set()).update(self._term(inner.group())[0])
+
+            # A term opening the text has no space before it
+            first = self.term_at.match(spaced)
+            if first:
+                add_term(0, first.group())
+            for match in self.term_scan.finditer(spaced):
+                add_term(match.start(1), match.group(1))
+        return {line: frozenset(entries) for line, entries in found.items()}
+
+
+@functools.lru_cache(maxsize=4)
+def _scanner(lexicon) -> _LineScanner:
+    return _LineScanner(lexicon)
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify(found):
+    """
+    Per-rule (header, excluded, break, window, inclusive) flags plus the
+    any-header / 'allerg' / NKDA / allergen / medication flags for a line's
+    keyword set; reports reuse few sets
+    """
+    found = found or frozenset()
+    flags = tuple(
+        (not found.isdisjoint(headers), not found.isdisjoint(excluded),
+         not found.isdisjoint(breaks), window, inclusive)
+        for _, headers, excluded, breaks, window, inclusive in SECTION_RULES
+    )
+    return (flags, any(rule[0] for rule in flags), 'allerg' in found, not found.isdisjoint(NO_ALLERGY_MARKERS),
+            _ALLERGEN_MARK in found, _MEDICATION_MARK in found)
+
+
+def segment_report(text: str) -> dict:
+    """
+    Single pass over the report lines. The text is lowercased and scanned
+    once for the section keywords and the allergen / medication lexicon
+    terms together; header lines open a window for their section and
+    following body lines are routed into that section's bucket.
+    Returns every candidate per section, deduplicated in document order.
+    """
+    lines = text.split('\n')
+    keywords = _scanner(get_lexicon()).by_line(text.lower())
+
+    buckets = [{} for _ in SECTION_RULES]
+    remaining = [0] * len(SECTION_RULES)
+    medications = SECTION_INDEX["medications"]
+    allergies = {}
+    allergy_window = 0
+    in_allergy_section = False
+    no_known_allergies = False
+
+    for number, line in enumerate(lines):
+        found = keywords.get(number)
+        if found is None and not allergy_window and not any(remaining):
+            continue
+        flags, has_header, opens_allergy, no_allergy, names_allergen, names_medication = _classify(found)
+        stripped = line.strip()
+
+        # Allergies: the 'allerg' line plus the next three, and any line naming an allergen
+        if opens_allergy:
+            allergy_window = 4
+        if allergy_window:
+            if len(stripped) > 2 and stripped.lower() not in ('allergies:', 'allergy'):
+                allergies[stripped] = None
+            allergy_window -= 1
+        if stripped and names_allergen:
+            allergies[stripped] = None
+        no_known_allergies = no_known_allergies or no_allergy
+
+        for i, (is_header, is_excluded, is_break, window, inclusive) in enumerate(flags):
+            if inclusive and is_header:
+                remaining[i] = window
+            if remaining[i]:
+                if len(stripped) > 3 and not is_excluded:
+                    buckets[i][stripped] = None
+                remaining[i] = 0 if is_break else remaining[i] - 1
+            if is_header and not inclusive:
+                remaining[i] = window
+
+        # The allergy list runs until the next section header
+        if opens_allergy:
+            in_allergy_section = True
+        elif has_header:
+            in_allergy_section = False
+
+        # Lines naming a known medication count even outside a medication
+        # header's window, unless they sit in the allergy list
+        if names_medication and not in_allergy_section:
+            if len(stripped) > 3 and not flags[medications][1]:
+                buckets[medications][stripped] = None
+
+    if no_known_allergies:
+        allergies["No known allergies reported"] = None
+
+    sections = {rule[0]: list(bucket) for rule, bucket in zip(SECTION_RULES, buckets)}
+    sections["allergies"] = [a for a in allergies if a.lower() not in ALLERGY_HEADERS]
+    return sections
+
+
 def extract_key_sections(text: str) -> dict:
     """
     Extract key medical information from report text
     Looks for common sections and patterns with plain-language explanations
     """
-    text_lower = text.lower()
-    
+    return key_sections_from_segments(segment_report(text))
+
+
+def key_sections_from_segments(segments: dict) -> dict:
+    """Top entries per section from segment_report output"""
     sections = {
-        "diagnoses": [],
-        "medications": [],
-        "procedures": [],
-        "allergies": [],
-        "vital_signs": []
+        "diagnoses": segments["diagnoses"][:6],
+        "medications": segments["medications"][:6],
+        "procedures": segments["procedures"][:6],
+        "allergies": sorted(segments["allergies"])[:6],
+        "vital_signs": segments["vital_signs"][:6],
     }
-    
-    lines = text.split('\n')
-    
-    # Extract diagnoses
-    for i, line in enumerate(lines):
-        if 'diagnosis' in line.lower() or 'medical condition' in line.lower():
-            for j in range(i+1, min(i+8, len(lines))):
-                stripped = lines[j].strip()
-                if stripped and not any(x in stripped.lower() for x in ['medication', 'allergy', 'vital', 'procedure']):
-                    if len(stripped) > 3:
-                        sections["diagnoses"].append(stripped)
-                if 'medication' in lines[j].lower():
-                    break
-    
-    # Extract medications
-    for i, line in enumerate(lines):
-        if 'medication' in line.lower() or 'drug' in line.lower():
-            for j in range(i+1, min(i+8, len(lines))):
-                stripped = lines[j].strip()
-                if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'allergy', 'vital', 'procedure']):
-                    if len(stripped) > 3:
-                        sections["medications"].append(stripped)
-                if any(x in lines[j].lower() for x in ['diagnosis', 'allergy', 'vital', 'procedure']):
-                    break
-    
-    # Extract allergies - be very aggressive with better matching
-    allergies = extract_allergies(text)
-    sections["allergies"] = allergies
-    
-    # Extract procedures
-    for i, line in enumerate(lines):
-        if 'procedure' in line.lower() or 'surgery' in line.lower() or 'test' in line.lower():
-            for j in range(i+1, min(i+6, len(lines))):
-                stripped = lines[j].strip()
-                if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'medication', 'allergy']):
-                    if len(stripped) > 3:
-                        sections["procedures"].append(stripped)
-                if any(x in lines[j].lower() for x in ['diagnosis', 'medication', 'allergy']):
-                    break
-    
-    # Extract vital signs
-    for i, line in enumerate(lines):
-        if 'vital' in line.lower():
-            for j in range(i, min(i+7, len(lines))):
-                stripped = lines[j].strip()
-                if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'medication']):
-                    if len(stripped) > 3:
-                        sections["vital_signs"].append(stripped)
-    
-    # Remove duplicates and limit to top entries
-    for key in sections:
-        sections[key] = list(set(sections[key]))[:6]
-    
     return sections
 
 
@@ -130,41 +325,4 @@ def extract_allergies(text: str) -> list:
     """
     Specifically extract allergies from report text with multiple matching strategies
     """
-    allergies = set()
-    text_lower = text.lower()
-    lines = text.split('\n')
-    
-    # Keyword patterns for allergies
-    allergy_keywords = ['penicillin', 'aspirin', 'ibuprofen', 'sulfa', 'latex', 'peanut', 
-                        'tree nut', 'shellfish', 'egg', 'milk', 'gluten', 'morphine',
-                        'codeine', 'sulfonamide', 'ace inhibitor', 'beta blocker']
-    
-    # Strategy 1: Look for lines containing 'allergy' or 'allergies'
-    for i, line in enumerate(lines):
-        if 'allerg' in line.lower():
-            # Get this line and next 3 lines
-            for j in range(i, min(i+4, len(lines))):
-                text_segment = lines[j].strip()
-                if text_segment and len(text_segment) > 2 and text_segment.lower() != 'allergies:' and text_segment.lower() != 'allergy':
-                    allergies.add(text_segment)
-    
-    # Strategy 2: Search for known allergens in the text
-    for allergen in allergy_keywords:
-        if allergen in text_lower:
-            # Find the context around this allergen
-            for line in lines:
-                if allergen in line.lower() and len(line.strip()) > 0:
-                    allergies.add(line.strip())
-    
-    # Strategy 3: Look for NKDA (No Known Drug Allergy) or similar
-    if 'nkda' in text_lower or 'no known allergy' in text_lower or 'nka' in text_lower:
-        allergies.add("No known allergies reported")
-    
-    # Filter out noise and return
-    clean_allergies = []
-    for allergy in allergies:
-        # Remove header-only lines
-        if allergy.lower() not in ['allergy:', 'allergies:', 'drug allergy:', 'allergies:']:
-            clean_allergies.append(allergy)
-    
-    return sorted(list(set(clean_allergies)))[:6]  # Return top 6 unique allergies
+    return sorted(segment_report(text)["allergies"])[:6]  # Return top 6 unique allergies
@@ -0,0 +1,224 @@
+"""
+Report Session Service - Server-side state for uploaded reports
+/summarize-report returns a report_id; follow-up questions and term
+explanations look the report up by id instead of resending its text.
+Each session keeps the report pre-split into lines (original and
+lowercased), its section buckets, a lexicon term -> line index and, once
+a free-form question needs it, an embedded chunk index.
+Every session is also written to REPORT_SESSION_DIR, so any API process
+sharing that directory can serve a report_id another one created.
+Sessions expire after REPORT_SESSION_TTL seconds without use; beyond
+REPORT_SESSION_MAX_BYTES the least recently used ones are dropped from
+memory and reloaded from disk when asked for again.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from backend.services.lexicon_service import get_lexicon
+from backend.services.report_index_service import ReportIndex
+from backend.services.report_parser_service import segment_report, key_sections_from_segments
+from backend.utils.config import REPORT_SESSION_TTL, REPORT_SESSION_MAX_BYTES, REPORT_SESSION_DIR
+
+
+class ReportSessionNotFound(KeyError):
+    """Raised when a report_id is unknown or its session has expired"""
+
+    def __str__(self):
+        return "Report session not found or expired. Please upload the report again."
+
+
+class ReportSession:
+    """A parsed report, ready for repeated questions"""
+
+    def __init__(self, report_id: str, filename: str, text: str, segments: dict = None,
+                 term_lines: dict = None, created_at: float = None, page_line_starts=None):
+        self.report_id = report_id
+        self.filename = filename
+        self.text = text
+        self.page_line_starts = page_line_starts
+        self.lines = text.split('\n')
+        self.lines_lower = text.lower().split('\n')
+        self.segments = segments if segments is not None else segment_report(text)
+        self.term_lines = term_lines if term_lines is not None else self._index_terms()
+        self.created_at = created_at or time.time()
+        self.last_access = time.time()
+        self.nbytes = sys.getsizeof(text) + sum(sys.getsizeof(line) for line in self.lines) * 2
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def _index_terms(self) -> dict:
+        """Lexicon term -> line numbers naming it, from one scan of the text"""
+        line_starts = [0]
+        for number, line in enumerate(self.lines[:-1]):
+            line_starts.append(line_starts[-1] + len(line) + 1)
+        term_lines = {}
+        line = 0
+        for match in get_lexicon().iter_matches(self.text):
+            while line + 1 < len(line_starts) and line_starts[line + 1] <= match.start:
+                line += 1
+            numbers = term_lines.setdefault(match.term, [])
+            if not numbers or numbers[-1] != line:
+                numbers.append(line)
+        return term_lines
+
+    def key_sections(self) -> dict:
+        return key_sections_from_segments(self.segments)
+
+    def lines_naming(self, terms) -> list:
+        """Stripped lines mentioning any of the given lexicon terms, in report order"""
+        numbers = sorted({n for term in terms for n in self.term_lines.get(term, [])})
+        return list(dict.fromkeys(self.lines[n].strip() for n in numbers))
+
+    @property
+    def index(self) -> ReportIndex:
+        """Chunk index, embedded on first use (not spilled; rebuilt after a reload)"""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = ReportIndex.build(self.text, self.page_line_starts)
+        return self._index
+
+    def to_dict(self) -> dict:
+        return {
+            "report_id": self.report_id,
+            "filename": self.filename,
+            "text": self.text,
+            "segments": self.segments,
+            "term_lines": self.term_lines,
+            "created_at": self.created_at,
+            "page_line_starts": self.page_line_starts,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReportSession":
+        return cls(data["report_id"], data["filename"], data["text"],
+                   segments=data["segments"], term_lines=data["term_lines"],
+                   created_at=data["created_at"], page_line_starts=data.get("page_line_starts"))
+
+
+class ReportSessionStore:
+    """TTL-bounded LRU of sessions with a memory cap, written through to a shared directory"""
+
+    def __init__(self, ttl: float, max_bytes: int, spill_dir: str):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, report_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{report_id}.json")
+
+    def create(self, filename: str, text: str, page_line_starts=None) -> ReportSession:
+        """Parse a report into a new session and return it"""
+        session = ReportSession(uuid.uuid4().hex, filename, text, page_line_starts=page_line_starts)
+        self._spill(session)
+        with self._lock:
+            self._insert(session)
+        self._sweep()
+        return session
+
+    def get(self, report_id: str) -> ReportSession:
+        """Return the live session for report_id or raise ReportSessionNotFound"""
+        if not report_id or not report_id.isalnum():
+            raise ReportSessionNotFound(report_id)
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(report_id)
+            if session is not None and now - session.last_access > self.ttl:
+                # Another process may have used it since; the file's mtime decides
+                self._forget(report_id)
+                session = None
+            if session is not None:
+                # Other processes judge expiry by the file's mtime
+                self._touch(report_id)
+                session.last_access = now
+                self._sessions.move_to_end(report_id)
+                return session
+
+            session = self._load_spilled(report_id, now)
+            if session is None:
+                raise ReportSessionNotFound(report_id)
+            self._touch(report_id)
+            self._insert(session)
+            return session
+
+    def delete(self, report_id: str):
+        with self._lock:
+            self._remove(report_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _insert(self, session: ReportSession):
+        self._sessions[session.report_id] = session
+        self._bytes += session.nbytes
+        # Keep the newest session in memory even if it alone exceeds the cap;
+        # evicted ones are already on disk
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            report_id, oldest = self._sessions.popitem(last=False)
+            self._bytes -= oldest.nbytes
+
+    def _forget(self, report_id: str):
+        session = self._sessions.pop(report_id, None)
+        if session is not None:
+            self._bytes -= session.nbytes
+
+    def _remove(self, report_id: str):
+        self._forget(report_id)
+        try:
+            os.remove(self._spill_path(report_id))
+        except OSError:
+            pass
+
+    def _spill(self, session: ReportSession):
+        fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(dict(session.to_dict(), last_access=session.last_access), f)
+        os.replace(tmp_path, self._spill_path(session.report_id))
+
+    def _touch(self, report_id: str):
+        try:
+            os.utime(self._spill_path(report_id))
+        except OSError:
+            pass
+
+    def _load_spilled(self, report_id: str, now: float):
+        path = self._spill_path(report_id)
+        try:
+            last_access = os.stat(path).st_mtime
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - max(last_access, data.get("last_access", 0)) > self.ttl:
+            return None
+        return ReportSession.from_dict(data)
+
+    def _sweep(self):
+        """Drop expired sessions from memory, and files unused by any process, at most once a minute"""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        with self._lock:
+            for report_id in [rid for rid, s in self._sessions.items() if now - s.last_access > self.ttl]:
+                self._forget(report_id)
+        for item in os.scandir(self.spill_dir):
+            try:
+                if now - item.stat().st_mtime > self.ttl:
+                    os.remove(item.path)
+            except OSError:
+                pass
+
+
+report_sessions = ReportSessionStore(REPORT_SESSION_TTL, REPORT_SESSION_MAX_BYTES, REPORT_SESSION_DIR)
@@ -2,14 +2,46 @@
 Report Summarization Service - AI-powered report analysis
 Uses LLM to create summaries and explanations
 """
-from backend.services.llm_service import generate_answer, answer_report_question
+import re
 
+from backend.services.glossary_service import get_glossary, normalize_term
+from backend.services.llm_service import generate_answer, answer_report_question, llm_available, complete_prompt
+from backend.services.report_index_service import ReportIndex, format_chunks
+from backend.services.report_mapreduce_service import map_reduce_summarize
+from backend.utils.config import REPORT_SUMMARY_CONTEXT_CHARS, REPORT_CONTEXT_CHUNKS
 
-def summarize_report(report_text: str) -> dict:
+# Retrieval query used to pick report chunks for the summary prompt
+SUMMARY_QUERY = ("diagnosis impression findings results abnormal critical values "
+                 "medications treatment plan follow-up recommendations")
+
+
+def _report_index(report_text: str, session=None) -> ReportIndex:
+    return session.index if session is not None else ReportIndex.build(report_text)
+
+
+def summarize_report(report_text: str, session=None, complete=None) -> dict:
     """
     Summarize a medical report using AI
     Returns: summary, key_findings, recommendations
+    With an LLM (complete(prompt) -> str, or the configured chat model) the
+    whole report is summarized map-reduce style. Otherwise the most relevant
+    chunks, up to REPORT_SUMMARY_CONTEXT_CHARS, go through the extractive
+    report answerer.
     """
+    if complete is None and llm_available():
+        complete = complete_prompt
+    if complete is not None:
+        try:
+            result = map_reduce_summarize(report_text, complete)
+            return {
+                "summary": result.pop("summary"),
+                "full_text": report_text,
+                "map_reduce": result
+            }
+        except Exception as e:
+            print(f"Map-reduce summarization failed: {e}, using report excerpts")
+
+    context = format_chunks(_report_index(report_text, session).context(SUMMARY_QUERY, REPORT_SUMMARY_CONTEXT_CHARS))
     
     # Create a summarization prompt
     summary_prompt = f"""Analyze this medical report and provide:
@@ -19,11 +51,11 @@ def summarize_report(report_text: str) -> dict:
 4. Any important alerts or critical values
 
 Medical Report:
-{report_text[:5000]}  # Limit to first 5000 chars to save tokens
+{context}
 
 Provide structured response with clear sections."""
     
-    summary_response = answer_report_question(summary_prompt, report_text)
+    summary_response = answer_report_question(summary_prompt, report_text, session=session)
     
     return {
         "summary": summary_response,
@@ -31,24 +63,69 @@ Provide structured response with clear sections."""
     }
 
 
-def explain_medical_term(report_text: str, term: str) -> str:
+DEFINE_PROMPT = """Explain the medical term '{term}' to a patient in one or two plain-language
+sentences. Do not give advice; only say what the term means."""
+
+
+def _report_mentions(report_text: str, keys, session=None, limit: int = 2) -> list:
+    """First few report lines naming any of the (normalized) glossary keys"""
+    pattern = re.compile(r"\b(?:" + "|".join(
+        r"[\W_]+".join(map(re.escape, key.split())) for key in keys
+    ) + r")\b")
+    lines = session.lines_lower if session is not None else report_text.lower().split('\n')
+    original = session.lines if session is not None else report_text.split('\n')
+    mentions = []
+    for number, line in enumerate(lines):
+        if pattern.search(line):
+            mentions.append(original[number].strip())
+            if len(mentions) == limit:
+                break
+    return mentions
+
+
+def explain_medical_term(report_text: str, term: str, session=None) -> str:
     """
-    Explain a medical term found in the report using LLM
+    Explain a medical term found in the report
+    Glossary terms (including near misspellings) are answered locally, with
+    the report lines that mention them. Other terms are defined once by the
+    LLM and remembered; without an LLM, the report chunks most relevant to
+    the term go through the extractive report answerer.
     """
+    glossary = get_glossary()
+    match = glossary.lookup(term)
+    if match is None and llm_available():
+        try:
+            glossary.learn(term, complete_prompt(DEFINE_PROMPT.format(term=term)).strip())
+            match = glossary.lookup(term)
+        except Exception as e:
+            print(f"LLM term definition failed: {e}, using report excerpts")
+
+    if match is not None:
+        entry = match.entry
+        explanation = f"{entry.term}: {entry.definition}"
+        if match.distance:
+            explanation = f"(Showing the closest glossary term to '{term}'.)\n" + explanation
+        keys = {normalize_term(name) for name in (entry.term, *entry.aliases)} - {""}
+        mentions = _report_mentions(report_text, keys, session)
+        if mentions:
+            explanation += "\n\nIn your report:\n" + "\n".join(mentions)
+        return explanation
+
+    context = format_chunks(_report_index(report_text, session).top_chunks(term, REPORT_CONTEXT_CHUNKS))
     
     explanation_prompt = f"""Based on this medical report, explain what '{term}' means in simple language.
 Provide a clear explanation that a patient can understand.
 
 Medical Report:
-{report_text}
+{context}
 
 Explanation of '{term}'."""
     
-    explanation = answer_report_question(explanation_prompt, report_text)
+    explanation = answer_report_question(explanation_prompt, report_text, session=session)
     return explanation
 
 
-def answer_report_question(question: str, report_text: str) -> str:
+def answer_report_question(question: str, report_text: str, session=None) -> str:
     """
     Answer a user question about their medical report
     """
@@ -64,7 +141,7 @@ Answer in clear, patient-friendly language."""
     
     # Use the new answer_report_question function from llm_service
     from backend.services.llm_service import answer_report_question as llm_answer
-    answer = llm_answer(question, report_text)
+    answer = llm_answer(question, report_text, session=session)
     return answer
 
 
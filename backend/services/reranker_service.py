@@ -1,51 +1,94 @@
-# Try to import ML packages with fallback
-try:
-    from sentence_transformers import CrossEncoder
-    cross_encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-    HAS_CROSS_ENCODER = True
-except ImportError:
-    HAS_CROSS_ENCODER = False
-    cross_encoder = None
+from backend.services.deadline_service import allows
+from backend.services.score_memo_service import RerankScoreCache
+from backend.services.tracing_service import span
+from backend.utils.config import MODEL_SERVER_SOCKET, RERANK_SCORE_CACHE_SIZE
 
-def rerank(query, papers, top_k=3):
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+if MODEL_SERVER_SOCKET:
+    # Shared model server process (see model_server_service)
+    from backend.services.model_server_service import RemoteCrossEncoder, get_model_client, np
+    cross_encoder = RemoteCrossEncoder(get_model_client())
+    HAS_CROSS_ENCODER = np is not None
+else:
+    # Try to import ML packages with fallback
+    try:
+        from sentence_transformers import CrossEncoder
+        cross_encoder = CrossEncoder(RERANK_MODEL_NAME)
+        HAS_CROSS_ENCODER = True
+    except ImportError:
+        HAS_CROSS_ENCODER = False
+        cross_encoder = None
+
+# (query, abstract) -> cross-encoder score, shared by every request
+rerank_scores = RerankScoreCache(RERANK_SCORE_CACHE_SIZE, RERANK_MODEL_NAME)
+
+def score_pairs(query, abstracts):
     """
-    Re-rank papers by relevance using cross-encoder.
-    Falls back to using hybrid_score if cross-encoder is not available.
+    Cross-encoder scores for (query, abstract) pairs, or None if unavailable.
+    Pairs scored before come from rerank_scores; only the rest are predicted.
+    """
+    if not HAS_CROSS_ENCODER or not abstracts:
+        return None
+    keys = rerank_scores.keys(query, abstracts)
+    scores = rerank_scores.get_many(keys)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        with span("rerank.cross_encoder", batch_size=len(missing), cache_hits=len(abstracts) - len(missing)):
+            predicted = cross_encoder.predict([[query, abstracts[i]] for i in missing])
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+        rerank_scores.put_many([keys[i] for i in missing], [scores[i] for i in missing])
+    return scores
+
+def rerank_rows(query, abstracts, fallback_scores=None, top_k=3, deadline=None):
+    """
+    Re-rank documents by row id using cross-encoder.
+    Returns (row_ids, scores); falls back to fallback_scores (e.g. hybrid
+    scores) or inverse position if the cross-encoder is not available or
+    the request deadline is too close.
     """
     
-    if not papers or len(papers) == 0:
-        return []
+    if not abstracts:
+        return [], []
     
+    use_cross_encoder = HAS_CROSS_ENCODER
+    if use_cross_encoder and not allows(deadline, "rerank"):
+        deadline.degrade("skipped_rerank")
+        use_cross_encoder = False
+
     # Try with cross-encoder if available
-    if HAS_CROSS_ENCODER:
+    if use_cross_encoder:
         try:
-            pairs = [[query, p.get("abstract", "")] for p in papers]
-            scores = cross_encoder.predict(pairs)
+            scores = score_pairs(query, abstracts)
             
-            ranked = sorted(zip(papers, scores), key=lambda x: x[1], reverse=True)
-            
-            top_papers = []
-            for paper, score in ranked[:top_k]:
-                paper_copy = paper.copy()
-                paper_copy["rerank_score"] = float(score)
-                top_papers.append(paper_copy)
-            
-            return top_papers
+            ranked = sorted(range(len(abstracts)), key=lambda i: scores[i], reverse=True)[:top_k]
+            return ranked, [float(scores[i]) for i in ranked]
         except Exception as e:
             print(f"Cross-encoder failed, using hybrid scores: {e}")
     
     # Fallback: Use existing hybrid_score or default
-    papers_copy = [p.copy() for p in papers]
+    scores = []
+    for i in range(len(abstracts)):
+        if fallback_scores is not None and fallback_scores[i] is not None:
+            scores.append(fallback_scores[i])
+        else:
+            scores.append(1.0 / (i + 1))  # Inverse position score
+    
+    ranked = sorted(range(len(abstracts)), key=lambda i: scores[i], reverse=True)[:top_k]
+    return ranked, [float(scores[i]) for i in ranked]
+
+def rerank(query, papers, top_k=3, deadline=None):
+    """
+    Re-rank papers by relevance using cross-encoder.
+    Falls back to using hybrid_score if cross-encoder is not available.
+    Only the returned top-k papers are copied.
+    """
+    
+    if not papers or len(papers) == 0:
+        return []
     
-    # Sort by hybrid_score if it exists, otherwise use position
-    for i, paper in enumerate(papers_copy):
-        if "rerank_score" not in paper:
-            # Use hybrid_score if available, otherwise assign based on position
-            if "hybrid_score" in paper:
-                paper["rerank_score"] = paper["hybrid_score"]
-            else:
-                paper["rerank_score"] = 1.0 / (i + 1)  # Inverse position score
+    fallback_scores = [p.get("rerank_score", p.get("hybrid_score")) for p in papers]
+    rows, scores = rerank_rows(query, [p.get("abstract", "") for p in papers], fallback_scores, top_k, deadline)
     
-    # Sort and return top_k
-    ranked = sorted(papers_copy, key=lambda x: x.get("rerank_score", 0), reverse=True)
-    return ranked[:top_k]
+    return [dict(papers[row], rerank_score=score) for row, score in zip(rows, scores)]
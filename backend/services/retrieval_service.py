@@ -1,5 +1,10 @@
 import re
 from collections import Counter
+from backend.services.deadline_service import allows
+from backend.services.score_memo_service import query_embeddings
+from backend.services.tracing_service import span
+from backend.services.vector_index_service import build_dense_index, save_dense_index
+from backend.utils.config import DENSE_INDEX_MODE, MODEL_SERVER_SOCKET
 
 # Try to import ML packages with fallback
 try:
@@ -11,13 +16,22 @@ except ImportError:
     HAS_ML_PACKAGES = False
     np = None
 
-try:
-    from sentence_transformers import SentenceTransformer
-    embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-    HAS_EMBEDDINGS = True
-except ImportError:
-    HAS_EMBEDDINGS = False
-    embed_model = None
+# Sentence embedding model; offline packs record it with their embeddings
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+
+if MODEL_SERVER_SOCKET:
+    # Shared model server process (see model_server_service)
+    from backend.services.model_server_service import RemoteEmbedder, get_model_client
+    embed_model = RemoteEmbedder(get_model_client())
+    HAS_EMBEDDINGS = HAS_ML_PACKAGES
+else:
+    try:
+        from sentence_transformers import SentenceTransformer
+        embed_model = SentenceTransformer(EMBED_MODEL_NAME)
+        HAS_EMBEDDINGS = True
+    except ImportError:
+        HAS_EMBEDDINGS = False
+        embed_model = None
 
 # Medical keyword synonyms for better matching
 MEDICAL_SYNONYMS = {
@@ -43,6 +57,22 @@ MEDICAL_SYNONYMS = {
     'gout': ['gout', 'uric', 'purine', 'arthralgia', 'acute'],
 }
 
+def embed_queries(queries):
+    """
+    Query embeddings as a 2-D float32 array (like embed_model.encode),
+    memoized per normalized query text in score_memo_service
+    """
+    embeddings = [query_embeddings.get(query) for query in queries]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        with span("embed.queries", batch_size=len(missing), cache_hits=len(queries) - len(missing)):
+            encoded = embed_model.encode([queries[i] for i in missing])
+        for i, embedding in zip(missing, encoded):
+            embedding = np.array(embedding, dtype=np.float32)
+            query_embeddings.put(queries[i], embedding)
+            embeddings[i] = embedding
+    return np.stack(embeddings)
+
 def _clean_text(text):
     """Clean and normalize text"""
     if not text:
@@ -98,54 +128,43 @@ def _calculate_relevance_score(query_words, title_words, abstract_words):
     
     return score
 
-def hybrid_retrieve(query, papers, top_k=10):
+def rank_rows(query, titles, abstracts, top_k=10, deadline=None):
     """
-    Perform hybrid retrieval using semantic and keyword search.
-    Falls back to improved keyword matching if ML packages are not available.
+    Rank documents by row id using semantic and keyword search.
+    Returns (row_ids, scores) so callers only materialize the top-k rows.
+    Falls back to improved keyword matching if ML packages are not available
+    or the request deadline leaves no time to embed the abstracts.
     """
     
-    if not papers:
-        return []
-    
-    abstracts = [p.get("abstract", "") for p in papers]
-    titles = [p.get("title", "") for p in papers]
+    if not abstracts:
+        return [], []
     
+    use_embeddings = HAS_ML_PACKAGES and HAS_EMBEDDINGS
+    if use_embeddings and not allows(deadline, "embed"):
+        deadline.degrade("keyword_scoring")
+        use_embeddings = False
+
     # Try hybrid retrieval with ML packages
-    if HAS_ML_PACKAGES and HAS_EMBEDDINGS:
+    if use_embeddings:
         try:
-            doc_embeddings = embed_model.encode(abstracts)
-            query_embedding = embed_model.encode([query])
+            with span("embed.documents", batch_size=len(abstracts)):
+                doc_embeddings = embed_model.encode(abstracts)
+            query_embedding = embed_queries([query])
 
-            dimension = len(doc_embeddings[0]) if doc_embeddings else 768
+            dimension = len(doc_embeddings[0]) if len(doc_embeddings) else 768
             index = faiss.IndexFlatL2(dimension)
             
             # Convert to numpy arrays for FAISS
             doc_array = np.array(doc_embeddings, dtype=np.float32)
             query_array = np.array([query_embedding[0]], dtype=np.float32)
             
-            index.add(doc_array)
-
-            D, I = index.search(query_array, len(abstracts))
-            dense_scores = 1 / (1 + D[0])
-
-            tokenized = [doc.split() for doc in abstracts]
-            bm25 = BM25Okapi(tokenized)
-            bm25_scores = bm25.get_scores(query.split())
-            bm25_scores = np.array(bm25_scores, dtype=np.float32)
-
-            dense_scores = dense_scores / (np.max(dense_scores) + 1e-8)
-            bm25_scores = bm25_scores / (np.max(bm25_scores) + 1e-8)
-
-            final_scores = 0.5 * dense_scores + 0.5 * bm25_scores
-            ranked_indices = np.argsort(final_scores)[::-1][:top_k]
-
-            ranked_papers = []
-            for i in ranked_indices:
-                paper = papers[int(i)].copy()
-                paper["hybrid_score"] = float(final_scores[int(i)])
-                ranked_papers.append(paper)
+            with span("faiss.search", vectors=len(abstracts)):
+                index.add(doc_array)
+                D, I = index.search(query_array, len(abstracts))
+            dense_scores = np.empty(len(abstracts), dtype=np.float32)
+            dense_scores[I[0]] = 1 / (1 + D[0])
 
-            return ranked_papers
+            return rank_with_dense_scores(query, abstracts, dense_scores, top_k)
         except Exception as e:
             print(f"ML retrieval failed, falling back to keyword search: {e}")
     
@@ -154,12 +173,8 @@ def hybrid_retrieve(query, papers, top_k=10):
     
     if not query_words:
         # If query is empty, return all papers
-        ranked_papers = []
-        for i, paper in enumerate(papers[:top_k]):
-            paper_copy = paper.copy()
-            paper_copy["hybrid_score"] = 0.1
-            ranked_papers.append(paper_copy)
-        return ranked_papers
+        rows = list(range(min(top_k, len(abstracts))))
+        return rows, [0.1] * len(rows)
     
     scores = []
     
@@ -189,10 +204,90 @@ def hybrid_retrieve(query, papers, top_k=10):
     if len(ranked_indices) == 0:
         ranked_indices = [i for score, i in scored_with_index][:top_k]
     
-    ranked_papers = []
-    for i in ranked_indices[:top_k]:
-        paper = papers[int(i)].copy()
-        paper["hybrid_score"] = float(scores[i])
-        ranked_papers.append(paper)
+    ranked_indices = ranked_indices[:top_k]
+    return ranked_indices, [float(scores[i]) for i in ranked_indices]
+
+def rank_with_dense_scores(query, abstracts, dense_scores, top_k=10):
+    """
+    Fuse precomputed dense scores (1 / (1 + squared L2), in document order)
+    with BM25 over the same abstracts. Returns (row_ids, scores).
+    """
+    with span("bm25.score", documents=len(abstracts)):
+        tokenized = [doc.split() for doc in abstracts]
+        bm25 = BM25Okapi(tokenized)
+        bm25_scores = bm25.get_scores(query.split())
+        bm25_scores = np.array(bm25_scores, dtype=np.float32)
+
+    final_scores = _fuse_scores(np.asarray(dense_scores, dtype=np.float32), bm25_scores)
+    ranked_indices = np.argsort(final_scores)[::-1][:top_k]
+
+    return [int(i) for i in ranked_indices], [float(final_scores[int(i)]) for i in ranked_indices]
+
+def hybrid_retrieve(query, papers, top_k=10, deadline=None):
+    """
+    Perform hybrid retrieval using semantic and keyword search.
+    Only the returned top-k papers are copied and annotated with hybrid_score.
+    """
+    
+    if not papers:
+        return []
+    
+    abstracts = [p.get("abstract", "") for p in papers]
+    titles = [p.get("title", "") for p in papers]
+    
+    with span("retrieve.hybrid", documents=len(papers), top_k=top_k):
+        rows, scores = rank_rows(query, titles, abstracts, top_k, deadline)
+    
+    return [dict(papers[row], hybrid_score=score) for row, score in zip(rows, scores)]
+
+def _fuse_scores(dense_scores, bm25_scores):
+    """Max-normalize dense and BM25 score arrays and combine them 50/50"""
+    dense_scores = dense_scores / (np.max(dense_scores) + 1e-8)
+    bm25_scores = bm25_scores / (np.max(bm25_scores) + 1e-8)
+    return 0.5 * dense_scores + 0.5 * bm25_scores
+
+def retrieve_from_store(query, store, rows=None, top_k=10, dense_index=None, candidates=100):
+    """
+    Rank rows of an ArticleStore without building paper dicts.
+    With a corpus dense index, the index shortlists candidate rows (restricted
+    to rows if given) and BM25 re-scores only that shortlist.
+    Returns (store_rows, scores); use store.materialize() for the final response.
+    """
+    if dense_index is not None and HAS_ML_PACKAGES and HAS_EMBEDDINGS:
+        try:
+            query_embedding = embed_queries([query])
+            with span("faiss.search", candidates=max(candidates, top_k)):
+                dense_scores, ids = dense_index.search(query_embedding, max(candidates, top_k), rows=rows)[0]
+            if len(ids) == 0:
+                return [], []
+            
+            with span("bm25.score", documents=len(ids)):
+                tokenized = [doc.split() for doc in store.abstracts(ids)]
+                bm25_scores = np.array(BM25Okapi(tokenized).get_scores(query.split()), dtype=np.float32)
+            
+            final_scores = _fuse_scores(np.maximum(dense_scores, 0), bm25_scores)
+            ranked = np.argsort(final_scores)[::-1][:top_k]
+            return [int(ids[i]) for i in ranked], [float(final_scores[i]) for i in ranked]
+        except Exception as e:
+            print(f"Dense corpus search failed, falling back to row scan: {e}")
+    
+    rows = [int(r) for r in (range(len(store)) if rows is None else rows)]
+    if not rows:
+        return [], []
+    
+    ranked, scores = rank_rows(query, store.titles(rows), store.abstracts(rows), top_k)
+    return [rows[i] for i in ranked], scores
+
+def build_store_dense_index(store, path, mode=DENSE_INDEX_MODE, batch_size=256, **params):
+    """Embed every abstract in an ArticleStore in batches and save a dense index"""
+    if not (HAS_ML_PACKAGES and HAS_EMBEDDINGS):
+        raise ImportError("sentence-transformers and numpy are required to embed the corpus")
+    
+    batches = []
+    for start in range(0, len(store), batch_size):
+        rows = range(start, min(start + batch_size, len(store)))
+        batches.append(np.asarray(embed_model.encode(store.abstracts(rows)), dtype=np.float32))
     
-    return ranked_papers
+    index = build_dense_index(np.vstack(batches), mode=mode, **params)
+    save_dense_index(index, path)
+    return index
@@ -0,0 +1,150 @@
+"""
+Score Memo Service - Memoized query embeddings and cross-encoder scores
+Repeated questions and conversational follow-ups send the same query text
+to the embedding model and the same (query, abstract) pairs to the
+cross-encoder. Two bounded layers remember those results:
+
+    query embeddings   LRU of normalized query text -> embedding
+    rerank scores      (query hash, abstract hash) -> score, held in a
+                       fixed-size float array with CLOCK eviction
+
+Keys use the normalized query (lowercased, whitespace collapsed), which
+both uncased MiniLM models see identically. Hit rates are in stats().
+"""
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from backend.utils.config import QUERY_EMBEDDING_CACHE_SIZE
+
+
+def normalize_query(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+def _layer_stats(hits: int, misses: int, size: int, capacity: int) -> dict:
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "size": size,
+        "capacity": capacity,
+    }
+
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU of normalized query text -> read-only embedding"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str):
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return embedding
+
+    def put(self, query: str, embedding):
+        if self.max_entries <= 0:
+            return
+        embedding.setflags(write=False)
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return _layer_stats(self.hits, self.misses, len(self._entries), self.max_entries)
+
+
+class RerankScoreCache:
+    """
+    (query, document) -> score for up to capacity pairs. Scores live in one
+    float array indexed by slot; a dict maps each 16-byte key to its slot and
+    a CLOCK hand picks the slot to reuse, giving LRU-like eviction without
+    linked-list nodes. Each entry still holds one bytes key, referenced from
+    both the dict and the slot's key list.
+    """
+
+    def __init__(self, capacity: int, model: str = ""):
+        self.capacity = max(0, capacity)
+        self.model = model
+        self._scores = array("f", bytes(4 * self.capacity))
+        self._keys = [None] * self.capacity
+        self._referenced = bytearray(self.capacity)
+        self._slots = {}
+        self._hand = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def query_key(self, query: str) -> bytes:
+        return _digest(f"{self.model}\0{normalize_query(query)}")
+
+    def keys(self, query: str, documents) -> list:
+        query_key = self.query_key(query)
+        return [query_key + _digest(document or "") for document in documents]
+
+    def get_many(self, keys) -> list:
+        """Cached score for each key, None for misses"""
+        scores = []
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    scores.append(None)
+                    continue
+                self._referenced[slot] = 1
+                scores.append(self._scores[slot])
+            found = sum(score is not None for score in scores)
+            self.hits += found
+            self.misses += len(scores) - found
+        return scores
+
+    def put_many(self, keys, scores):
+        if not self.capacity:
+            return
+        with self._lock:
+            for key, score in zip(keys, scores):
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._victim()
+                    old = self._keys[slot]
+                    if old is not None:
+                        del self._slots[old]
+                    self._keys[slot] = key
+                    self._slots[key] = slot
+                self._scores[slot] = score
+                self._referenced[slot] = 1
+
+    def _victim(self) -> int:
+        # Second chance: skip (and clear) recently used slots
+        while self._referenced[self._hand]:
+            self._referenced[self._hand] = 0
+            self._hand = (self._hand + 1) % self.capacity
+        slot = self._hand
+        self._hand = (self._hand + 1) % self.capacity
+        return slot
+
+    def stats(self) -> dict:
+        return _layer_stats(self.hits, self.misses, len(self._slots), self.capacity)
+
+
+query_embeddings = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE)
@@ -0,0 +1,157 @@
+"""
+Sparse Index Service - BM25 postings for the local corpus
+Postings are stored as flat row/term-frequency arrays (memory-mapped) with a
+term -> [start, end) vocabulary, so a query only touches its own postings.
+"""
+import json
+import math
+import os
+from array import array
+from collections import Counter
+
+# Try to import ML packages with fallback
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+    np = None
+
+SPARSE_FILE = "sparse.json"
+ROWS_FILE = "postings_rows.i32"
+TFS_FILE = "postings_tfs.u16"
+DOC_LENS_FILE = "doc_lens.i32"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def _tokenize(paper: dict) -> list:
+    # Imported lazily: retrieval_service loads the embedding model at import
+    from backend.services.retrieval_service import _clean_text
+    return _clean_text(f"{paper.get('title') or ''} {paper.get('abstract') or ''}")
+
+
+class SparseIndexBuilder:
+    """Collects postings while the article store is written"""
+
+    def __init__(self):
+        self._postings = {}
+        self._doc_lens = array("i")
+
+    def add(self, row: int, paper: dict):
+        tokens = _tokenize(paper)
+        self._doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self._postings.setdefault(term, (array("i"), array("H")))
+            rows, tfs = self._postings[term]
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+
+    def save(self, path: str):
+        terms = {}
+        position = 0
+        with open(os.path.join(path, ROWS_FILE), "wb") as rows_file, \
+                open(os.path.join(path, TFS_FILE), "wb") as tfs_file:
+            for term in sorted(self._postings):
+                rows, tfs = self._postings[term]
+                rows.tofile(rows_file)
+                tfs.tofile(tfs_file)
+                terms[term] = [position, position + len(rows)]
+                position += len(rows)
+        with open(os.path.join(path, DOC_LENS_FILE), "wb") as f:
+            self._doc_lens.tofile(f)
+
+        count = len(self._doc_lens)
+        manifest = {
+            "version": 1,
+            "count": count,
+            "avgdl": (sum(self._doc_lens) / count) if count else 0.0,
+            "terms": terms,
+        }
+        with open(os.path.join(path, SPARSE_FILE), "w") as f:
+            json.dump(manifest, f)
+
+
+class SparseIndex:
+    """Read-only BM25 index over postings arrays"""
+
+    def __init__(self, terms: dict, rows, tfs, doc_lens, avgdl: float):
+        self._terms = terms
+        self._rows = rows
+        self._tfs = tfs
+        self._doc_lens = doc_lens
+        self._avgdl = avgdl or 1.0
+
+    @classmethod
+    def open(cls, path: str) -> "SparseIndex":
+        with open(os.path.join(path, SPARSE_FILE)) as f:
+            manifest = json.load(f)
+
+        def load(name, dtype):
+            file_path = os.path.join(path, name)
+            if os.path.getsize(file_path) == 0:
+                return np.empty(0, dtype=dtype)
+            return np.memmap(file_path, dtype=dtype, mode="r")
+
+        return cls(manifest["terms"], load(ROWS_FILE, np.int32), load(TFS_FILE, np.uint16),
+                   load(DOC_LENS_FILE, np.int32), manifest["avgdl"])
+
+    def __len__(self):
+        return len(self._doc_lens)
+
+    def search(self, query_terms, k: int = 10, allowed_rows=None):
+        """
+        BM25 top-k over the postings of query_terms. allowed_rows (sorted
+        array of row ids) is applied as a pre-filter before scoring, so
+        filtered queries accumulate fewer postings.
+        Returns (scores, rows), best first.
+        """
+        n = len(self)
+        all_rows, all_scores = [], []
+        for term in set(query_terms):
+            span = self._terms.get(term)
+            if span is None:
+                continue
+            rows = self._rows[span[0]:span[1]]
+            tfs = self._tfs[span[0]:span[1]]
+            idf = math.log((n - len(rows) + 0.5) / (len(rows) + 0.5) + 1)
+
+            if allowed_rows is not None:
+                if len(allowed_rows) == 0:
+                    break
+                pos = np.searchsorted(allowed_rows, rows)
+                keep = allowed_rows[np.minimum(pos, len(allowed_rows) - 1)] == rows
+                rows, tfs = rows[keep], tfs[keep]
+            if len(rows) == 0:
+                continue
+
+            tfs = tfs.astype(np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lens[rows] / self._avgdl)
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+
+        if not all_rows:
+            return np.empty(0, np.float32), np.empty(0, np.int64)
+
+        unique_rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+
+        k = min(k, len(unique_rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return scores[top], unique_rows[top].astype(np.int64)
+
+
+_sparse_index = None
+
+
+def get_sparse_index():
+    """Load the local corpus BM25 postings once per process (None if absent)"""
+    global _sparse_index
+    if _sparse_index is None:
+        from backend.utils.config import LOCAL_CORPUS_DIR
+        if not HAS_NUMPY or not LOCAL_CORPUS_DIR or not os.path.exists(os.path.join(LOCAL_CORPUS_DIR, SPARSE_FILE)):
+            return None
+        _sparse_index = SparseIndex.open(LOCAL_CORPUS_DIR)
+    return _sparse_index
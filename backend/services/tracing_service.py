@@ -0,0 +1,423 @@
+"""
+Tracing Service - Per-request spans exported as OTLP/JSON
+With TRACING_ENABLED, each API request becomes a trace whose child spans
+cover the PubMed esearch/efetch calls (with byte counts), embedding batches,
+FAISS and BM25 scoring, cross-encoder batches and LLM calls (with token
+counts). Cache hits are span attributes and deadline degradations are span
+events. A W3C traceparent header (sent by streamlit_app.py) continues the
+caller's trace, and the response echoes the server span's traceparent.
+
+Finished traces are written by a background thread to TRACE_FILE (one
+OTLP/JSON export request per line) or POSTed to TRACE_OTLP_ENDPOINT. With
+TRACE_SLOW_MS set, a trace is kept only if its root span took at least that
+long or failed (tail sampling). Spans that end after their trace's root
+span are dropped.
+
+Spans are Python context managers:
+
+    with tracing.span("rerank.cross_encoder", pairs=len(pairs)) as s:
+        s.set("cache_hits", hits)
+
+When tracing is disabled span() returns a shared no-op span.
+
+Run "python -m backend.services.tracing_service" for a local OTLP/HTTP
+collector stand-in that appends what it receives to a file.
+"""
+import argparse
+import contextvars
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from backend.utils.config import (
+    TRACING_ENABLED, TRACE_EXPORTER, TRACE_FILE, TRACE_OTLP_ENDPOINT, TRACE_SLOW_MS, TRACE_SERVICE_NAME
+)
+
+TRACEPARENT_HEADER = "traceparent"
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_MAX_OPEN_TRACES = 1000
+_MAX_SPANS_PER_TRACE = 2000
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def parse_traceparent(value):
+    """(trace_id, parent span_id) from a traceparent header, or None if invalid"""
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+def new_traceparent() -> str:
+    """A traceparent header starting a new sampled trace"""
+    return f"00-{secrets.token_hex(16)}-{secrets.token_hex(8)}-01"
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """One timed operation; entering it (with) makes it the current span"""
+
+    def __init__(self, name: str, trace_id: str, parent_id, attributes: dict, kind: int = KIND_INTERNAL,
+                 local_root: bool = False):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.local_root = local_root
+        self.attributes = dict(attributes)
+        self.events = []
+        self.status = STATUS_OK
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._token = None
+        if local_root:
+            _traces.begin(trace_id)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+        return self
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def fail(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _traces.on_end(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fail(f"{exc_type.__name__}: {exc}")
+        _current.reset(self._token)
+        self.end()
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [{"timeUnixNano": str(t), "name": name, "attributes": _otlp_attributes(attrs)}
+                       for t, name, attrs in self.events],
+            "status": {"code": self.status, "message": self.status_message},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stands in for Span when tracing is off or there is no current span"""
+
+    traceparent = None
+
+    def set(self, key, value):
+        return self
+
+    def set_attributes(self, **attributes):
+        return self
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def fail(self, message):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """
+    A child of the current span (or the root of a new trace). Use it in a
+    with block, or call end() when it cannot be the current span (e.g. it
+    spans a generator).
+    """
+    if not TRACING_ENABLED:
+        return _NOOP
+    parent = _current.get()
+    if parent is None:
+        return Span(name, secrets.token_hex(16), None, attributes, local_root=True)
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def server_span(name: str, traceparent=None, **attributes):
+    """The root span of a request, continuing the caller's trace if it sent one"""
+    if not TRACING_ENABLED:
+        return _NOOP
+    parent = parse_traceparent(traceparent)
+    trace_id, parent_id = parent if parent is not None else (secrets.token_hex(16), None)
+    return Span(name, trace_id, parent_id, attributes, kind=KIND_SERVER, local_root=True)
+
+
+def current_span():
+    """The active span, or a no-op span"""
+    return _current.get() or _NOOP
+
+
+def add_event(name: str, **attributes):
+    """Record an event (e.g. a fallback) on the active span"""
+    current_span().add_event(name, **attributes)
+
+
+class _TraceBuffer:
+    """Holds each trace's finished spans until its local root ends, then tail-samples it"""
+
+    def __init__(self, slow_ms: float = TRACE_SLOW_MS):
+        self.slow_ms = slow_ms
+        self._open = OrderedDict()  # trace_id -> finished spans
+        self._lock = threading.Lock()
+        self.exporter = None
+        self.kept = 0
+        self.dropped = 0
+
+    def begin(self, trace_id: str):
+        with self._lock:
+            self._open.setdefault(trace_id, [])
+            while len(self._open) > _MAX_OPEN_TRACES:
+                self._open.popitem(last=False)
+
+    def on_end(self, span: Span):
+        with self._lock:
+            spans = self._open.get(span.trace_id)
+            if spans is None:
+                return  # the root already ended and the trace was decided
+            if len(spans) < _MAX_SPANS_PER_TRACE:
+                spans.append(span)
+            if not span.local_root:
+                return
+            del self._open[span.trace_id]
+            keep = (self.slow_ms <= 0 or span.duration_ms >= self.slow_ms
+                    or any(s.status == STATUS_ERROR for s in spans))
+            if keep:
+                self.kept += 1
+            else:
+                self.dropped += 1
+        if keep:
+            self._exporter().submit(spans)
+
+    def _exporter(self):
+        if self.exporter is None:
+            with self._lock:
+                if self.exporter is None:
+                    self.exporter = SpanExporter()
+        return self.exporter
+
+
+def export_request(spans: list, service_name: str = TRACE_SERVICE_NAME) -> dict:
+    """An OTLP/JSON ExportTraceServiceRequest for finished spans"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{
+                "scope": {"name": "backend.services.tracing_service"},
+                "spans": [span.to_otlp() for span in spans],
+            }],
+        }]
+    }
+
+
+class SpanExporter:
+    """Background writer of kept traces to TRACE_FILE or an OTLP/HTTP endpoint"""
+
+    def __init__(self, kind: str = TRACE_EXPORTER, path: str = TRACE_FILE, endpoint: str = TRACE_OTLP_ENDPOINT,
+                 max_batch: int = 64):
+        self.kind = kind
+        self.path = path
+        self.endpoint = endpoint
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=10000)
+        self.exported = 0
+        self.failed = 0
+        threading.Thread(target=self._loop, name="trace-exporter", daemon=True).start()
+
+    def submit(self, spans: list):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.failed += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until queued traces have been written"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(export_request([span for spans in batch for span in spans]))
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"Trace export failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, payload: dict):
+        if self.kind == "otlp":
+            import requests
+            response = requests.post(self.endpoint, json=payload, timeout=5)
+            response.raise_for_status()
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(payload) + "\n")
+
+
+_traces = _TraceBuffer()
+
+
+def stats() -> dict:
+    exporter = _traces.exporter
+    return {
+        "enabled": TRACING_ENABLED,
+        "exporter": TRACE_EXPORTER,
+        "slow_ms": _traces.slow_ms,
+        "traces_kept": _traces.kept,
+        "traces_dropped": _traces.dropped,
+        "traces_exported": exporter.exported if exporter is not None else 0,
+        "export_failures": exporter.failed if exporter is not None else 0,
+    }
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per request to the given paths"""
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        root = server_span(f"{scope['method']} {scope['path']}",
+                           Headers(scope=scope).get(TRACEPARENT_HEADER),
+                           **{"http.method": scope["method"], "http.route": scope["path"]})
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    root.fail(f"HTTP {message['status']}")
+                MutableHeaders(scope=message).append(TRACEPARENT_HEADER, root.traceparent)
+            await send(message)
+
+        with root:
+            await self.app(scope, receive, send_with_trace)
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    """Accepts OTLP/HTTP JSON exports and appends them to the server's file"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.send_response(400)
+            self.end_headers()
+            return
+        with self.server.lock, open(self.server.out, "a") as f:
+            f.write(json.dumps(payload) + "\n")
+        for resource in payload.get("resourceSpans", []):
+            for scope in resource.get("scopeSpans", []):
+                for span in scope.get("spans", []):
+                    if not span.get("parentSpanId") or span.get("kind") == KIND_SERVER:
+                        duration = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+                        print(f"trace {span['traceId']} {span['name']} {duration:.1f} ms")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OTLP/HTTP JSON collector stand-in")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--out", default="traces.jsonl", help="file the received exports are appended to")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), _CollectorHandler)
+    server.out = args.out
+    server.lock = threading.Lock()
+    print(f"Collecting OTLP/JSON traces on http://127.0.0.1:{args.port}/v1/traces into {args.out}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
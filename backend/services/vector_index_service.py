@@ -0,0 +1,323 @@
+"""
+Vector Index Service - Compressed dense indexes for the local corpus
+Modes: flat (float32), float16, ivfpq (FAISS IVF-PQ) and binary
+(Hamming prefilter + exact float16 rescoring of a shortlist).
+All indexes use inner product over L2-normalized vectors (cosine similarity).
+"""
+import json
+import os
+
+# Try to import ML packages with fallback
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+    np = None
+
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+    faiss = None
+
+INDEX_MODES = ("flat", "float16", "ivfpq", "binary")
+MANIFEST_FILE = "dense_index.json"
+
+# Rows scored per block when scanning float16 / binary codes
+_BLOCK_ROWS = 8192
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, ids, k):
+    """Select the k best (scores, ids) pairs, best first"""
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[part], ids[part]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], ids[order]
+
+
+def _scan(matrix, query, rows):
+    """Exact inner products of one query against (a subset of) matrix rows"""
+    if rows is not None:
+        return (matrix[rows].astype(np.float32) @ query).astype(np.float32)
+    scores = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], _BLOCK_ROWS):
+        block = matrix[start:start + _BLOCK_ROWS].astype(np.float32, copy=False)
+        scores[start:start + len(block)] = block @ query
+    return scores
+
+
+class DenseIndex:
+    """Base class: search() returns (scores, row_ids) per query, best first"""
+
+    mode = None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:
+        raise NotImplementedError
+
+    def search(self, queries, k: int = 10, rows=None):
+        """
+        Search normalized queries; rows optionally restricts the search to a
+        subset of row ids (a pre-filter, which makes the scan cheaper).
+        """
+        queries = _normalize(queries)
+        if rows is not None:
+            rows = np.unique(np.asarray(rows, dtype=np.int64))
+        k = min(k, len(self) if rows is None else len(rows))
+        results = []
+        for query in queries:
+            if k <= 0:
+                results.append((np.empty(0, np.float32), np.empty(0, np.int64)))
+            else:
+                results.append(self._search_one(query, k, rows))
+        return results
+
+    def _search_one(self, query, k, rows):
+        raise NotImplementedError
+
+    def save(self, path: str):
+        raise NotImplementedError
+
+
+class FlatIndex(DenseIndex):
+    """Uncompressed float32 baseline (FAISS IndexFlatIP when available)"""
+
+    mode = "flat"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self._faiss = None
+        if HAS_FAISS:
+            self._faiss = faiss.IndexFlatIP(vectors.shape[1])
+            self._faiss.add(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.vectors.nbytes)
+
+    def _search_one(self, query, k, rows):
+        if rows is None and self._faiss is not None:
+            D, I = self._faiss.search(query[None, :], k)
+            return D[0], I[0].astype(np.int64)
+        ids = rows if rows is not None else np.arange(len(self), dtype=np.int64)
+        return _top_k(_scan(self.vectors, query, rows), ids, k)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, "vectors.f32.npy"), np.asarray(self.vectors, dtype=np.float32))
+
+
+class Float16Index(DenseIndex):
+    """Half-precision storage, scored block-wise in float32"""
+
+    mode = "float16"
+
+    def __init__(self, vectors):
+        self.vectors = vectors if vectors.dtype == np.float16 else vectors.astype(np.float16)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.vectors.nbytes)
+
+    def _search_one(self, query, k, rows):
+        ids = rows if rows is not None else np.arange(len(self), dtype=np.int64)
+        return _top_k(_scan(self.vectors, query, rows), ids, k)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, "vectors.f16.npy"), self.vectors)
+
+
+class IVFPQIndex(DenseIndex):
+    """FAISS inverted file with product-quantized codes"""
+
+    mode = "ivfpq"
+
+    def __init__(self, index, nprobe: int = 16):
+        self.index = index
+        self.index.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, nlist: int = 1024, m: int = 48, nbits: int = 8, nprobe: int = 16):
+        if not HAS_FAISS:
+            raise ImportError("faiss is required for the ivfpq index mode")
+        dimension = vectors.shape[1]
+        # FAISS needs enough training points per centroid
+        nlist = max(1, min(nlist, vectors.shape[0] // 39))
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        return cls(index, nprobe=nprobe)
+
+    def __len__(self):
+        return self.index.ntotal
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.index.ntotal * self.index.pq.code_size
+                   + self.index.nlist * self.index.d * 4
+                   + self.index.pq.M * self.index.pq.ksub * self.index.pq.dsub * 4)
+
+    def _search_one(self, query, k, rows):
+        params = None
+        if rows is not None:
+            params = faiss.SearchParametersIVF(sel=faiss.IDSelectorBatch(rows), nprobe=self.index.nprobe)
+        D, I = self.index.search(query[None, :], k, params=params)
+        keep = I[0] >= 0
+        return D[0][keep], I[0][keep].astype(np.int64)
+
+    def save(self, path: str):
+        faiss.write_index(self.index, os.path.join(path, "ivfpq.faiss"))
+
+
+# Number of set bits for every byte value
+_POPCOUNT = None
+
+
+def _popcount_table():
+    global _POPCOUNT
+    if _POPCOUNT is None:
+        _POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+    return _POPCOUNT
+
+
+class BinaryIndex(DenseIndex):
+    """
+    1-bit sign codes scanned by Hamming distance, then the shortlist is
+    rescored exactly against float16 vectors (which can stay on disk via mmap).
+    """
+
+    mode = "binary"
+
+    def __init__(self, codes, rescore_vectors, shortlist: int = 200):
+        self.codes = codes
+        self.rescore_vectors = rescore_vectors
+        self.shortlist = shortlist
+
+    @classmethod
+    def build(cls, vectors, shortlist: int = 200):
+        codes = np.packbits(vectors > 0, axis=1)
+        return cls(codes, vectors.astype(np.float16), shortlist=shortlist)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        # Only the codes need to be resident; rescoring touches shortlist rows
+        return int(self.codes.nbytes)
+
+    def _hamming(self, query_code, rows):
+        table = _popcount_table()
+        if rows is not None:
+            return table[np.bitwise_xor(self.codes[rows], query_code)].sum(axis=1, dtype=np.int32)
+        distances = np.empty(len(self), dtype=np.int32)
+        for start in range(0, len(self), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS]
+            distances[start:start + len(block)] = table[np.bitwise_xor(block, query_code)].sum(axis=1, dtype=np.int32)
+        return distances
+
+    def _search_one(self, query, k, rows):
+        query_code = np.packbits(query > 0)
+        ids = rows if rows is not None else np.arange(len(self), dtype=np.int64)
+        distances = self._hamming(query_code, rows)
+
+        shortlist = min(len(ids), max(self.shortlist, k))
+        if shortlist < len(ids):
+            part = np.argpartition(distances, shortlist - 1)[:shortlist]
+        else:
+            part = np.arange(len(ids))
+        candidates = np.sort(ids[part])
+
+        scores = (self.rescore_vectors[candidates].astype(np.float32) @ query).astype(np.float32)
+        return _top_k(scores, candidates, k)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, "codes.u1.npy"), self.codes)
+        np.save(os.path.join(path, "vectors.f16.npy"), self.rescore_vectors)
+
+
+def build_dense_index(vectors, mode: str = "flat", **params) -> DenseIndex:
+    """Build a dense index over embeddings (normalized here) in the given mode"""
+    if not HAS_NUMPY:
+        raise ImportError("numpy is required for dense indexes")
+    if mode not in INDEX_MODES:
+        raise ValueError(f"Unknown dense index mode '{mode}'. Supported: {', '.join(INDEX_MODES)}")
+
+    vectors = np.ascontiguousarray(_normalize(vectors))
+    if mode == "flat":
+        return FlatIndex(vectors)
+    if mode == "float16":
+        return Float16Index(vectors)
+    if mode == "ivfpq":
+        return IVFPQIndex.build(vectors, **params)
+    return BinaryIndex.build(vectors, **params)
+
+
+def save_dense_index(index: DenseIndex, path: str):
+    """Persist an index next to the article store columns"""
+    os.makedirs(path, exist_ok=True)
+    index.save(path)
+    manifest = {"mode": index.mode, "count": len(index)}
+    if isinstance(index, IVFPQIndex):
+        manifest["nprobe"] = index.index.nprobe
+    if isinstance(index, BinaryIndex):
+        manifest["shortlist"] = index.shortlist
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+
+def load_dense_index(path: str) -> DenseIndex:
+    """Load a saved index; array-backed modes are memory-mapped read-only"""
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    mode = manifest["mode"]
+
+    if mode == "flat":
+        return FlatIndex(np.load(os.path.join(path, "vectors.f32.npy"), mmap_mode="r"))
+    if mode == "float16":
+        return Float16Index(np.load(os.path.join(path, "vectors.f16.npy"), mmap_mode="r"))
+    if mode == "ivfpq":
+        if not HAS_FAISS:
+            raise ImportError("faiss is required for the ivfpq index mode")
+        index = faiss.read_index(os.path.join(path, "ivfpq.faiss"))
+        return IVFPQIndex(index, nprobe=manifest.get("nprobe", 16))
+    if mode == "binary":
+        return BinaryIndex(np.load(os.path.join(path, "codes.u1.npy"), mmap_mode="r"),
+                           np.load(os.path.join(path, "vectors.f16.npy"), mmap_mode="r"),
+                           shortlist=manifest.get("shortlist", 200))
+    raise ValueError(f"Unknown dense index mode '{mode}'")
+
+
+_dense_index = None
+
+
+def get_dense_index():
+    """Load the local corpus dense index once per process (None if absent)"""
+    global _dense_index
+    if _dense_index is None:
+        from backend.utils.config import LOCAL_CORPUS_DIR
+        path = os.path.join(LOCAL_CORPUS_DIR, "dense") if LOCAL_CORPUS_DIR else ""
+        if not HAS_NUMPY or not path or not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            return None
+        _dense_index = load_dense_index(path)
+    return _dense_index
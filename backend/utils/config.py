@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load .env file
@@ -6,8 +7,198 @@ load_dotenv()
 
 NVIDIA_MODEL = os.getenv("NVIDIA_MODEL", "meta/llama3-70b-instruct")
 NVIDIA_API_KEY = os.getenv("NVIDIA_API_KEY", "")
+# OpenAI-compatible endpoint to use instead of NVIDIA's (e.g. a load-test stand-in)
+NVIDIA_BASE_URL = os.getenv("NVIDIA_BASE_URL", "")
 
 # Warn if API key is not set, but don't crash
 if not NVIDIA_API_KEY:
     import warnings
     warnings.warn("NVIDIA_API_KEY not set. LLM features will fail. Set it in .env file.")
+
+# Local corpus (memory-mapped article store); empty disables it
+LOCAL_CORPUS_DIR = os.getenv("LOCAL_CORPUS_DIR", "")
+
+# Offline corpus pack (articles + BM25 postings + embeddings) used when NCBI
+# is unreachable; OFFLINE_MODE serves /ask from it without any network calls.
+# Without the pack file the source articles are indexed in memory.
+OFFLINE_MODE = os.getenv("OFFLINE_MODE", "false").lower() == "true"
+OFFLINE_PACK_PATH = os.getenv("OFFLINE_PACK_PATH") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "offline_pack.zip")
+OFFLINE_CORPUS_SOURCE = os.getenv("OFFLINE_CORPUS_SOURCE") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "offline_corpus.jsonl")
+
+# Dense index compression for the local corpus: flat, float16, ivfpq or binary
+DENSE_INDEX_MODE = os.getenv("DENSE_INDEX_MODE", "float16")
+
+# /ask streaming pipeline: embedding micro-batch size, cosine similarity at
+# which a candidate is cross-encoded early, and PMID -> embedding cache size
+PIPELINE_EMBED_BATCH = int(os.getenv("PIPELINE_EMBED_BATCH", "8"))
+EARLY_RERANK_THRESHOLD = float(os.getenv("EARLY_RERANK_THRESHOLD", "0.5"))
+ARTICLE_CACHE_SIZE = int(os.getenv("ARTICLE_CACHE_SIZE", "5000"))
+# Memoized model results: normalized query -> embedding, and
+# (query, abstract) -> cross-encoder score
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+RERANK_SCORE_CACHE_SIZE = int(os.getenv("RERANK_SCORE_CACHE_SIZE", "100000"))
+# Extractive answers (mode="fast" and the LLM fallback): character budget for
+# the quoted sentences, MMR relevance/diversity trade-off (1 = relevance only)
+# and abstracts whose sentence embeddings are kept
+EXTRACTIVE_MAX_CHARS = int(os.getenv("EXTRACTIVE_MAX_CHARS", "900"))
+EXTRACTIVE_MMR_LAMBDA = float(os.getenv("EXTRACTIVE_MMR_LAMBDA", "0.7"))
+EXTRACTIVE_SENTENCE_CACHE_SIZE = int(os.getenv("EXTRACTIVE_SENTENCE_CACHE_SIZE", "4096"))
+
+# NCBI E-utilities: optional API key raises the rate budget from 3 to 10 req/s
+NCBI_API_KEY = os.getenv("NCBI_API_KEY", "")
+NCBI_MAX_RPS = float(os.getenv("NCBI_MAX_RPS", "0"))  # 0 = derive from the API key
+NCBI_EUTILS_URL = os.getenv("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+# Query variants per question: "true" runs raw, keyword, MeSH and synonym
+# esearches concurrently, "false" only the raw question, and "auto" fans out
+# only with a budget of 10 req/s (an API key) - below it the raw and MeSH
+# variants are OR'ed into a single esearch
+PUBMED_QUERY_FANOUT = os.getenv("PUBMED_QUERY_FANOUT", "auto").lower()
+# Recent esearch results kept for requests too short on time to call NCBI
+PUBMED_SEARCH_CACHE_SIZE = int(os.getenv("PUBMED_SEARCH_CACHE_SIZE", "1024"))
+
+# Report extraction limits; PDFs with at least REPORT_PARALLEL_MIN_PAGES
+# pages are split across REPORT_EXTRACT_WORKERS processes (<= 1 disables)
+REPORT_MAX_BYTES = int(os.getenv("REPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+REPORT_MAX_PAGES = int(os.getenv("REPORT_MAX_PAGES", "150"))
+REPORT_EXTRACT_TIMEOUT = float(os.getenv("REPORT_EXTRACT_TIMEOUT", "30"))
+REPORT_EXTRACT_WORKERS = int(os.getenv("REPORT_EXTRACT_WORKERS", "2"))
+REPORT_PARALLEL_MIN_PAGES = int(os.getenv("REPORT_PARALLEL_MIN_PAGES", "8"))
+
+# Upload spooling and the content-addressed parsed-report cache
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "automedrag-report-cache")
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Vocabulary files (<category>.txt, one term per line) for the lexicon matcher
+LEXICON_DIR = os.getenv("LEXICON_DIR") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "lexicons")
+
+# Plain-language glossary for /explain-term ("term|alias<TAB>definition"
+# lines), the spelling-error budget for fuzzy lookups, and how many LLM
+# definitions of terms missing from the glossary are remembered
+GLOSSARY_PATH = os.getenv("GLOSSARY_PATH") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "glossary.tsv")
+GLOSSARY_MAX_EDITS = int(os.getenv("GLOSSARY_MAX_EDITS", "2"))
+GLOSSARY_CACHE_SIZE = int(os.getenv("GLOSSARY_CACHE_SIZE", "1024"))
+
+# Report sessions (report_id -> pre-split report): idle TTL in seconds, and
+# the in-memory budget beyond which least recently used sessions spill to disk
+REPORT_SESSION_TTL = int(os.getenv("REPORT_SESSION_TTL", "3600"))
+REPORT_SESSION_MAX_BYTES = int(os.getenv("REPORT_SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+REPORT_SESSION_DIR = os.getenv("REPORT_SESSION_DIR") or os.path.join(tempfile.gettempdir(), "automedrag-report-sessions")
+
+# Per-report retrieval: chunk size, chunks used to answer a question, and the
+# character budget of report context sent with a summary prompt
+REPORT_CHUNK_CHARS = int(os.getenv("REPORT_CHUNK_CHARS", "600"))
+REPORT_CONTEXT_CHUNKS = int(os.getenv("REPORT_CONTEXT_CHUNKS", "4"))
+REPORT_SUMMARY_CONTEXT_CHARS = int(os.getenv("REPORT_SUMMARY_CONTEXT_CHARS", "5000"))
+
+# Map-reduce summarization of long reports: section-aware chunk size, parallel
+# LLM calls, and how many chunk/merge summaries are memoized for re-uploads
+REPORT_MAP_CHUNK_CHARS = int(os.getenv("REPORT_MAP_CHUNK_CHARS", "4000"))
+REPORT_SUMMARY_CONCURRENCY = int(os.getenv("REPORT_SUMMARY_CONCURRENCY", "4"))
+REPORT_SUMMARY_CACHE_SIZE = int(os.getenv("REPORT_SUMMARY_CACHE_SIZE", "2048"))
+
+# Background report jobs: worker threads, pending jobs accepted before new
+# submissions are refused, SQLite job table, stored uploads, and how long
+# finished jobs are kept
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_MAX_QUEUE = int(os.getenv("REPORT_JOB_MAX_QUEUE", "32"))
+REPORT_JOB_DB = os.getenv("REPORT_JOB_DB") or os.path.join(tempfile.gettempdir(), "automedrag-jobs", "jobs.sqlite3")
+REPORT_JOB_DIR = os.getenv("REPORT_JOB_DIR") or os.path.join(tempfile.gettempdir(), "automedrag-jobs", "uploads")
+REPORT_JOB_RETENTION = int(os.getenv("REPORT_JOB_RETENTION", "86400"))
+
+# Seconds a running job's lease lasts without a heartbeat from its process
+# before another process may requeue it
+REPORT_JOB_LEASE = int(os.getenv("REPORT_JOB_LEASE", "60"))
+
+# Conversation sessions for /ask: idle TTL in seconds, sessions kept (least
+# recently used dropped first), per-session memory cap, turns and answer
+# characters in the condensed context, and the question similarity above
+# which a follow-up re-ranks earlier candidates instead of searching PubMed
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "3600"))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "500"))
+CONVERSATION_SESSION_MAX_BYTES = int(os.getenv("CONVERSATION_SESSION_MAX_BYTES", str(256 * 1024)))
+CONVERSATION_CONTEXT_TURNS = int(os.getenv("CONVERSATION_CONTEXT_TURNS", "2"))
+CONVERSATION_ANSWER_CHARS = int(os.getenv("CONVERSATION_ANSWER_CHARS", "400"))
+CONVERSATION_REUSE_THRESHOLD = float(os.getenv("CONVERSATION_REUSE_THRESHOLD", "0.8"))
+
+# Conversation state shared by the API processes (each turn is written here)
+CONVERSATION_DIR = os.getenv("CONVERSATION_DIR") or os.path.join(tempfile.gettempdir(), "automedrag-conversations")
+
+# Shared model server: Unix socket of `python -m backend.services.model_server_service`
+# (empty loads the embedding and rerank models in every worker), the largest
+# cross-worker batch, how long the server waits to fill one, the per-connection
+# shared-memory result buffer, and the client timeout in seconds
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "")
+MODEL_SERVER_MAX_BATCH = int(os.getenv("MODEL_SERVER_MAX_BATCH", "64"))
+MODEL_SERVER_BATCH_WAIT_MS = float(os.getenv("MODEL_SERVER_BATCH_WAIT_MS", "5"))
+MODEL_SERVER_SHM_BYTES = int(os.getenv("MODEL_SERVER_SHM_BYTES", str(4 * 1024 * 1024)))
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "30"))
+
+# /ask time budget in seconds when the client sends no X-Request-Deadline-Ms
+# header, and the budget each stage needs before it falls back to a cheaper
+# path (cached PubMed only, keyword scoring, no cross-encoder, extractive answer)
+ASK_DEADLINE_SECONDS = float(os.getenv("ASK_DEADLINE_SECONDS", "30"))
+DEADLINE_FETCH_MIN_SECONDS = float(os.getenv("DEADLINE_FETCH_MIN_SECONDS", "4"))
+DEADLINE_EMBED_MIN_SECONDS = float(os.getenv("DEADLINE_EMBED_MIN_SECONDS", "2"))
+DEADLINE_RERANK_MIN_SECONDS = float(os.getenv("DEADLINE_RERANK_MIN_SECONDS", "1.5"))
+DEADLINE_LLM_MIN_SECONDS = float(os.getenv("DEADLINE_LLM_MIN_SECONDS", "3"))
+
+# Admission control: requests processed at once before new ones queue (the
+# lower priority classes get a smaller share), the hard in-flight limit, and
+# each client's token bucket (requests per second and burst size; 0 = off)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "8"))
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "2"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "20"))
+
+# Who a token bucket belongs to: the address ADMISSION_FORWARDED_HOPS trusted
+# proxies recorded in X-Forwarded-For (0 = the connecting address, which
+# behind a proxy is the proxy's). ADMISSION_CLIENT_HEADER names a per-user id
+# header (empty = ignored); the id gets its own bucket only on requests that
+# carry ADMISSION_FRONTEND_SECRET (the Streamlit app's), and otherwise only
+# splits the caller's address bucket further
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")
+ADMISSION_FRONTEND_SECRET = os.getenv("ADMISSION_FRONTEND_SECRET", "")
+ADMISSION_FORWARDED_HOPS = int(os.getenv("ADMISSION_FORWARDED_HOPS", "0"))
+
+# Admin token for the /debug endpoints and per-request profiling (empty = both
+# disabled); profiles sample stacks every PROFILE_INTERVAL_MS and the newest
+# PROFILE_MAX_COUNT are kept in PROFILE_DIR
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "automedrag-profiles")
+PROFILE_MAX_COUNT = int(os.getenv("PROFILE_MAX_COUNT", "100"))
+
+# Request tracing: spans exported as OTLP/JSON lines to TRACE_FILE
+# (TRACE_EXPORTER=file) or POSTed to an OTLP/HTTP collector
+# (TRACE_EXPORTER=otlp); with TRACE_SLOW_MS > 0 only traces at least that
+# slow (or failed) are kept
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "file")
+TRACE_FILE = os.getenv("TRACE_FILE") or os.path.join(tempfile.gettempdir(), "automedrag-traces", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "automedrag")
+
+# Near-duplicate collapsing: articles whose abstracts have an estimated
+# Jaccard similarity (MinHash over word shingles) of at least DEDUP_THRESHOLD
+# are dropped before embedding and at corpus ingestion. DEDUP_BANDS LSH bands
+# split DEDUP_NUM_PERM hashes; rebuild the corpus after changing either
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+DEDUP_SIGNATURE_CACHE_SIZE = int(os.getenv("DEDUP_SIGNATURE_CACHE_SIZE", "10000"))
+
+# Traffic capture for load-test replay (benchmarks/replay_traffic.py): a
+# CAPTURE_SAMPLE_RATE share of /ask and report requests is written, with
+# questions scrubbed and ids hashed with CAPTURE_SALT, to JSONL files in
+# CAPTURE_DIR rotated at CAPTURE_MAX_BYTES (the newest CAPTURE_MAX_FILES kept)
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+CAPTURE_DIR = os.getenv("CAPTURE_DIR") or os.path.join(tempfile.gettempdir(), "automedrag-capture")
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "10"))
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")
@@ -0,0 +1,229 @@
+"""
+Golden check and benchmark for the single-pass report section segmenter
+Verifies extract_key_sections against the golden corpus in
+benchmarks/data/key_sections, checks that every section's candidates match
+the previous multi-pass implementation, and times both on large reports.
+Also compares per-term substring scanning with the Aho-Corasick lexicon as
+the vocabulary grows.
+
+Run as: python -m benchmarks.bench_key_sections [--regenerate] [--lines 50000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from backend.services.lexicon_service import Lexicon, get_lexicon
+from backend.services.report_parser_service import extract_key_sections, segment_report
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "data", "key_sections")
+
+
+def legacy_key_sections(text: str, limit=6) -> dict:
+    """The previous multi-pass implementation, kept as the reference"""
+    sections = {"diagnoses": [], "medications": [], "procedures": [], "allergies": [], "vital_signs": []}
+    lines = text.split('\n')
+
+    for i, line in enumerate(lines):
+        if 'diagnosis' in line.lower() or 'medical condition' in line.lower():
+            for j in range(i+1, min(i+8, len(lines))):
+                stripped = lines[j].strip()
+                if stripped and not any(x in stripped.lower() for x in ['medication', 'allergy', 'vital', 'procedure']):
+                    if len(stripped) > 3:
+                        sections["diagnoses"].append(stripped)
+                if 'medication' in lines[j].lower():
+                    break
+
+    for i, line in enumerate(lines):
+        if 'medication' in line.lower() or 'drug' in line.lower():
+            for j in range(i+1, min(i+8, len(lines))):
+                stripped = lines[j].strip()
+                if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'allergy', 'vital', 'procedure']):
+                    if len(stripped) > 3:
+                        sections["medications"].append(stripped)
+                if any(x in lines[j].lower() for x in ['diagnosis', 'allergy', 'vital', 'procedure']):
+                    break
+
+    sections["allergies"] = legacy_allergies(text, limit)
+
+    for i, line in enumerate(lines):
+        if 'procedure' in line.lower() or 'surgery' in line.lower() or 'test' in line.lower():
+            for j in range(i+1, min(i+6, len(lines))):
+                stripped = lines[j].strip()
+                if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'medication', 'allergy']):
+                    if len(stripped) > 3:
+                        sections["procedures"].append(stripped)
+                if any(x in lines[j].lower() for x in ['diagnosis', 'medication', 'allergy']):
+                    break
+
+    for i, line in enumerate(lines):
+        if 'vital' in line.lower():
+            for j in range(i, min(i+7, len(lines))):
+                stripped = lines[j].strip()
+                if stripped and not any(x in stripped.lower() for x in ['diagnosis', 'medication']):
+                    if len(stripped) > 3:
+                        sections["vital_signs"].append(stripped)
+
+    for key in sections:
+        sections[key] = list(set(sections[key]))[:limit]
+    return sections
+
+
+def legacy_allergies(text: str, limit=6) -> list:
+    allergies = set()
+    text_lower = text.lower()
+    lines = text.split('\n')
+    allergy_keywords = ['penicillin', 'aspirin', 'ibuprofen', 'sulfa', 'latex', 'peanut',
+                        'tree nut', 'shellfish', 'egg', 'milk', 'gluten', 'morphine',
+                        'codeine', 'sulfonamide', 'ace inhibitor', 'beta blocker']
+    for i, line in enumerate(lines):
+        if 'allerg' in line.lower():
+            for j in range(i, min(i+4, len(lines))):
+                text_segment = lines[j].strip()
+                if text_segment and len(text_segment) > 2 and text_segment.lower() != 'allergies:' and text_segment.lower() != 'allergy':
+                    allergies.add(text_segment)
+    for allergen in allergy_keywords:
+        if allergen in text_lower:
+            for line in lines:
+                if allergen in line.lower() and len(line.strip()) > 0:
+                    allergies.add(line.strip())
+    if 'nkda' in text_lower or 'no known allergy' in text_lower or 'nka' in text_lower:
+        allergies.add("No known allergies reported")
+    clean = [a for a in allergies if a.lower() not in ['allergy:', 'allergies:', 'drug allergy:', 'allergies:']]
+    return sorted(list(set(clean)))[:limit]
+
+
+def check_equivalence(name: str, text: str) -> list:
+    """
+    Compare full (untruncated) candidate sets with the legacy implementation.
+    The legacy top-6 came from set iteration order, so only the sets are
+    comparable. Medications and allergies also take lines naming a lexicon
+    term, so they must contain the legacy candidates; the rest must match.
+    """
+    problems = []
+    legacy = legacy_key_sections(text, limit=None)
+    segments = segment_report(text)
+    for section, candidates in segments.items():
+        if section in ("medications", "allergies"):
+            if not set(legacy[section]) <= set(candidates):
+                problems.append(f"{name}: {section} misses legacy candidates")
+        elif set(candidates) != set(legacy[section]):
+            problems.append(f"{name}: {section} differs from legacy")
+    return problems
+
+
+def check_golden(regenerate: bool) -> int:
+    problems = []
+    names = sorted(f for f in os.listdir(CORPUS_DIR) if f.endswith(".txt"))
+    for filename in names:
+        with open(os.path.join(CORPUS_DIR, filename), encoding="utf-8") as f:
+            text = f.read()
+        expected_path = os.path.join(CORPUS_DIR, filename[:-4] + ".json")
+        result = extract_key_sections(text)
+        if regenerate:
+            with open(expected_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+                f.write("\n")
+        else:
+            with open(expected_path, encoding="utf-8") as f:
+                if json.load(f) != result:
+                    problems.append(f"{filename}: output differs from golden")
+        problems += check_equivalence(filename, text)
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print(f"golden corpus: {len(names)} reports, {len(problems)} problems")
+    return len(problems)
+
+
+def make_report(lines: int, seed: int) -> str:
+    """Large synthetic report stitched from the golden corpus plus filler"""
+    rng = random.Random(seed)
+    pool = []
+    for filename in sorted(os.listdir(CORPUS_DIR)):
+        if filename.endswith(".txt"):
+            with open(os.path.join(CORPUS_DIR, filename), encoding="utf-8") as f:
+                pool.extend(f.read().split("\n"))
+    filler = "Patient tolerated the visit well and questions were answered in detail."
+    return "\n".join(rng.choice(pool) if rng.random() < 0.6 else filler for _ in range(lines))
+
+
+def legacy_term_scan(text: str, terms) -> set:
+    """Legacy per-term matching: one substring test per term, then per line"""
+    text_lower = text.lower()
+    lines = text.split('\n')
+    hits = set()
+    for term in terms:
+        if term in text_lower:
+            for line in lines:
+                if term in line.lower() and len(line.strip()) > 0:
+                    hits.add(line.strip())
+    return hits
+
+
+def make_vocabulary(size: int, seed: int) -> list:
+    """Bundled allergen terms padded with random pseudo-words"""
+    rng = random.Random(seed)
+    terms = [term for term, category in _bundled_terms() if category == "allergens"]
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    while len(terms) < size:
+        terms.append("".join(rng.choice(letters) for _ in range(rng.randint(6, 12))))
+    return terms[:size]
+
+
+def _bundled_terms():
+    lexicon = get_lexicon()
+    return [entry[:2] for node in lexicon._output for entry in node]
+
+
+def time_call(func, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def run(args):
+    failures = check_golden(args.regenerate)
+
+    print(f"{'lines':>8}{'legacy ms':>12}{'single-pass ms':>16}{'speedup':>9}{'consistent':>11}")
+    for lines in args.lines:
+        text = make_report(lines, args.seed)
+        legacy_ms = time_call(legacy_key_sections, text, args.repeat)
+        new_ms = time_call(extract_key_sections, text, args.repeat)
+        consistent = not check_equivalence(f"synthetic-{lines}", text)
+        failures += not consistent
+        print(f"{lines:>8}{legacy_ms:>12.1f}{new_ms:>16.1f}{legacy_ms / new_ms:>8.1f}x{str(consistent):>11}")
+
+    print()
+    print(f"{'terms':>8}{'per-term ms':>14}{'lexicon ms':>12}{'speedup':>9}")
+    text = make_report(args.vocab_lines, args.seed)
+    for size in args.vocab_sizes:
+        terms = make_vocabulary(size, args.seed)
+        lexicon = Lexicon()
+        for term in terms:
+            lexicon.add(term, "allergens")
+        lexicon.build()
+        legacy_ms = time_call(lambda t: legacy_term_scan(t, terms), text, 1)
+        lexicon_ms = time_call(lexicon.find, text, args.repeat)
+        print(f"{size:>8}{legacy_ms:>14.1f}{lexicon_ms:>12.1f}{legacy_ms / lexicon_ms:>8.1f}x")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--regenerate", action="store_true", help="rewrite the golden .json files")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[16, 1000, 20000])
+    parser.add_argument("--vocab-lines", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(1 if run(parser.parse_args()) else 0)
+
+
+if __name__ == "__main__":
+    main()
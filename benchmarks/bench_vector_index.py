@@ -0,0 +1,83 @@
+"""
+Benchmark: recall@10 vs memory vs query latency for dense index modes
+Compares each compressed mode against the exact flat (float32) baseline.
+
+Run as: python -m benchmarks.bench_vector_index --rows 200000 --queries 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from backend.services.vector_index_service import INDEX_MODES, build_dense_index
+
+
+def make_corpus(rows: int, dim: int, clusters: int, seed: int):
+    """Clustered unit vectors, roughly shaped like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, rows)
+    vectors = centers[assignment] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors, centers, rng
+
+
+def make_queries(vectors, count: int, rng):
+    """Perturbed copies of corpus rows so every query has close neighbours"""
+    picks = rng.integers(0, len(vectors), count)
+    return vectors[picks] + 0.3 * rng.standard_normal((count, vectors.shape[1])).astype(np.float32)
+
+
+def run(args):
+    vectors, _, rng = make_corpus(args.rows, args.dim, args.clusters, args.seed)
+    queries = make_queries(vectors, args.queries, rng)
+
+    baseline = build_dense_index(vectors, "flat")
+    truth = [set(ids.tolist()) for _, ids in baseline.search(queries, args.k)]
+
+    print(f"rows={args.rows} dim={args.dim} queries={args.queries} k={args.k}")
+    print(f"{'mode':<10}{'recall@' + str(args.k):>12}{'memory MB':>12}{'x smaller':>11}{'ms/query':>11}{'build s':>10}")
+
+    for mode in args.modes:
+        params = {}
+        if mode == "ivfpq":
+            params = {"nlist": args.nlist, "m": args.pq_m, "nprobe": args.nprobe}
+        elif mode == "binary":
+            params = {"shortlist": args.shortlist}
+
+        started = time.perf_counter()
+        try:
+            index = baseline if mode == "flat" else build_dense_index(vectors, mode, **params)
+        except ImportError as e:
+            print(f"{mode:<10}  skipped: {e}")
+            continue
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = [index.search(query, args.k)[0] for query in queries]
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        hits = sum(len(truth[i] & set(ids.tolist())) for i, (_, ids) in enumerate(results))
+        recall = hits / (len(queries) * args.k)
+
+        print(f"{mode:<10}{recall:>12.3f}{index.nbytes / 2**20:>12.1f}"
+              f"{baseline.nbytes / index.nbytes:>11.1f}{latency_ms:>11.2f}{build_seconds:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=list(INDEX_MODES), choices=INDEX_MODES)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--shortlist", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
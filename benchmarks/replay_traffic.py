@@ -0,0 +1,318 @@
+"""
+Replay captured traffic against a running backend for capacity testing
+Reads the JSONL files written by the capture middleware (CAPTURE_DIR) and
+sends the same mix of /ask and report requests to --url: at the recorded
+pace (scaled by --speed), or at a fixed --rate, with at most --concurrency
+requests in flight. Captured conversation and report ids are digests, so
+each one is mapped to a session or a synthetic text report created on the
+target; uploads are replayed as text reports of the recorded size.
+
+With --stand-ins the fake NCBI and chat model servers (benchmarks.stand_ins)
+run in this process; start the backend with the environment it prints.
+
+Reports throughput, p50/p95/p99 of client latency and of each stage the
+backend timed, and error, shed (429/503) and fallback rates per endpoint.
+
+Run as: python -m benchmarks.replay_traffic [capture files or dirs] --url http://127.0.0.1:8000
+            [--rate recorded|<req/s>] [--speed 1.0] [--concurrency 16] [--limit 500] [--stand-ins]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from backend.services.capture_service import response_outcome, CAPTURE_FILE
+from backend.utils.config import CAPTURE_DIR
+
+REPORT_DIR = os.path.join(os.path.dirname(__file__), "data", "key_sections")
+REPLAYED_PATHS = ("/ask", "/summarize-report", "/jobs/summarize-report", "/report-question", "/explain-term")
+
+
+def load_records(paths: list) -> list:
+    """Captured records from files and capture directories, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, "capture-*.jsonl")) + glob.glob(os.path.join(path, CAPTURE_FILE))
+        else:
+            files.append(path)
+    records = []
+    for name in files:
+        with open(name) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("path") in REPLAYED_PATHS:
+                    records.append(record)
+    return sorted(records, key=lambda r: r["ts"])
+
+
+def schedule(records: list, rate: str, speed: float) -> list:
+    """Send offset (seconds from start) of each record"""
+    if rate == "recorded":
+        start = records[0]["ts"] if records else 0
+        return [(record["ts"] - start) / speed for record in records]
+    return [i / float(rate) for i in range(len(records))]
+
+
+def synthetic_report(size: int) -> str:
+    """Golden-corpus reports repeated to roughly size characters"""
+    notes = []
+    for filename in sorted(os.listdir(REPORT_DIR)):
+        if filename.endswith(".txt"):
+            with open(os.path.join(REPORT_DIR, filename), encoding="utf-8") as f:
+                notes.append(f.read().strip())
+    size = max(size, 200)
+    text, i = "", 0
+    while len(text) < size:
+        text += notes[i % len(notes)] + "\n\n"
+        i += 1
+    return text[:size]
+
+
+class Replayer:
+    """Sends captured requests, mapping captured ids to ones made on the target"""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._http = threading.local()
+        self._sessions = {}
+        self._reports = {}
+        self._lock = threading.Lock()
+        self._pending = defaultdict(threading.Lock)
+
+    @property
+    def http(self) -> requests.Session:
+        if not hasattr(self._http, "session"):
+            self._http.session = requests.Session()
+        return self._http.session
+
+    def _mapped(self, table: dict, key: str, create):
+        """table[key], created once (other threads wait for it)"""
+        with self._lock:
+            pending = self._pending[(id(table), key)]
+        with pending:
+            if key not in table:
+                table[key] = create()
+            return table[key]
+
+    def _new_session(self) -> str:
+        response = self.http.post(f"{self.url}/sessions", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["session_id"]
+
+    def _new_report(self, size: int = 4000) -> str:
+        files = {"file": ("replay.txt", synthetic_report(size).encode("utf-8"), "text/plain")}
+        response = self.http.post(f"{self.url}/summarize-report", files=files, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["report_id"]
+
+    def _request(self, record: dict) -> dict:
+        """requests.post keyword arguments for one captured record"""
+        captured = record.get("request") or {}
+        headers = {}
+        if captured.get("deadline_ms"):
+            headers["X-Request-Deadline-Ms"] = str(captured["deadline_ms"])
+        path = record["path"]
+        if path.endswith("summarize-report"):
+            text = synthetic_report(captured.get("upload_bytes") or 4000)
+            return {"files": {"file": ("replay.txt", text.encode("utf-8"), "text/plain")}, "headers": headers}
+        body = {k: v for k, v in captured.items()
+                if k not in ("deadline_ms", "session_id", "report_id", "report_text_chars")}
+        if captured.get("session_id"):
+            body["session_id"] = self._mapped(self._sessions, captured["session_id"], self._new_session)
+        if captured.get("report_id"):
+            body["report_id"] = self._mapped(self._reports, captured["report_id"], self._new_report)
+        elif captured.get("report_text_chars"):
+            body["report_text"] = synthetic_report(captured["report_text_chars"])
+        body.setdefault("question" if path != "/explain-term" else "term", "replayed request")
+        return {"json": body, "headers": headers}
+
+    def send(self, record: dict) -> dict:
+        path = record["path"]
+        started = time.perf_counter()
+        try:
+            response = self.http.post(f"{self.url}{path}", timeout=self.timeout, **self._request(record))
+            if response.status_code == 404 and (record.get("request") or {}).get("session_id"):
+                # The mapped session expired on the target: start a new one
+                with self._lock:
+                    self._sessions.pop(record["request"]["session_id"], None)
+                response = self.http.post(f"{self.url}{path}", timeout=self.timeout, **self._request(record))
+            latency_ms = (time.perf_counter() - started) * 1000
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            return dict(response_outcome(path, response.status_code, data), path=path,
+                        status=response.status_code, latency_ms=latency_ms)
+        except requests.RequestException as e:
+            return {"path": path, "status": None, "latency_ms": (time.perf_counter() - started) * 1000,
+                    "error": True, "shed": False, "degradations": [], "timings": None,
+                    "exception": type(e).__name__}
+
+
+def stage_durations(timings) -> dict:
+    """Milliseconds per backend stage from a response's timings"""
+    if not isinstance(timings, dict):
+        return {}
+    durations = {}
+    for name, stage in (timings.get("stages") or {}).items():
+        if stage.get("end_ms") is not None and stage.get("start_ms") is not None:
+            durations[name] = stage["end_ms"] - stage["start_ms"]
+        elif stage.get("busy_ms") is not None:
+            durations[name] = stage["busy_ms"]
+    if isinstance(timings.get("answer"), dict):
+        durations[f"answer ({timings['answer'].get('mode')})"] = timings["answer"].get("busy_ms")
+    if timings.get("total_ms") is not None:
+        durations["server total"] = timings["total_ms"]
+    return {name: value for name, value in durations.items() if value is not None}
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    completed = [r for r in results if r["status"] is not None]
+    summary = {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(completed) / elapsed, 2) if elapsed else 0.0,
+        "endpoints": {},
+        "stages": {},
+        "degradations": dict(Counter(d for r in results for d in r["degradations"])),
+        "exceptions": dict(Counter(r["exception"] for r in results if r.get("exception"))),
+    }
+    by_path = defaultdict(list)
+    for result in results:
+        by_path[result["path"]].append(result)
+    for path, group in sorted(by_path.items()):
+        latencies = [r["latency_ms"] for r in group]
+        summary["endpoints"][path] = {
+            "count": len(group),
+            "error_rate": round(sum(r["error"] for r in group) / len(group), 4),
+            "shed_rate": round(sum(r["shed"] for r in group) / len(group), 4),
+            "fallback_rate": round(sum(bool(r["degradations"]) for r in group) / len(group), 4),
+            **{f"p{q}_ms": round(percentile(latencies, q), 1) for q in (50, 95, 99)},
+        }
+    stages = defaultdict(list)
+    for result in results:
+        for name, value in stage_durations(result["timings"]).items():
+            stages[name].append(value)
+    for name, values in stages.items():
+        summary["stages"][name] = {"count": len(values),
+                                   **{f"p{q}_ms": round(percentile(values, q), 1) for q in (50, 95, 99)}}
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']:.1f} s: "
+          f"{summary['throughput_rps']:.2f} completed req/s")
+    print(f"\n{'endpoint':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>9}{'shed':>8}{'fallback':>10}")
+    for path, row in summary["endpoints"].items():
+        print(f"{path:<24}{row['count']:>7}{row['p50_ms']:>10.0f}{row['p95_ms']:>10.0f}{row['p99_ms']:>10.0f}"
+              f"{row['error_rate']:>9.1%}{row['shed_rate']:>8.1%}{row['fallback_rate']:>10.1%}")
+    if summary["stages"]:
+        print(f"\n{'backend stage':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, row in sorted(summary["stages"].items(), key=lambda item: -item[1]["p50_ms"]):
+            print(f"{name:<24}{row['count']:>7}{row['p50_ms']:>10.0f}{row['p95_ms']:>10.0f}{row['p99_ms']:>10.0f}")
+    if summary["degradations"]:
+        print("\ndegradations: " + ", ".join(f"{k} x{v}" for k, v in sorted(summary["degradations"].items())))
+    if summary["exceptions"]:
+        print("client errors: " + ", ".join(f"{k} x{v}" for k, v in sorted(summary["exceptions"].items())))
+
+
+def run(args) -> dict:
+    if args.stand_ins:
+        from benchmarks.stand_ins import start_stand_ins
+        env = start_stand_ins(args.ncbi_port, args.llm_port, args.ncbi_latency_ms / 1000, args.llm_latency_ms / 1000)
+        print("Stand-ins running; the backend must be started with:")
+        for key, value in env.items():
+            print(f"  export {key}={value}")
+
+    records = load_records(args.captures or [CAPTURE_DIR])
+    if not records:
+        sys.exit(f"No captured requests found in {', '.join(args.captures or [CAPTURE_DIR])}")
+    if args.limit:
+        # Repeat a short capture to reach the limit, keeping its pace
+        span = records[-1]["ts"] - records[0]["ts"] + 1.0
+        records = [dict(records[i % len(records)], ts=records[i % len(records)]["ts"] + span * (i // len(records)))
+                   for i in range(args.limit)]
+    offsets = schedule(records, args.rate, args.speed)
+    print(f"replaying {len(records)} requests over ~{offsets[-1]:.1f} s against {args.url} "
+          f"(rate {args.rate}, concurrency {args.concurrency})")
+
+    replayer = Replayer(args.url, args.timeout)
+    slots = threading.Semaphore(args.concurrency)
+    results, late = [], 0
+
+    def send(record):
+        try:
+            results.append(replayer.send(record))
+        finally:
+            slots.release()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for record, offset in zip(records, offsets):
+            wait = offset - (time.perf_counter() - started)
+            if wait > 0:
+                time.sleep(wait)
+            slots.acquire()
+            # Sent more than 100 ms behind schedule: the concurrency limit is the bottleneck
+            late += (time.perf_counter() - started) - offset > 0.1
+            pool.submit(send, record)
+    summary = summarize(results, time.perf_counter() - started)
+    summary["sent_late"] = late
+    print_summary(summary)
+    if late:
+        print(f"{late} requests were sent late because --concurrency {args.concurrency} were in flight")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captures", nargs="*", help=f"capture files or directories (default {CAPTURE_DIR})")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", default="recorded", help="'recorded' or a fixed number of requests per second")
+    parser.add_argument("--speed", type=float, default=1.0, help="scale of the recorded pace (2 = twice as fast)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=0, help="replay this many requests, repeating the capture")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--stand-ins", action="store_true", help="serve fake NCBI and chat model endpoints")
+    parser.add_argument("--ncbi-port", type=int, default=8801)
+    parser.add_argument("--llm-port", type=int, default=8802)
+    parser.add_argument("--ncbi-latency-ms", type=float, default=150)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    args = parser.parse_args()
+    if args.rate != "recorded":
+        try:
+            if float(args.rate) <= 0:
+                raise ValueError
+        except ValueError:
+            parser.error("--rate must be 'recorded' or a positive number")
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    summary = run(args)
+    sys.exit(1 if any(row["error_rate"] for row in summary["endpoints"].values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Local stand-ins for NCBI E-utilities and the chat model, for load tests
+The fake E-utilities server answers esearch with PMIDs derived from the
+term and efetch with generated PubMed XML; the fake chat model serves an
+OpenAI-compatible /v1/chat/completions backed by FakeLLM. Both add a
+configurable latency so a replay exercises the backend's own stages rather
+than the real services' rate limits and bills.
+
+Start the backend against them with the environment printed at startup.
+
+Run as: python -m benchmarks.stand_ins [--ncbi-port 8801] [--llm-port 8802]
+                                       [--ncbi-latency-ms 150] [--llm-latency-ms 800]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+from backend.services.report_mapreduce_service import FakeLLM
+
+_TOPICS = ["pneumonia", "sepsis", "type 2 diabetes", "hypertension", "asthma", "heart failure",
+           "chronic kidney disease", "influenza", "atrial fibrillation", "COPD", "stroke", "migraine"]
+_INTERVENTIONS = ["antibiotic therapy", "metformin", "ACE inhibitors", "inhaled corticosteroids",
+                  "early mobilisation", "beta blockers", "vaccination", "anticoagulation", "statins"]
+_OUTCOMES = ["mortality", "hospital readmission", "length of stay", "symptom scores", "HbA1c",
+             "blood pressure", "exacerbation rate", "quality of life", "adverse events"]
+_DESIGNS = ["Randomized Controlled Trial", "Cohort Study", "Meta-Analysis", "Review", "Case Reports"]
+
+
+def fake_article(pmid: int) -> dict:
+    """A deterministic, plausible-looking abstract for a PMID"""
+    rng = random.Random(pmid)
+    topic, intervention = rng.choice(_TOPICS), rng.choice(_INTERVENTIONS)
+    outcomes = rng.sample(_OUTCOMES, 3)
+    patients = rng.randrange(40, 5000)
+    sentences = [
+        f"{topic.capitalize()} remains a leading cause of morbidity in adults.",
+        f"We assessed whether {intervention} changes {outcomes[0]} in patients with {topic}.",
+        f"A total of {patients} patients were enrolled across {rng.randrange(1, 40)} centres.",
+        f"{intervention.capitalize()} reduced {outcomes[0]} by {rng.randrange(5, 45)}% compared with usual care.",
+        f"Secondary outcomes included {outcomes[1]} and {outcomes[2]}, which improved modestly.",
+        f"Adverse events were reported in {rng.randrange(1, 20)}% of the intervention group.",
+        f"These findings support {intervention} for selected patients with {topic}.",
+    ]
+    return {
+        "pmid": pmid,
+        "title": f"{intervention.capitalize()} and {outcomes[0]} in {topic}: a {rng.choice(['multicentre', 'single-centre', 'population-based'])} study",
+        "abstract": " ".join(sentences[:rng.randrange(4, len(sentences) + 1)]),
+        "year": rng.randrange(2000, 2026),
+        "publication_type": rng.choice(_DESIGNS),
+        "mesh": topic.title(),
+    }
+
+
+def _article_xml(article: dict) -> str:
+    return (
+        "<PubmedArticle><MedlineCitation>"
+        f"<PMID>{article['pmid']}</PMID>"
+        f"<Article><Journal><JournalIssue><PubDate><Year>{article['year']}</Year></PubDate></JournalIssue></Journal>"
+        f"<ArticleTitle>{escape(article['title'])}</ArticleTitle>"
+        f"<Abstract><AbstractText>{escape(article['abstract'])}</AbstractText></Abstract>"
+        f"<PublicationTypeList><PublicationType>{article['publication_type']}</PublicationType></PublicationTypeList>"
+        "</Article>"
+        f"<MeshHeadingList><MeshHeading><DescriptorName>{escape(article['mesh'])}</DescriptorName></MeshHeading></MeshHeadingList>"
+        "</MedlineCitation></PubmedArticle>"
+    )
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, payload: dict, status: int = 200):
+        self._reply(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _delay(self):
+        latency = self.server.latency
+        if latency:
+            time.sleep(random.uniform(0.5, 1.5) * latency)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EutilsHandler(_StandInHandler):
+    """GET .../esearch.fcgi and .../efetch.fcgi"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self._delay()
+        with self.server.lock:
+            self.server.calls += 1
+        if url.path.endswith("esearch.fcgi"):
+            term = params.get("term", "")
+            rng = random.Random(zlib.crc32(term.lower().encode("utf-8")))
+            count = min(int(params.get("retmax", 20)), 200)
+            ids = [str(rng.randrange(10_000_000, 40_000_000)) for _ in range(count)]
+            self._json({"esearchresult": {"count": str(count), "idlist": ids}})
+        elif url.path.endswith("efetch.fcgi"):
+            ids = [int(pmid) for pmid in params.get("id", "").split(",") if pmid.strip().isdigit()]
+            body = "<?xml version=\"1.0\" ?><PubmedArticleSet>" + "".join(
+                _article_xml(fake_article(pmid)) for pmid in ids) + "</PubmedArticleSet>"
+            self._reply(200, body.encode("utf-8"), "text/xml")
+        else:
+            self._json({"error": f"Unknown E-utility: {url.path}"}, 404)
+
+
+class ChatHandler(_StandInHandler):
+    """OpenAI-compatible GET /v1/models and POST /v1/chat/completions"""
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json({"object": "list", "data": [{"id": self.server.model, "object": "model"}]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json({"error": "not found"}, 404)
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self._json({"error": "invalid JSON"}, 400)
+        prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        self._delay()
+        reply = self.server.llm(prompt) or "No relevant findings."
+        self._json({
+            "id": f"chatcmpl-{random.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", self.server.model),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(reply) // 4,
+                      "total_tokens": (len(prompt) + len(reply)) // 4},
+        })
+
+
+def start_stand_ins(ncbi_port: int = 8801, llm_port: int = 8802, ncbi_latency: float = 0.15,
+                    llm_latency: float = 0.8, model: str = "stand-in/chat") -> dict:
+    """Serve both stand-ins on daemon threads; returns the backend environment for them"""
+    eutils = ThreadingHTTPServer(("127.0.0.1", ncbi_port), EutilsHandler)
+    eutils.latency, eutils.lock, eutils.calls = ncbi_latency, threading.Lock(), 0
+    chat = ThreadingHTTPServer(("127.0.0.1", llm_port), ChatHandler)
+    # FakeLLM sleeps itself; the handler's own delay stays off
+    chat.latency, chat.llm, chat.model = 0, FakeLLM(llm_latency), model
+    for server in (eutils, chat):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return {
+        "NCBI_EUTILS_URL": f"http://127.0.0.1:{eutils.server_address[1]}/entrez/eutils",
+        # The stand-in has no rate limit to respect
+        "NCBI_MAX_RPS": "1000",
+        "NVIDIA_BASE_URL": f"http://127.0.0.1:{chat.server_address[1]}/v1",
+        "NVIDIA_API_KEY": "stand-in",
+        "NVIDIA_MODEL": model,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ncbi-port", type=int, default=8801)
+    parser.add_argument("--llm-port", type=int, default=8802)
+    parser.add_argument("--ncbi-latency-ms", type=float, default=150)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    args = parser.parse_args()
+    env = start_stand_ins(args.ncbi_port, args.llm_port, args.ncbi_latency_ms / 1000, args.llm_latency_ms / 1000)
+    print("Stand-ins running; start the backend with:")
+    for key, value in env.items():
+        print(f"  export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,3 +3,5 @@ set -e
 echo "Installing dependencies with prebuilt wheels only..."
 pip install --only-binary :all: -r requirements.txt 2>&1 || pip install --prefer-binary -r requirements.txt
 echo "Dependencies installed successfully!"
+echo "Building offline corpus pack..."
+python -m backend.services.offline_corpus_service || echo "Offline pack not built; source articles will be indexed at startup"
@@ -1,16 +1,36 @@
 import streamlit as st
 import requests
 import json
+import time
 
 # Configuration
 API_BASE_URL = "http://127.0.0.1:8000"
 API_ENDPOINT = f"{API_BASE_URL}/ask"
 
+# /ask is asked to answer (degrading if needed) a little before we give up on it
+ASK_TIMEOUT = 60
+ASK_HEADERS = {"X-Request-Deadline-Ms": str((ASK_TIMEOUT - 5) * 1000)}
+
+
+def wait_for_report_job(job_id, poll_seconds=1.0):
+    """Poll a background report job, showing its stage, until it finishes"""
+    progress = st.progress(0.0, text="Queued")
+    while True:
+        response = requests.get(f"{API_BASE_URL}/jobs/{job_id}", timeout=10)
+        if response.status_code != 200:
+            return response
+        job = response.json()
+        progress.progress(job["progress"], text=f"Stage: {job['stage']}")
+        if job["status"] in ("done", "failed"):
+            progress.empty()
+            return response
+        time.sleep(poll_seconds)
+
 st.set_page_config(page_title="AutoMedRAG", layout="wide", initial_sidebar_state="expanded")
 
-# Initialize session state for report text
-if "report_text" not in st.session_state:
-    st.session_state.report_text = ""
+# Initialize session state for the uploaded report's server-side id
+if "report_id" not in st.session_state:
+    st.session_state.report_id = ""
 
 # Initialize session state for research questions (kept separate)
 if "quick_research_results" not in st.session_state:
@@ -87,7 +107,8 @@ with tab1:
                 response = requests.post(
                     api_url,
                     json={"question": query, "history": []},
-                    timeout=60
+                    headers=ASK_HEADERS,
+                    timeout=ASK_TIMEOUT
                 )
 
                 if response.status_code == 200:
@@ -130,24 +151,19 @@ with tab2:
                 files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
                 
                 response = requests.post(
-                    f"{API_BASE_URL}/summarize-report",
+                    f"{API_BASE_URL}/jobs/summarize-report",
                     files=files,
                     timeout=60
                 )
+                if response.status_code == 200 and "job_id" in response.json():
+                    # The report is processed in the background; poll until it finishes
+                    response = wait_for_report_job(response.json()["job_id"])
                 
-                if response.status_code == 200:
-                    result = response.json()
+                if response.status_code == 200 and response.json().get("status") == "done":
+                    result = response.json()["result"]
                     
-                    # Store the actual extracted report text from backend response
-                    if result.get("report_text"):
-                        st.session_state.report_text = result["report_text"]
-                    else:
-                        # Fallback for older versions
-                        file_content = uploaded_file.read()
-                        if uploaded_file.name.endswith('.txt'):
-                            st.session_state.report_text = file_content.decode('utf-8', errors='ignore')
-                        else:
-                            st.session_state.report_text = "[Binary file]"
+                    # The backend keeps the parsed report; follow-ups only send this id
+                    st.session_state.report_id = result.get("report_id", "")
                     
                     st.success("✅ Report Analyzed Successfully!")
                     
@@ -5,6 +5,8 @@ Run as: streamlit run streamlit_app.py
 import streamlit as st
 import requests
 import json
+import secrets
+import time
 
 # Initialize session state for mic recording
 if "mic_query" not in st.session_state:
@@ -13,6 +15,66 @@ if "mic_query" not in st.session_state:
 # Configuration
 API_BASE_URL = st.secrets.get("API_URL", "http://127.0.0.1:8000")
 API_ENDPOINT = f"{API_BASE_URL}/ask"
+# Shared with the backend's ADMISSION_FRONTEND_SECRET so it trusts X-Client-Id
+FRONTEND_SECRET = st.secrets.get("FRONTEND_SECRET", "")
+
+# /ask is asked to answer (degrading if needed) a little before we give up on it
+ASK_TIMEOUT = 60
+ASK_HEADERS = {"X-Request-Deadline-Ms": str((ASK_TIMEOUT - 5) * 1000)}
+
+
+def traced(headers=None):
+    """
+    Headers starting a new trace (W3C traceparent) the backend continues,
+    plus this browser session's id: every user reaches the backend from
+    this server, so admission tells them apart by X-Client-Id, which it
+    trusts when the request carries the shared frontend secret
+    """
+    if "client_id" not in st.session_state:
+        st.session_state.client_id = secrets.token_hex(8)
+    headers = {**(headers or {}), "traceparent": f"00-{secrets.token_hex(16)}-{secrets.token_hex(8)}-01",
+               "X-Client-Id": st.session_state.client_id}
+    if FRONTEND_SECRET:
+        headers["X-Frontend-Secret"] = FRONTEND_SECRET
+    return headers
+
+
+def show_trace_id(response):
+    """Show the request's trace id so a failure can be found in the trace export"""
+    parts = (response.headers.get("traceparent") or response.request.headers.get("traceparent") or "").split("-")
+    if len(parts) == 4:
+        st.caption(f"Trace ID: {parts[1]}")
+
+
+def wait_for_report_job(job_id, poll_seconds=1.0):
+    """Poll a background report job, showing its stage, until it finishes"""
+    progress = st.progress(0.0, text="Queued")
+    while True:
+        response = requests.get(f"{API_BASE_URL}/jobs/{job_id}", timeout=10)
+        if response.status_code != 200:
+            return response
+        job = response.json()
+        progress.progress(job["progress"], text=f"Stage: {job['stage']}")
+        if job["status"] in ("done", "failed"):
+            progress.empty()
+            return response
+        time.sleep(poll_seconds)
+
+def start_conversation():
+    """Create a server-side conversation and return its session_id"""
+    response = requests.post(f"{API_BASE_URL}/sessions", timeout=10)
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+
+def end_conversation():
+    """Forget the current conversation on the server, if any"""
+    session_id = st.session_state.pop("conversation_id", None)
+    if session_id:
+        try:
+            requests.delete(f"{API_BASE_URL}/sessions/{session_id}", timeout=5)
+        except requests.exceptions.RequestException:
+            pass
 
 st.set_page_config(page_title="AutoMedRAG", layout="wide", initial_sidebar_state="expanded")
 
@@ -51,6 +113,7 @@ with st.sidebar:
     # Clear chat history button
     if st.button("🗑️ Clear Chat History", use_container_width=True):
         st.session_state.messages = []
+        end_conversation()
         st.rerun()
     
     # Clear research results button
@@ -79,9 +142,9 @@ with st.sidebar:
     - Data Source: PubMed API
     """)
 
-# Initialize session state for report text
-if "report_text" not in st.session_state:
-    st.session_state.report_text = ""
+# Initialize session state for the uploaded report's server-side id
+if "report_id" not in st.session_state:
+    st.session_state.report_id = ""
 
 # Main interface
 st.title("🏥 AutoMedRAG")
@@ -122,6 +185,9 @@ if st.session_state.messages:
                         except Exception as e:
                             st.error(f"Could not generate speech: {e}")
                 
+                if message.get("degradations"):
+                    st.caption("⚡ Shortened to answer in time: " + ", ".join(message["degradations"]))
+
                 if message.get("papers"):
                     with st.expander(f"📚 Papers ({len(message['papers'])} found)"):
                         for paper_idx, paper in enumerate(message["papers"], 1):
@@ -193,26 +259,27 @@ with tab1:
     if search_button and use_text_query:
         with st.spinner("🔄 Searching medical literature..."):
             try:
-                # Build history for context
-                history = []
-                for msg in st.session_state.messages:
-                    history.append({
-                        "role": msg["role"],
-                        "content": msg["content"] if msg["role"] == "user" else msg["answer"]
-                    })
-                
-                # Send query with history FOR CONVERSATIONAL
+                # The server keeps the conversation history for this session
+                if "conversation_id" not in st.session_state:
+                    st.session_state.conversation_id = start_conversation()
                 payload = {
                     "question": use_text_query,
-                    "history": history
+                    "session_id": st.session_state.conversation_id
                 }
                 
                 response = requests.post(
                     api_url,
                     json=payload,
-                    timeout=60
+                    headers=traced(ASK_HEADERS),
+                    timeout=ASK_TIMEOUT
                 )
 
+                # Expired conversation: continue in a new one
+                if response.status_code == 404:
+                    st.session_state.conversation_id = start_conversation()
+                    payload["session_id"] = st.session_state.conversation_id
+                    response = requests.post(api_url, json=payload, headers=traced(ASK_HEADERS), timeout=ASK_TIMEOUT)
+
                 if response.status_code == 200:
                     data = response.json()
                     
@@ -225,7 +292,8 @@ with tab1:
                     st.session_state.messages.append({
                         "role": "assistant",
                         "answer": data["answer"],
-                        "papers": data.get("papers", [])
+                        "papers": data.get("papers", []),
+                        "degradations": data.get("degradations") or []
                     })
                     
                     # Clear input and rerun to show new messages
@@ -234,6 +302,7 @@ with tab1:
                 else:
                     st.error(f"❌ API Error {response.status_code}")
                     st.code(response.text)
+                    show_trace_id(response)
 
             except requests.exceptions.ConnectionError:
                 st.error("❌ Cannot connect to backend API")
@@ -273,6 +342,8 @@ with tab2:
     col1, col2 = st.columns([1, 4])
     with col1:
         quick_search_button = st.button("🔍 Search", use_container_width=True, key="search_quick")
+    with col2:
+        fast_answer = st.checkbox("⚡ Fast answer (quoted sentences, no LLM)", value=False, key="fast_quick")
 
     if quick_search_button and quick_query:
         with st.spinner("🔄 Searching medical literature..."):
@@ -280,13 +351,15 @@ with tab2:
                 # Send query WITHOUT history for independent research
                 payload = {
                     "question": quick_query,
-                    "history": []  # NO HISTORY - independent search
+                    "history": [],  # NO HISTORY - independent search
+                    "mode": "fast" if fast_answer else "llm"
                 }
                 
                 response = requests.post(
                     api_url,
                     json=payload,
-                    timeout=60
+                    headers=traced(ASK_HEADERS),
+                    timeout=ASK_TIMEOUT
                 )
 
                 if response.status_code == 200:
@@ -304,6 +377,7 @@ with tab2:
                 else:
                     st.error(f"❌ API Error {response.status_code}")
                     st.code(response.text)
+                    show_trace_id(response)
 
             except requests.exceptions.ConnectionError:
                 st.error("❌ Cannot connect to backend API")
@@ -333,24 +407,20 @@ if uploaded_file is not None:
             files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
             
             response = requests.post(
-                f"{API_BASE_URL}/summarize-report",
+                f"{API_BASE_URL}/jobs/summarize-report",
                 files=files,
+                headers=traced(),
                 timeout=60
             )
+            if response.status_code == 200 and "job_id" in response.json():
+                # The report is processed in the background; poll until it finishes
+                response = wait_for_report_job(response.json()["job_id"])
             
-            if response.status_code == 200:
-                result = response.json()
+            if response.status_code == 200 and response.json().get("status") == "done":
+                result = response.json()["result"]
                 
-                # Store the actual extracted report text from backend response
-                if result.get("report_text"):
-                    st.session_state.report_text = result["report_text"]
-                else:
-                    # Fallback for older versions
-                    file_content = uploaded_file.read()
-                    if uploaded_file.name.endswith('.txt'):
-                        st.session_state.report_text = file_content.decode('utf-8', errors='ignore')
-                    else:
-                        st.session_state.report_text = "[Binary file]"
+                # The backend keeps the parsed report; follow-ups only send this id
+                st.session_state.report_id = result.get("report_id", "")
                 
                 st.success("✅ Report Analyzed Successfully!")
                 
@@ -406,6 +476,7 @@ if uploaded_file is not None:
             else:
                 st.error(f"❌ Error analyzing report: {response.status_code}")
                 st.code(response.text)
+                show_trace_id(response)
         
         except requests.exceptions.ConnectionError:
             st.error("❌ Cannot connect to backend API")